@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import InputData as D
+import MarkovClasses as Cls
+import ParameterClasses as P
+
+POP_SIZES = [1000, 10000, 100000, 1000000]  # population sizes to benchmark
+MAX_OBJECT_POP_SIZE = 10000     # largest population simulated one patient at a time (Patient.simulate)
+MAX_REPORT_POP_SIZE = 100000    # largest population passed to Support.report_CEA_CBA
+N_REPEATS = 3                   # each stage is timed this many times and the fastest time is reported
+REGRESSION_THRESHOLD = 0.2      # fail the regression check if throughput drops by more than this fraction
+BASELINE_FILE_NAME = 'BenchmarkBaseline.json'
+STARTUP_MODULES = ['MarkovClasses']     # modules whose import time is measured in a fresh interpreter
+PLOTTING_MODULES = ['matplotlib']       # modules that the startup modules should not load
+
+# example inputs with age-dependent mortality and stroke rates (1-year age bands, Gompertz-like growth)
+# and starting ages spread over 50-80 years, to compare with the speed of the constant-rate model
+AGE_DEPENDENT_INPUTS = {
+    'ANNUAL_PROB_ALL_CAUSE_MORT_BY_AGE': [[age, min(0.5, 0.005 * np.exp(0.09 * (age - 50)))] for age in range(50, 101)],
+    'ANNUAL_PROB_FIRST_STROKE_BY_AGE': [[age, min(0.2, 0.005 * np.exp(0.05 * (age - 50)))] for age in range(50, 101)],
+    'STARTING_AGE_DIST': [[age, 1] for age in range(50, 81)],
+}
+
+
+def simulate_patients(pop_size, therapy):
+    """ simulates patients one at a time with Patient.simulate
+    :return: number of events simulated
+    """
+
+    params = P.Parameters(therapy=therapy)
+    n_events = 0
+    for i in range(pop_size):
+        patient = Cls.Patient(id=therapy.value * pop_size + i, parameters=params)
+        patient.simulate(sim_length=D.SIM_LENGTH)
+        n_events += patient.stateMonitor.nEvents
+    return n_events
+
+
+def simulate_cohort(pop_size, therapy, inputs=None):
+    """ simulates a cohort with Cohort.simulate using the vectorized engine
+    :param inputs: (dictionary) model inputs to use instead of the values in InputData
+    :return: the simulated cohort
+    """
+
+    cohort = Cls.Cohort(id=therapy.value, pop_size=pop_size, parameters=P.Parameters(therapy=therapy, inputs=inputs))
+    cohort.simulate(sim_length=D.SIM_LENGTH, engine='vectorized')
+    return cohort
+
+
+def report_CEA_CBA(cohorts):
+    """ runs Support.report_CEA_CBA in a temporary directory without showing figures """
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    import Support
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            Support.report_CEA_CBA(sim_outcomes_none=cohorts[P.Therapies.NONE].cohortOutcomes,
+                                   sim_outcomes_anti=cohorts[P.Therapies.ANTICOAG].cohortOutcomes)
+        finally:
+            os.chdir(cwd)
+            plt.close('all')
+
+
+def measure_import(module, n_repeats=N_REPEATS):
+    """ imports a module in a fresh interpreter (as a worker process or a short command-line run does)
+    :param module: name of the module
+    :param n_repeats: number of timed imports (the fastest is reported to reduce noise)
+    :return: (seconds, True if the import loaded any of PLOTTING_MODULES)
+    """
+
+    code = ('import sys, time\n'
+            'start = time.perf_counter()\n'
+            'import {}\n'
+            'print(time.perf_counter() - start, any(m in sys.modules for m in {!r}))').format(module, PLOTTING_MODULES)
+
+    seconds = float('inf')
+    for _ in range(n_repeats):
+        output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.split()
+        seconds = min(seconds, float(output[0]))
+
+    return seconds, output[1] == 'True'
+
+
+def measure(func, if_measure_memory, n_repeats=N_REPEATS):
+    """ calls func and measures its wall-clock time and, optionally, its peak memory
+    (the memory is measured in a separate call so that tracing does not slow down the timed calls)
+    :param n_repeats: number of timed calls (the fastest is reported to reduce noise)
+    :return: (value returned by func, seconds, peak memory in MB or None)
+    """
+
+    seconds = float('inf')
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        result = func()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    peak_memory = None
+    if if_measure_memory:
+        tracemalloc.start()
+        func()
+        peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    return result, seconds, peak_memory
+
+
+def get_record(stage, therapy, pop_size, seconds, peak_memory, n_events=None):
+    """
+    :return: (dictionary) benchmark results of a stage
+    """
+
+    return {'stage': stage,
+            'therapy': therapy,
+            'pop_size': pop_size,
+            'seconds': seconds,
+            'patients_per_second': pop_size / seconds,
+            'events_per_second': None if n_events is None else n_events / seconds,
+            'peak_memory_mb': peak_memory}
+
+
+def run_startup_benchmarks(n_repeats=N_REPEATS):
+    """ times the import of each of STARTUP_MODULES
+    :return: (list) one dictionary of results per module (with N = 1, so patients/s is imports/s)
+    """
+
+    records = []
+    for module in STARTUP_MODULES:
+        seconds, if_loads_plotting = measure_import(module=module, n_repeats=n_repeats)
+        record = get_record('import ' + module, 'ALL', 1, seconds, None)
+        record['loads_plotting_modules'] = if_loads_plotting
+        records.append(record)
+    return records
+
+
+def run_benchmarks(pop_sizes, if_measure_memory=True, n_repeats=N_REPEATS):
+    """ times the startup and every stage of the simulation and reporting pipeline at each population size
+    :param pop_sizes: population sizes to benchmark
+    :param if_measure_memory: set to True to measure the peak memory of each stage
+    :param n_repeats: number of times each stage is timed
+    :return: (list) one dictionary of results per stage, therapy and population size
+    """
+
+    records = run_startup_benchmarks(n_repeats=n_repeats)
+    for pop_size in pop_sizes:
+        cohorts = {}
+        for therapy in P.Therapies:
+
+            if pop_size <= MAX_OBJECT_POP_SIZE:
+                n_events, seconds, peak_memory = measure(
+                    lambda: simulate_patients(pop_size=pop_size, therapy=therapy), if_measure_memory, n_repeats)
+                records.append(get_record('Patient.simulate', therapy.name, pop_size,
+                                          seconds, peak_memory, n_events))
+
+            cohort, seconds, peak_memory = measure(
+                lambda: simulate_cohort(pop_size=pop_size, therapy=therapy), if_measure_memory, n_repeats)
+            records.append(get_record('Cohort.simulate', therapy.name, pop_size,
+                                      seconds, peak_memory, cohort.cohortOutcomes.nEvents))
+            cohorts[therapy] = cohort
+
+            age_cohort, seconds, peak_memory = measure(
+                lambda: simulate_cohort(pop_size=pop_size, therapy=therapy, inputs=AGE_DEPENDENT_INPUTS),
+                if_measure_memory, n_repeats)
+            records.append(get_record('Cohort.simulate (age-dependent rates)', therapy.name, pop_size,
+                                      seconds, peak_memory, age_cohort.cohortOutcomes.nEvents))
+
+            _, seconds, peak_memory = measure(
+                lambda: cohort.cohortOutcomes.calculate_cohort_outcomes(initial_pop_size=pop_size),
+                if_measure_memory, n_repeats)
+            records.append(get_record('CohortOutcomes.calculate_cohort_outcomes', therapy.name, pop_size,
+                                      seconds, peak_memory))
+
+        if pop_size <= MAX_REPORT_POP_SIZE:
+            _, seconds, peak_memory = measure(
+                lambda: report_CEA_CBA(cohorts=cohorts), if_measure_memory, n_repeats)
+            records.append(get_record('Support.report_CEA_CBA', 'ALL', pop_size, seconds, peak_memory))
+
+    return records
+
+
+def print_records(records):
+
+    print('{:<42} {:>8} {:>8} {:>9} {:>12} {:>12} {:>10}'.format(
+        'stage', 'therapy', 'N', 'time (s)', 'patients/s', 'events/s', 'peak (MB)'))
+    for r in records:
+        print('{:<42} {:>8} {:>8} {:>9.3f} {:>12,.0f} {:>12} {:>10}'.format(
+            r['stage'], r['therapy'], r['pop_size'], r['seconds'], r['patients_per_second'],
+            '' if r['events_per_second'] is None else '{:,.0f}'.format(r['events_per_second']),
+            '' if r['peak_memory_mb'] is None else '{:.1f}'.format(r['peak_memory_mb'])))
+
+
+def save_baseline(records, file_name):
+    """ saves the benchmark results (and the environment they were obtained in) in a JSON file """
+
+    baseline = {'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'processor': platform.processor(),
+                'records': records}
+    with open(file_name, 'w') as file:
+        json.dump(baseline, file, indent=2)
+
+
+def check_regressions(records, file_name, threshold=REGRESSION_THRESHOLD):
+    """ compares the throughput of each stage with the baseline saved in a JSON file
+    :param records: benchmark results
+    :param file_name: name of the JSON file storing the baseline
+    :param threshold: largest acceptable drop in patients/second (as a fraction of the baseline)
+    :return: (list) descriptions of stages whose throughput dropped by more than the threshold
+    """
+
+    with open(file_name) as file:
+        baseline = {(r['stage'], r['therapy'], r['pop_size']): r for r in json.load(file)['records']}
+
+    regressions = []
+    for r in records:
+        if r.get('loads_plotting_modules'):
+            regressions.append('{} loads {}'.format(r['stage'], ', '.join(PLOTTING_MODULES)))
+        base = baseline.get((r['stage'], r['therapy'], r['pop_size']))
+        if base is None:
+            continue
+        ratio = r['patients_per_second'] / base['patients_per_second']
+        if ratio < 1 - threshold:
+            regressions.append('{} ({}, N={}): {:,.0f} patients/s vs. baseline {:,.0f} ({:.0%})'.format(
+                r['stage'], r['therapy'], r['pop_size'],
+                r['patients_per_second'], base['patients_per_second'], ratio - 1))
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks the simulation and reporting pipeline.')
+    parser.add_argument('--pop-sizes', type=int, nargs='*', default=POP_SIZES,
+                        help='population sizes to benchmark (none to only time the startup)')
+    parser.add_argument('--repeats', type=int, default=N_REPEATS)
+    parser.add_argument('--no-memory', action='store_true', help='do not measure peak memory')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='save the results as the baseline in ' + BASELINE_FILE_NAME)
+    parser.add_argument('--check', action='store_true',
+                        help='fail if throughput dropped compared to the baseline in ' + BASELINE_FILE_NAME)
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    results = run_benchmarks(pop_sizes=args.pop_sizes, if_measure_memory=not args.no_memory,
+                             n_repeats=args.repeats)
+    print_records(results)
+
+    if args.save_baseline:
+        save_baseline(records=results, file_name=BASELINE_FILE_NAME)
+        print('Baseline saved in', BASELINE_FILE_NAME)
+
+    if args.check:
+        found_regressions = check_regressions(records=results, file_name=BASELINE_FILE_NAME,
+                                              threshold=args.threshold)
+        for regression in found_regressions:
+            print('Regression:', regression)
+        if len(found_regressions) > 0:
+            sys.exit(1)
+        print('No regression larger than {:.0%} compared to the baseline.'.format(args.threshold))
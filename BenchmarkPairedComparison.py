@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+
+import InputData as D
+import MarkovClasses as Cls
+import ParameterClasses as P
+
+POP_SIZES = [1000, 10000, 100000]   # population sizes to compare
+WTP = 30000                         # willingness-to-pay per QALY for the incremental net monetary benefit
+N_BOOTSTRAP_SAMPLES = 200           # number of bootstrap samples for the ICER confidence interval
+
+
+def simulate_arms(pop_size, crn_seed):
+    """
+    :return: (costs, utilities) arrays with one row per patient and one column per therapy
+    """
+
+    cohorts = [Cls.Cohort(id=therapy.value,
+                          pop_size=pop_size,
+                          parameters=P.Parameters(therapy=therapy),
+                          crn_seed=crn_seed)
+               for therapy in P.Therapies]
+    Cls.simulate_cohorts(cohorts=cohorts, sim_length=D.SIM_LENGTH, engine='vectorized')
+
+    costs = np.column_stack([cohort.cohortOutcomes.costs for cohort in cohorts])
+    utilities = np.column_stack([cohort.cohortOutcomes.utilities for cohort in cohorts])
+    return costs, utilities
+
+
+def get_half_width(diffs_var, n):
+    """ half-width of the normal-approximation 95% confidence interval of a mean difference """
+    return 1.96 * np.sqrt(diffs_var / n)
+
+
+def get_icer_CI_width(costs, utilities, if_paired, rng):
+    """ width of the 95% bootstrap percentile interval of the ICER """
+
+    n = len(costs)
+    idx_anti = rng.randint(0, n, size=(N_BOOTSTRAP_SAMPLES, n))
+    # paired samples resample patients; independent samples resample each arm separately
+    idx_none = idx_anti if if_paired else rng.randint(0, n, size=(N_BOOTSTRAP_SAMPLES, n))
+
+    d_cost = costs[idx_anti, 1].mean(axis=1) - costs[idx_none, 0].mean(axis=1)
+    d_effect = utilities[idx_anti, 1].mean(axis=1) - utilities[idx_none, 0].mean(axis=1)
+    lower, upper = np.percentile(d_cost / d_effect, [2.5, 97.5])
+    return upper - lower
+
+
+if __name__ == '__main__':
+
+    rng = np.random.RandomState(seed=1)
+
+    print('{:>8} {:>12} {:>8} {:>14} {:>14} {:>14} {:>14}'.format(
+        'N', 'mode', 'CPU (s)', 'HW dCost', 'HW dQALY', 'HW dNMB', 'ICER CI width'))
+
+    for pop_size in POP_SIZES:
+        variances = {}
+        for mode, crn_seed in (('independent', None), ('paired', 0)):
+
+            start = time.process_time()
+            costs, utilities = simulate_arms(pop_size=pop_size, crn_seed=crn_seed)
+            cpu_time = time.process_time() - start
+
+            if mode == 'paired':
+                # variance of patient-level differences
+                var_cost = np.var(costs[:, 1] - costs[:, 0], ddof=1)
+                var_effect = np.var(utilities[:, 1] - utilities[:, 0], ddof=1)
+                nmb = WTP * utilities - costs
+                var_nmb = np.var(nmb[:, 1] - nmb[:, 0], ddof=1)
+            else:
+                # for independent samples, var(x - y) = var(x) + var(y)
+                var_cost = np.var(costs, axis=0, ddof=1).sum()
+                var_effect = np.var(utilities, axis=0, ddof=1).sum()
+                var_nmb = np.var(WTP * utilities - costs, axis=0, ddof=1).sum()
+            variances[mode] = (var_cost, var_effect, var_nmb)
+
+            print('{:>8} {:>12} {:>8.2f} {:>14.2f} {:>14.4f} {:>14.2f} {:>14.2f}'.format(
+                pop_size, mode, cpu_time,
+                get_half_width(var_cost, pop_size),
+                get_half_width(var_effect, pop_size),
+                get_half_width(var_nmb, pop_size),
+                get_icer_CI_width(costs, utilities, if_paired=(mode == 'paired'), rng=rng)))
+
+        # the variance ratio is the factor by which common random numbers reduce
+        # the number of patients needed for the same confidence interval width
+        ratios = np.array(variances['independent']) / np.array(variances['paired'])
+        print('{:>8} {:>12} {:>8} {:>14.1f}x {:>13.1f}x {:>13.1f}x'.format(
+            '', 'var. ratio', '', ratios[0], ratios[1], ratios[2]))
@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+
+import CEAClasses as CEA
+import InputData as D
+import MarkovClasses as Cls
+import ParameterClasses as P
+from RandomStreams import SAMPLING_SCHEMES
+
+POP_SIZES = [4096, 32768, 262144]   # population sizes to compare (multiples of RandomStreams.QMC_GROUP_SIZE)
+WTP = 30000                         # willingness-to-pay per QALY for the incremental net monetary benefit
+N_REPEATS = 3                       # each run is timed this many times and the fastest CPU time is reported
+
+
+def simulate_arms(pop_size, sampling):
+    """
+    :return: (cohorts, cpu_time) cohorts simulated under each therapy and the CPU time it took
+    """
+
+    cpu_times = []
+    for _ in range(N_REPEATS):
+        start = time.process_time()
+        cohorts = [Cls.Cohort(id=therapy.value,
+                              pop_size=pop_size,
+                              parameters=P.Parameters(therapy=therapy),
+                              sampling=sampling)
+                   for therapy in P.Therapies]
+        Cls.simulate_cohorts(cohorts=cohorts, sim_length=D.SIM_LENGTH, engine='vectorized')
+        cpu_times.append(time.process_time() - start)
+    return cohorts, min(cpu_times)
+
+
+def get_half_widths(cohorts):
+    """
+    :return: half-widths of the normal-approximation 95% confidence intervals of the mean cost and QALY of
+        the first cohort and of the increase in mean cost, QALY and net monetary benefit under the second cohort
+        (the intervals treat groups of dependent patients, e.g. antithetic pairs, as independent observations)
+    """
+
+    strategies = [CEA.Strategy(name=cohort.params.therapy.name,
+                               costs=cohort.cohortOutcomes.costs,
+                               effects=cohort.cohortOutcomes.utilities,
+                               group_size=cohort.cohortOutcomes.groupSize)
+                  for cohort in cohorts]
+    # the arms are simulated independently, so the covariance of the difference is the sum of covariances
+    cov_none = strategies[0].meanCov
+    cov_diff = strategies[0].meanCov + strategies[1].meanCov
+    nmb = np.array([-1, WTP])
+
+    return 1.96 * np.sqrt([cov_none[0, 0], cov_none[1, 1], cov_diff[0, 0], cov_diff[1, 1], nmb @ cov_diff @ nmb])
+
+
+if __name__ == '__main__':
+
+    print('{:>8} {:>11} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'N', 'sampling', 'CPU (s)', 'HW Cost', 'HW QALY', 'HW dCost', 'HW dQALY', 'HW dNMB', 'efficiency'))
+
+    for pop_size in POP_SIZES:
+        reference = None
+        for sampling in SAMPLING_SCHEMES:
+            cohorts, cpu_time = simulate_arms(pop_size=pop_size, sampling=sampling)
+            half_widths = np.array(get_half_widths(cohorts))
+
+            # efficiency relative to independent sampling: the ratio of (variance x CPU time) of the incremental
+            # net monetary benefit, i.e. how many times less CPU time the scheme needs for the same half-width
+            work = half_widths[4] ** 2 * cpu_time
+            if reference is None:
+                reference = work
+
+            print('{:>8} {:>11} {:>8.2f} {:>10.2f} {:>10.4f} {:>10.2f} {:>10.4f} {:>10.2f} {:>11.1f}x'.format(
+                pop_size, sampling, cpu_time, *half_widths, reference / work))
@@ -0,0 +1,495 @@
+import math
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.stats import t
+
+# deampy and matplotlib are imported in the methods that write tables and draw figures
+# because importing them takes longer than the analysis of most cohorts
+
+N_BOOTSTRAP_SAMPLES = 1000  # number of bootstrap samples for the confidence intervals of ICERs and NMBs
+BOOTSTRAP_CHUNK_SIZE = 20   # number of bootstrap samples drawn by a thread at a time
+N_WTP_VALUES = 200          # number of willingness-to-pay values in the net monetary benefit analysis
+
+
+class Strategy:
+    def __init__(self, name, costs, effects, color=None, group_size=1):
+        """ a strategy whose cost and effect observations are kept as numpy arrays
+        :param name: name of the strategy
+        :param costs: (list or numpy.array) cost observations
+        :param effects: (list or numpy.array) effect observations
+        :param color: (string) color code
+        :param group_size: number of consecutive observations that are dependent (e.g. 2 for antithetic pairs
+            of patients); confidence intervals treat these groups, not observations, as independent units
+        """
+
+        if len(costs) != len(effects):
+            raise ValueError('Strategy ' + name + ' should have the same number of cost and effect observations.')
+
+        self.name = name
+        self.color = color
+        # one row per observation; columns are cost and effect
+        self.observations = np.column_stack((np.asarray(costs, dtype=float), np.asarray(effects, dtype=float)))
+        self.n = len(self.observations)
+        self.means = self.observations.mean(axis=0)
+
+        # total cost and effect and number of observations of each independent unit
+        self.groupSize = group_size
+        if group_size == 1:
+            self.unitTotals = self.observations
+            self.unitSizes = np.ones(self.n)
+        else:
+            units = np.arange(self.n) // group_size
+            self.unitTotals = np.column_stack([np.bincount(units, weights=column) for column in self.observations.T])
+            self.unitSizes = np.bincount(units).astype(float)
+        self.nUnits = len(self.unitSizes)
+        # deviations of unit totals from their expected values under the means
+        # (with one observation per unit, the deviations of observations from the means)
+        self.residuals = self.unitTotals - self.unitSizes[:, None] * self.means
+        # covariance matrix of the mean cost and effect
+        self.meanCov = self.residuals.T @ self.residuals / (self.nUnits - 1) * self.nUnits / self.n ** 2
+
+    def get_cost(self):
+        return self.means[0]
+
+    def get_effect(self):
+        return self.means[1]
+
+
+class _EconEval:
+    def __init__(self, strategies, if_paired, n_bootstrap_samples=N_BOOTSTRAP_SAMPLES, seed=1, n_threads=None):
+        """ base class of the cost-effectiveness and cost-benefit analyses
+        (the first strategy is the base strategy)
+        :param strategies: (list) of Strategy objects
+        :param if_paired: set to True if observation i of all strategies belongs to the same patient
+        :param n_bootstrap_samples: number of bootstrap samples
+        :param seed: seed of the bootstrap samples (the samples do not depend on the number of threads)
+        :param n_threads: number of threads to draw bootstrap samples with (if None, the number of CPUs)
+        """
+
+        if if_paired and len(set((s.n, s.groupSize) for s in strategies)) > 1:
+            raise ValueError('Paired strategies should have the same number of observations and group size.')
+
+        self.strategies = strategies
+        self.ifPaired = if_paired
+        self.nBootstrapSamples = n_bootstrap_samples
+        self.seed = seed
+        self.nThreads = os.cpu_count() if n_threads is None else n_threads
+        self._bootstrapMeans = None
+
+    def get_bootstrap_means(self):
+        """
+        :return: (numpy.array) mean cost and effect of each strategy in each bootstrap sample
+            with shape (n_bootstrap_samples, n_strategies, 2)
+        """
+
+        if self._bootstrapMeans is None:
+            # each chunk of bootstrap samples has its own seed so that threads can draw them in any order
+            sizes = [min(BOOTSTRAP_CHUNK_SIZE, self.nBootstrapSamples - first)
+                     for first in range(0, self.nBootstrapSamples, BOOTSTRAP_CHUNK_SIZE)]
+            seeds = np.random.SeedSequence(self.seed).spawn(len(sizes))
+            with ThreadPoolExecutor(max_workers=self.nThreads) as executor:
+                chunks = list(executor.map(self._get_bootstrap_means_of_chunk, seeds, sizes))
+            self._bootstrapMeans = np.concatenate(chunks)
+
+        return self._bootstrapMeans
+
+    def _get_bootstrap_means_of_chunk(self, seed, size):
+        """
+        :param seed: (numpy.random.SeedSequence) seed of this chunk
+        :param size: number of bootstrap samples in this chunk
+        :return: (numpy.array) mean cost and effect of each strategy with shape (size, n_strategies, 2)
+        """
+
+        rng = np.random.default_rng(seed)
+        if self.ifPaired:
+            # patients (or groups of patients) are resampled together across strategies
+            unit_totals = np.hstack([s.unitTotals for s in self.strategies])
+            means = _get_resampled_means(unit_totals=unit_totals, unit_sizes=self.strategies[0].unitSizes,
+                                         size=size, rng=rng)
+            return means.reshape((size, len(self.strategies), 2))
+        else:
+            # observations of each strategy are resampled independently
+            return np.stack([_get_resampled_means(unit_totals=s.unitTotals, unit_sizes=s.unitSizes,
+                                                  size=size, rng=rng)
+                             for s in self.strategies], axis=1)
+
+    def _get_difference_moments(self, strategy, strategy_ref):
+        """
+        :return: (mean, components) where mean is the mean cost and effect of strategy minus those of strategy_ref
+            and components is a list of (covariance matrix, degrees of freedom) of independent terms
+            whose sum is the covariance matrix of mean
+        """
+
+        mean = strategy.means - strategy_ref.means
+        if strategy is strategy_ref:
+            return mean, []
+        elif self.ifPaired:
+            cov = strategy.meanCov + strategy_ref.meanCov - _get_cross_cov(strategy, strategy_ref)
+            return mean, [(cov, strategy.nUnits - 1)]
+        else:
+            return mean, [(strategy.meanCov, strategy.nUnits - 1),
+                          (strategy_ref.meanCov, strategy_ref.nUnits - 1)]
+
+    def _get_bootstrap_differences(self, strategy, strategy_ref):
+        """
+        :return: (numpy.array) bootstrap mean cost and effect of strategy minus those of strategy_ref
+            with shape (n_bootstrap_samples, 2)
+        """
+        means = self.get_bootstrap_means()
+        return means[:, self.strategies.index(strategy)] - means[:, self.strategies.index(strategy_ref)]
+
+
+class CEA(_EconEval):
+    def __init__(self, strategies, if_paired, n_bootstrap_samples=N_BOOTSTRAP_SAMPLES, seed=1, n_threads=None):
+        """ cost-effectiveness analysis
+        (see _EconEval for the description of parameters)
+        """
+
+        _EconEval.__init__(self, strategies=strategies, if_paired=if_paired,
+                           n_bootstrap_samples=n_bootstrap_samples, seed=seed, n_threads=n_threads)
+        self.frontier = _find_frontier(strategies)
+
+    def get_ICER(self, strategy, strategy_ref, alpha=0.05):
+        """
+        :return: (ICER, [l, u]) incremental cost-effectiveness ratio of strategy with respect to strategy_ref
+            and its bootstrap percentile interval (nan if the ratio is not defined)
+        """
+
+        d_cost, d_effect = strategy.means - strategy_ref.means
+        if not (d_effect > 0 and d_cost >= 0):
+            return math.nan, [math.nan, math.nan]
+
+        d_costs, d_effects = self._get_bootstrap_differences(strategy, strategy_ref).T
+        if np.any(d_effects <= 0):
+            warnings.warn('The confidence interval of the ICER of {} is not computable because the mean '
+                          'incremental effect of a bootstrap sample is not positive.'.format(strategy.name))
+            return d_cost / d_effect, [math.nan, math.nan]
+
+        return d_cost / d_effect, np.percentile(d_costs / d_effects, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+
+    def build_CE_table(self, interval_type='c', alpha=0.05,
+                       cost_digits=0, effect_digits=2, icer_digits=1, file_name='CETable.csv'):
+        """ writes a table with the same columns as deampy's CEA.build_CE_table
+        :param interval_type: (string) the interval of cost and effect estimates
+            'n' for no interval, 'c' for t-based confidence interval,
+            'cb' for bootstrap confidence interval, and 'p' for percentile interval
+            (for ICERs, the bootstrap confidence interval is always reported)
+        :param alpha: significance level
+        :param cost_digits: digits to round cost estimates to
+        :param effect_digits: digits to round effect estimates to
+        :param icer_digits: digits to round ICER estimates to
+        :param file_name: name of the csv file
+        """
+        from deampy.in_out_functions import write_csv
+
+        table = [['Strategy', 'Cost', 'Effect', 'Incremental Cost', 'Incremental Effect',
+                  'ICER (with confidence interval)']]
+
+        for s in sorted(self.strategies, key=lambda s: s.get_cost()):
+            row = [s.name]
+            intervals = self._get_intervals(strategy=s, strategy_ref=None, interval_type=interval_type, alpha=alpha)
+            row.append(_format(s.get_cost(), intervals[0], deci=cost_digits))
+            row.append(_format(s.get_effect(), intervals[1], deci=effect_digits))
+
+            if s in self.frontier[1:]:
+                # incremental outcomes with respect to the previous strategy on the frontier
+                s_before = self.frontier[self.frontier.index(s) - 1]
+                d_cost, d_effect = s.means - s_before.means
+                intervals = self._get_intervals(
+                    strategy=s, strategy_ref=s_before, interval_type=interval_type, alpha=alpha)
+                row.append(_format(d_cost, intervals[0], deci=cost_digits))
+                row.append(_format(d_effect, intervals[1], deci=effect_digits))
+                icer, interval = self.get_ICER(strategy=s, strategy_ref=s_before, alpha=alpha)
+                row.append(_format(icer, interval, deci=icer_digits))
+            else:
+                row.extend(['-', '-', '-' if s in self.frontier else 'Dominated'])
+
+            table.append(row)
+
+        write_csv(rows=table, file_name=file_name)
+
+    def plot_CE_plane(self, title='Cost-Effectiveness Analysis', x_label='Additional Health',
+                      y_label='Additional Cost', x_range=None, y_range=None,
+                      interval_type='c', alpha=0.05, fig_size=(5, 5), file_name=None):
+        """ plots the mean cost and effect of strategies with respect to the base strategy
+        :param interval_type: (string) 'n' for no interval, 'c' for t-based confidence interval,
+            'cb' for bootstrap confidence interval, and 'p' for percentile interval
+        :param file_name: (string) file name to save the figure as (if None, the figure is displayed)
+        """
+        import matplotlib.pyplot as plt
+        from deampy.plots.plot_support import output_figure
+
+        fig, ax = plt.subplots(figsize=fig_size)
+        ax.set_title(title)
+        ax.set_xlabel(x_label)
+        ax.set_ylabel(y_label)
+
+        base = self.strategies[0]
+        for s in self.strategies:
+            d_cost, d_effect = s.means - base.means
+            ax.scatter(d_effect, d_cost, color=s.color, s=75, label=s.name, zorder=2, edgecolors='k')
+
+            intervals = self._get_intervals(strategy=s, strategy_ref=base, interval_type=interval_type, alpha=alpha)
+            if intervals[0] is not None:
+                ax.errorbar(d_effect, d_cost,
+                            xerr=[[d_effect - intervals[1][0]], [intervals[1][1] - d_effect]],
+                            yerr=[[d_cost - intervals[0][0]], [intervals[0][1] - d_cost]],
+                            fmt='none', color=s.color, linewidth=1, alpha=0.5)
+
+        if len(self.frontier) > 1:
+            frontier = np.array([s.means - base.means for s in self.frontier])
+            ax.plot(frontier[:, 1], frontier[:, 0], color='k', alpha=0.6, linewidth=2, zorder=3, label='Frontier')
+
+        ax.legend()
+        ax.set_xlim(x_range)
+        ax.set_ylim(y_range)
+        ax.axhline(y=0, c='k', linestyle='--', linewidth=0.5)
+        ax.axvline(x=0, c='k', linestyle='--', linewidth=0.5)
+
+        output_figure(plt=fig, filename=file_name)
+
+    def _get_intervals(self, strategy, strategy_ref, interval_type, alpha):
+        """
+        :param strategy_ref: reference strategy (None for the outcomes of strategy itself)
+        :return: [cost interval, effect interval] of strategy minus strategy_ref ([None, None] if interval_type is 'n')
+        """
+
+        if interval_type == 'n' or interval_type is None:
+            return [None, None]
+
+        if strategy_ref is None:
+            mean = strategy.means
+            components = [(strategy.meanCov, strategy.nUnits - 1)]
+        else:
+            mean, components = self._get_difference_moments(strategy, strategy_ref)
+
+        if interval_type == 'c':
+            return _get_t_intervals(mean=mean, components=components, coefficients=np.identity(2), alpha=alpha)
+        elif interval_type == 'cb':
+            means = self.get_bootstrap_means()[:, self.strategies.index(strategy)]
+            if strategy_ref is not None:
+                means = means - self.get_bootstrap_means()[:, self.strategies.index(strategy_ref)]
+            return np.percentile(means, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0).T
+        elif interval_type == 'p':
+            if strategy_ref is None:
+                observations = strategy.observations
+            elif self.ifPaired:
+                observations = strategy.observations - strategy_ref.observations
+            else:
+                # as in deampy, the observations of an independent strategy are shifted by the mean of the reference
+                observations = strategy.observations - strategy_ref.means
+            return np.percentile(observations, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0).T
+        else:
+            raise ValueError('Invalid interval type.')
+
+
+class CBA(_EconEval):
+    def __init__(self, strategies, wtp_range, if_paired, n_wtp_values=N_WTP_VALUES,
+                 n_bootstrap_samples=N_BOOTSTRAP_SAMPLES, seed=1, n_threads=None):
+        """ cost-benefit analysis
+        :param wtp_range: ([l, u]) range of willingness-to-pay values
+        :param n_wtp_values: number of willingness-to-pay values in this range
+        (see _EconEval for the description of other parameters)
+        """
+
+        _EconEval.__init__(self, strategies=strategies, if_paired=if_paired,
+                           n_bootstrap_samples=n_bootstrap_samples, seed=seed, n_threads=n_threads)
+        self.wtpValues = np.linspace(wtp_range[0], wtp_range[1], n_wtp_values)
+
+    def get_marginal_nmbs(self, interval_type='c', alpha=0.05):
+        """ marginal net monetary benefit of each strategy with respect to the base strategy
+        at every willingness-to-pay value (calculated from the mean and covariance of cost and effect,
+        so the cost does not grow with the number of observations times the number of willingness-to-pay values)
+        :param interval_type: (string) 'n' for no interval, 'c' for t-based confidence interval,
+            and 'cb' for bootstrap confidence interval
+        :param alpha: significance level
+        :return: (means, intervals) where means has shape (n_wtp_values, n_strategies) and
+            intervals has shape (n_wtp_values, n_strategies, 2) (None if interval_type is 'n')
+        """
+
+        base = self.strategies[0]
+        # coefficients of (cost, effect) in the net monetary benefit (wtp * effect - cost)
+        coefficients = np.column_stack((-np.ones_like(self.wtpValues), self.wtpValues))
+
+        moments = [self._get_difference_moments(s, base) for s in self.strategies]
+        means = coefficients @ np.column_stack([mean for mean, components in moments])
+
+        if interval_type == 'n' or interval_type is None:
+            return means, None
+        elif interval_type == 'c':
+            intervals = np.stack([_get_t_intervals(mean=mean, components=components,
+                                                   coefficients=coefficients, alpha=alpha)
+                                  for mean, components in moments], axis=1)
+        elif interval_type == 'cb':
+            bootstrap_means = self.get_bootstrap_means()
+            differences = bootstrap_means - bootstrap_means[:, :1]
+            # shape (n_bootstrap_samples, n_wtp_values, n_strategies)
+            nmbs = np.einsum('wk,bsk->bws', coefficients, differences)
+            intervals = np.moveaxis(np.percentile(nmbs, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0), 0, -1)
+        else:
+            raise ValueError('Invalid interval type.')
+
+        return means, intervals
+
+    def plot_marginal_nmb_lines(self, title='Marginal Net Monetary Benefit',
+                                x_label='Willingness-To-Pay Threshold', y_label='Marginal Net Monetary Benefit',
+                                interval_type='c', alpha=0.05, show_legend=True, figure_size=(5, 5),
+                                y_range=None, file_name=None):
+        """ plots the marginal net monetary benefit lines of strategies with respect to the base strategy
+        :param interval_type: (string) 'n' for no interval, 'c' for t-based confidence interval,
+            and 'cb' for bootstrap confidence interval
+        :param file_name: (string) file name to save the figure as (if None, the figure is displayed)
+        """
+        import matplotlib.pyplot as plt
+        from deampy.plots.plot_support import output_figure
+
+        means, intervals = self.get_marginal_nmbs(interval_type=interval_type, alpha=alpha)
+
+        fig, ax = plt.subplots(figsize=figure_size)
+        ax.set_title(title)
+        ax.set_xlabel(x_label)
+        ax.set_ylabel(y_label)
+
+        for i, s in enumerate(self.strategies):
+            ax.plot(self.wtpValues, means[:, i], color=s.color, alpha=1, label=s.name)
+            if intervals is not None:
+                ax.fill_between(self.wtpValues, intervals[:, i, 0], intervals[:, i, 1], color=s.color, alpha=0.2)
+        # strategies with the highest expected net monetary benefit
+        ax.plot(self.wtpValues, means.max(axis=1), color='k', alpha=0.6, linewidth=2, label='Frontier')
+
+        if show_legend:
+            ax.legend()
+        ax.set_xlim(self.wtpValues[0], self.wtpValues[-1])
+        ax.set_ylim(y_range)
+        ax.axhline(y=0, c='k', linestyle='--', linewidth=0.5)
+
+        output_figure(plt=fig, filename=file_name)
+
+
+def _get_resampled_means(unit_totals, unit_sizes, size, rng):
+    """
+    :param unit_totals: (numpy.array) one row per independent unit (an observation or a group of observations)
+        with the totals of its observations
+    :param unit_sizes: (numpy.array) number of observations in each unit
+    :param size: number of bootstrap samples
+    :param rng: random number generator
+    :return: (numpy.array) column means of each bootstrap sample of units with shape (size, n_columns)
+    """
+
+    # a bootstrap sample is summarized by how many times it contains each unit,
+    # so the means of all samples in a chunk are a single matrix product
+    # (which releases the GIL and lets threads run in parallel)
+    n = len(unit_totals)
+    counts = np.empty((size, n))
+    for i in range(size):
+        counts[i] = np.bincount(rng.integers(0, n, size=n), minlength=n)
+    return counts @ unit_totals / (counts @ unit_sizes)[:, None]
+
+
+def _get_cross_cov(strategy, strategy_ref):
+    """
+    :return: (numpy.array) cov(x, y_ref) + cov(y_ref, x) for the mean (cost, effect) x and y_ref
+        of two paired strategies
+    """
+
+    cross = strategy.residuals.T @ strategy_ref.residuals / (strategy.nUnits - 1) * strategy.nUnits / strategy.n ** 2
+    return cross + cross.T
+
+
+def _get_t_intervals(mean, components, coefficients, alpha):
+    """ t-based confidence intervals of linear combinations of mean (cost, effect) differences
+    (Welch-Satterthwaite degrees of freedom are used if there is more than one independent component)
+    :param mean: (numpy.array) mean (cost, effect)
+    :param components: (list) of (covariance matrix of mean, degrees of freedom) of independent terms
+    :param coefficients: (numpy.array) coefficients of linear combinations with shape (n_combinations, 2)
+    :param alpha: significance level
+    :return: (numpy.array) intervals with shape (n_combinations, 2)
+    """
+
+    estimates = coefficients @ mean
+    if len(components) == 0:
+        return np.column_stack((estimates, estimates))
+
+    # variance of each linear combination contributed by each component
+    variances = np.array([np.einsum('wi,ij,wj->w', coefficients, cov, coefficients) for cov, df in components])
+    dfs = np.array([df for cov, df in components], dtype=float)
+
+    total = variances.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df = total ** 2 / (variances ** 2 / dfs[:, None]).sum(axis=0)
+    half_lengths = t.ppf(1 - alpha / 2, np.nan_to_num(df, nan=dfs.sum())) * np.sqrt(total)
+
+    return np.column_stack((estimates - half_lengths, estimates + half_lengths))
+
+
+def _find_frontier(strategies):
+    """
+    :return: (list) strategies on the cost-effectiveness frontier in increasing order of cost
+        (strategies that are dominated or extendedly dominated are excluded)
+    """
+
+    frontier = []
+    for s in sorted(strategies, key=lambda s: (s.get_cost(), -s.get_effect())):
+        # strategies that cost more but are not more effective are dominated
+        if len(frontier) > 0 and s.get_effect() <= frontier[-1].get_effect():
+            continue
+        # remove strategies whose ICER is higher than the ICER of the next strategy (extended dominance)
+        while len(frontier) > 1 and _get_ratio(frontier[-1], frontier[-2]) >= _get_ratio(s, frontier[-1]):
+            frontier.pop()
+        frontier.append(s)
+
+    return frontier
+
+
+def _get_ratio(strategy, strategy_ref):
+    d_cost, d_effect = strategy.means - strategy_ref.means
+    return d_cost / d_effect
+
+
+def _format(estimate, interval, deci):
+    """
+    :return: (string) estimate and interval in the form 'estimate (l, u)' as formatted by deampy
+    """
+    import deampy.format_functions as F
+
+    return F.format_estimate_interval(estimate=estimate,
+                                      interval=None if interval is None else list(interval),
+                                      deci=deci, format=',')
+
+
+if __name__ == '__main__':
+
+    # check the estimates against deampy and that bootstrap samples do not depend on the number of threads
+    import deampy.econ_eval as econ
+
+    rng = np.random.RandomState(seed=1)
+    n = 5000
+    costs_base = rng.gamma(shape=2, scale=500, size=n)
+    effects_base = rng.normal(loc=10, scale=2, size=n)
+    costs_new = costs_base + rng.normal(loc=2000, scale=300, size=n)
+    effects_new = effects_base + rng.normal(loc=0.2, scale=0.1, size=n)
+
+    strategies = [Strategy(name='Base', costs=costs_base, effects=effects_base),
+                  Strategy(name='New', costs=costs_new, effects=effects_new)]
+
+    for if_paired in (True, False):
+        cea = CEA(strategies=strategies, if_paired=if_paired, n_threads=1)
+        cba = CBA(strategies=strategies, wtp_range=[0, 50000], if_paired=if_paired, n_threads=4)
+        assert np.array_equal(cea.get_bootstrap_means(), cba.get_bootstrap_means())
+
+        icer = econ.ICER_Paired(costs_new=costs_new, effects_new=effects_new,
+                                costs_base=costs_base, effects_base=effects_base)
+        assert np.isclose(cea.get_ICER(strategies[1], strategies[0])[0], icer.get_ICER())
+
+        means, t_intervals = cba.get_marginal_nmbs(interval_type='c')
+        means, bootstrap_intervals = cba.get_marginal_nmbs(interval_type='cb')
+        nmb = econ.MarginalNMB_Paired(costs_new=costs_new, effects_new=effects_new,
+                                      costs_base=costs_base, effects_base=effects_base)
+        assert np.allclose(means[:, 1], [nmb.get_marginal_nmb(wtp) for wtp in cba.wtpValues])
+        # t-based and bootstrap intervals should roughly agree
+        assert np.allclose(t_intervals, bootstrap_intervals, rtol=0.05, atol=50)
+
+    print('CEA and CBA estimates agree with deampy.')
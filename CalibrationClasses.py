@@ -0,0 +1,370 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import InputData as D
+import MarkovClasses as Cls
+import ParameterClasses as P
+from ExpectedClasses import ExpectedCohortOutcomes
+from PSAClasses import get_input_label, get_inputs_from_draw
+from ResultCache import get_parameters_description
+
+OUTCOMES = ('survival_probability', 'mean_survival_time', 'restricted_mean_survival_time', 'n_strokes')
+EVALUATORS = ('expected', 'simulation')
+EXPECTED_TIME_STEP = 0.1    # distance between the time points of the survival curve of the expected evaluator
+ELITE_FRACTION = 0.1        # fraction of the best candidates evaluated so far that new candidates are drawn around
+
+
+class CalibrationTarget:
+    def __init__(self, outcome, value, tolerance, therapy=P.Therapies.NONE, time=None):
+        """ a target statistic of a cohort that calibrated inputs should reproduce
+        :param outcome: 'survival_probability' (proportion of patients alive at 'time'),
+            'mean_survival_time' (of patients who die before the end of the simulation),
+            'restricted_mean_survival_time' (mean time alive until the end of the simulation)
+            or 'n_strokes' (mean number of strokes per patient)
+        :param value: target value
+        :param tolerance: largest accepted absolute difference between the outcome and the target value
+        :param therapy: therapy of the cohort
+        :param time: time of the survival probability (only used for 'survival_probability')
+        """
+
+        if outcome not in OUTCOMES:
+            raise ValueError('outcome should be one of {}.'.format(', '.join(OUTCOMES)))
+        if (outcome == 'survival_probability') != (time is not None):
+            raise ValueError("time should be provided for 'survival_probability' (and only for it).")
+        if tolerance <= 0:
+            raise ValueError('tolerance should be positive.')
+
+        self.outcome = outcome
+        self.value = value
+        self.tolerance = tolerance
+        self.therapy = therapy
+        self.time = time
+
+    def get_name(self):
+        """
+        :return: (string) description of the targeted outcome (e.g. 'survival_probability at 10 (NONE)')
+        """
+        name = self.outcome if self.time is None else '{} at {:g}'.format(self.outcome, self.time)
+        return '{} ({})'.format(name, self.therapy.name)
+
+    def get_score(self, outcome_value):
+        """
+        :return: distance of the outcome from the target value in units of the tolerance
+            (the outcome is within the tolerance if the score is not larger than 1)
+        """
+        return abs(outcome_value - self.value) / self.tolerance
+
+    def get_expected_value(self, expected_outcomes):
+        """
+        :param expected_outcomes: (ExpectedCohortOutcomes) expected outcomes of the cohort
+        :return: expected value of the targeted outcome
+        """
+
+        if self.outcome == 'survival_probability':
+            return float(np.interp(self.time, expected_outcomes.times, expected_outcomes.survivalProbabilities))
+        elif self.outcome == 'mean_survival_time':
+            return float(expected_outcomes.meanSurvivalTime)
+        elif self.outcome == 'restricted_mean_survival_time':
+            return float(expected_outcomes.restrictedMeanSurvivalTime)
+        else:
+            return float(expected_outcomes.expectedNumStrokes)
+
+    def get_simulated_value(self, cohort_outcomes, pop_size, sim_length):
+        """
+        :param cohort_outcomes: (CohortOutcomes) outcomes of the simulated patients of the cohort
+        :param pop_size: population size of the cohort
+        :param sim_length: simulation length
+        :return: value of the targeted outcome in the simulated cohort
+        """
+
+        survival_times = np.array(cohort_outcomes.survivalTimes, dtype=float)
+        if self.outcome == 'survival_probability':
+            return float(1 - np.count_nonzero(survival_times <= self.time) / pop_size)
+        elif self.outcome == 'mean_survival_time':
+            return float(survival_times.mean()) if len(survival_times) > 0 else np.nan
+        elif self.outcome == 'restricted_mean_survival_time':
+            return float((survival_times.sum() + (pop_size - len(survival_times)) * sim_length) / pop_size)
+        else:
+            return float(np.mean(cohort_outcomes.nTotalStrokes))
+
+
+class CalibrationRunner:
+    def __init__(self, targets, bounds, evaluator='expected', if_confirm=True,
+                 pop_size=D.POP_SIZE, seed=0, sim_length=D.SIM_LENGTH,
+                 batch_size=256, n_rounds=10, n_accepted=20, max_confirmed=50, seed_search=0,
+                 cache_file=None):
+        """ searches for values of model inputs whose outcomes are within the tolerances of all targets
+        (candidates are drawn in batches: the first batch covers the bounds with scrambled Sobol' points and
+        every later batch perturbs the best candidates found so far, until n_accepted candidates are within
+        the tolerances of all targets or n_rounds batches are evaluated)
+        :param targets: (list) of CalibrationTarget objects
+        :param bounds: (dictionary) [lower, upper] bounds of each calibrated input, keyed by the name of the input
+            in InputData, or (name, index) for an element of an input that is a list
+        :param evaluator: 'expected' to score candidates with the expected outcomes calculated from the
+            transition rate matrix (fast, but transition rates should not depend on age) or 'simulation'
+            to score them by simulating cohorts with a fixed seed (so that every candidate is evaluated
+            with the same patients)
+        :param if_confirm: set to True to confirm the candidates accepted by the 'expected' evaluator by simulation
+        :param pop_size: population size of the cohorts simulated to score or confirm candidates
+        :param seed: id of the cohorts simulated to score or confirm candidates (seeds their patients)
+        :param sim_length: simulation length
+        :param batch_size: number of candidates evaluated in each round
+        :param n_rounds: largest number of rounds
+        :param n_accepted: number of accepted candidates after which the search stops
+        :param max_confirmed: largest number of accepted candidates (the best ones) confirmed by simulation
+        :param seed_search: seed of the random number generator of the search
+        :param cache_file: name of a .json file to store the outcomes of evaluated candidates in, so that
+            they are reused by later runs (if None, outcomes are only reused within this run)
+        """
+
+        if evaluator not in EVALUATORS:
+            raise ValueError("evaluator should be either 'expected' or 'simulation'.")
+        for key, (lower, upper) in bounds.items():
+            if not lower < upper:
+                raise ValueError('The lower bound of {} should be smaller than its upper bound.'.format(
+                    get_input_label(key)))
+
+        self.targets = targets
+        self.keys = list(bounds)
+        self.inputLabels = [get_input_label(key) for key in self.keys]
+        self.lowerBounds = np.array([bounds[key][0] for key in self.keys], dtype=float)
+        self.upperBounds = np.array([bounds[key][1] for key in self.keys], dtype=float)
+        self.evaluator = evaluator
+        self.ifConfirm = if_confirm and evaluator == 'expected'
+        self.popSize = pop_size
+        self.seed = seed
+        self.simLength = sim_length
+        self.batchSize = batch_size
+        self.nRounds = n_rounds
+        self.nAccepted = n_accepted
+        self.maxConfirmed = max_confirmed
+        self.seedSearch = seed_search
+        self.cacheFile = cache_file
+
+        self.candidates = np.empty((0, len(self.keys)))  # evaluated candidates (one row per candidate)
+        self.scores = np.empty(0)   # largest score of each candidate across targets
+        self.nRoundsRun = 0
+        self.nConfirmed = 0         # number of candidates simulated to confirm them
+        self.acceptedSets = []      # accepted candidates as dictionaries of 'inputs', 'outcomes' and 'score'
+
+        # outcomes of evaluated candidates keyed by a hash of the candidate and the settings of its evaluation
+        self._cache = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file) as file:
+                self._cache = json.load(file)
+        self._executor = None
+        self._nWorkers = 1
+
+    def run(self, n_workers=1):
+        """ searches for accepted candidates (and confirms them by simulation if required)
+        :param n_workers: number of worker processes that evaluate the candidates of a round
+        :return: (list) accepted candidates as dictionaries of 'inputs' (value of each calibrated input),
+            'outcomes' (value of each targeted outcome) and 'score' (largest score across targets)
+        """
+
+        from scipy.stats import qmc
+
+        rng = np.random.default_rng(self.seedSearch)
+        widths = self.upperBounds - self.lowerBounds
+
+        self._nWorkers = n_workers
+        self._executor = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+        try:
+            for k in range(self.nRounds):
+                if k == 0:
+                    # cover the bounds with scrambled Sobol' points
+                    points = qmc.Sobol(d=len(self.keys), scramble=True, seed=self.seedSearch).random(self.batchSize)
+                    candidates = self.lowerBounds + widths * points
+                else:
+                    # perturb the best candidates evaluated so far (by the spread of these candidates)
+                    n_elite = max(2, int(ELITE_FRACTION * len(self.scores)))
+                    elite = self.candidates[np.argsort(self.scores)[:n_elite]]
+                    st_devs = np.maximum(elite.std(axis=0), 1e-3 * widths)
+                    candidates = elite[rng.integers(n_elite, size=self.batchSize)] \
+                        + rng.normal(size=(self.batchSize, len(self.keys))) * st_devs
+                    candidates = np.clip(candidates, self.lowerBounds, self.upperBounds)
+
+                outcomes = self._evaluate(candidates=candidates, evaluator=self.evaluator)
+                self.candidates = np.vstack((self.candidates, candidates))
+                self.scores = np.append(self.scores, self._get_scores(outcomes))
+                self.nRoundsRun += 1
+
+                if np.count_nonzero(self.scores <= 1) >= self.nAccepted:
+                    break
+
+            # the best accepted candidates
+            order = np.argsort(self.scores)
+            accepted = self.candidates[order[self.scores[order] <= 1][:self.maxConfirmed]]
+            evaluator = self.evaluator
+            if self.ifConfirm:
+                evaluator = 'simulation'
+                self.nConfirmed = len(accepted)
+            outcomes = self._evaluate(candidates=accepted, evaluator=evaluator)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = None
+        self._save_cache()
+
+        scores = self._get_scores(outcomes)
+        self.acceptedSets = [{'inputs': dict(zip(self.inputLabels, candidate.tolist())),
+                              'outcomes': dict(zip([target.get_name() for target in self.targets], values)),
+                              'score': score}
+                             for candidate, values, score in zip(accepted, outcomes, scores) if score <= 1]
+        self.acceptedSets.sort(key=lambda accepted_set: accepted_set['score'])
+
+        return self.acceptedSets
+
+    def get_inputs(self, accepted_set):
+        """
+        :param accepted_set: (dictionary) an element of acceptedSets
+        :return: (dictionary) inputs to pass to ParameterClasses.Parameters
+        """
+        return get_inputs_from_draw(keys=self.keys, values=[accepted_set['inputs'][label]
+                                                            for label in self.inputLabels])
+
+    def _get_scores(self, outcomes):
+        """
+        :param outcomes: (list) value of each targeted outcome for each candidate
+        :return: (numpy.array) largest score of each candidate across targets
+        """
+        return np.array([max(target.get_score(value) for target, value in zip(self.targets, values))
+                         for values in outcomes]).reshape(len(outcomes))
+
+    def _evaluate(self, candidates, evaluator):
+        """
+        :param candidates: (numpy.array) candidates with one row per candidate
+        :param evaluator: 'expected' or 'simulation'
+        :return: (list) value of each targeted outcome for each candidate (from the cache where possible)
+        """
+
+        cache_keys = [self._get_cache_key(candidate=candidate, evaluator=evaluator) for candidate in candidates]
+        new = [i for i, key in enumerate(cache_keys) if key not in self._cache]
+
+        if len(new) > 0:
+            # split the new candidates across worker processes
+            chunks = np.array_split(np.array(new), min(len(new), self._nWorkers))
+            args = [(self.keys, candidates[chunk], self.targets, evaluator, self.popSize, self.seed, self.simLength)
+                    for chunk in chunks]
+            if self._executor is None:
+                chunk_outcomes = [_calculate_outcomes(*chunk_args) for chunk_args in args]
+            else:
+                chunk_outcomes = list(self._executor.map(_calculate_outcomes, *zip(*args)))
+            for chunk, outcomes in zip(chunks, chunk_outcomes):
+                for i, values in zip(chunk, outcomes):
+                    self._cache[cache_keys[i]] = values
+
+        return [self._cache[key] for key in cache_keys]
+
+    def _get_cache_key(self, candidate, evaluator):
+        """
+        :return: (string) hash of the parameters of the candidate (resolved from the calibrated inputs and every
+            other model input in InputData), the targeted outcomes and the settings of its evaluation
+        """
+
+        # parameters of the cohorts of the targets (so that a change to an input that is not calibrated
+        # does not reuse the outcomes of candidates evaluated before)
+        inputs = get_inputs_from_draw(keys=self.keys, values=candidate)
+        therapies = list(dict.fromkeys(target.therapy for target in self.targets))
+        parameters = [get_parameters_description(parameters=P.Parameters(therapy=therapy, inputs=inputs))
+                      for therapy in therapies]
+
+        description = {'parameters': parameters,
+                       'targets': [target.get_name() for target in self.targets],
+                       'evaluator': evaluator,
+                       'sim_length': self.simLength}
+        if evaluator == 'simulation':
+            description.update(pop_size=self.popSize, seed=self.seed, engine_version=Cls.ENGINE_VERSION)
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _save_cache(self):
+        """ saves the outcomes of evaluated candidates in the cache file (if any) """
+
+        if self.cacheFile is None:
+            return
+        temp_file_name = self.cacheFile + '.tmp'
+        with open(temp_file_name, 'w') as file:
+            json.dump(self._cache, file)
+        os.replace(temp_file_name, self.cacheFile)
+
+
+def _calculate_outcomes(keys, candidates, targets, evaluator, pop_size, seed, sim_length):
+    """ calculates the targeted outcomes of candidates (runs in a worker process if n_workers > 1)
+    :return: (list) value of each targeted outcome for each candidate
+    """
+
+    therapies = list(dict.fromkeys(target.therapy for target in targets))
+    outcomes = []
+    for values in candidates:
+        inputs = get_inputs_from_draw(keys=keys, values=values)
+        cohort_outcomes = {}
+        for therapy in therapies:
+            params = P.Parameters(therapy=therapy, inputs=inputs)
+            if evaluator == 'expected':
+                cohort_outcomes[therapy] = ExpectedCohortOutcomes(
+                    parameters=params, pop_size=pop_size, sim_length=sim_length, time_step=EXPECTED_TIME_STEP)
+            else:
+                # every candidate is simulated with the same cohort id (and hence the same patient seeds)
+                cohort = Cls.Cohort(id=seed, pop_size=pop_size, parameters=params)
+                cohort.simulate_patients(sim_length=sim_length, first_index=0, last_index=pop_size,
+                                         cohort_outcomes=cohort.cohortOutcomes, engine='vectorized')
+                cohort_outcomes[therapy] = cohort.cohortOutcomes
+
+        if evaluator == 'expected':
+            outcomes.append([target.get_expected_value(cohort_outcomes[target.therapy]) for target in targets])
+        else:
+            outcomes.append([target.get_simulated_value(cohort_outcomes[target.therapy], pop_size, sim_length)
+                             for target in targets])
+    return outcomes
+
+
+if __name__ == '__main__':
+
+    # check that the calibration recovers inputs whose outcomes match targets generated from known inputs
+    import tempfile
+    import time
+
+    true_inputs = {'ANNUAL_PROB_FIRST_STROKE': 0.02, 'PROB_SURVIVE_FIRST_STROKE': 0.7}
+    params = P.Parameters(therapy=P.Therapies.NONE, inputs=true_inputs)
+    expected = ExpectedCohortOutcomes(parameters=params, pop_size=1, sim_length=D.SIM_LENGTH, time_step=0.1)
+    targets = [CalibrationTarget(outcome='n_strokes', value=expected.expectedNumStrokes, tolerance=0.01),
+               CalibrationTarget(outcome='survival_probability', time=10,
+                                 value=np.interp(10, expected.times, expected.survivalProbabilities),
+                                 tolerance=0.005)]
+    bounds = {'ANNUAL_PROB_FIRST_STROKE': [0.005, 0.04], 'PROB_SURVIVE_FIRST_STROKE': [0.5, 0.9]}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_file = os.path.join(temp_dir, 'cache.json')
+
+        start = time.perf_counter()
+        runner = CalibrationRunner(targets=targets, bounds=bounds, pop_size=20000, cache_file=cache_file)
+        accepted_sets = runner.run()
+        print('{} candidates in {} rounds; {} of {} confirmed by simulation in {:.1f} seconds.'.format(
+            len(runner.scores), runner.nRoundsRun, len(accepted_sets), runner.nConfirmed,
+            time.perf_counter() - start))
+
+        assert len(accepted_sets) > 0
+        for accepted_set in accepted_sets:
+            assert abs(accepted_set['inputs']['ANNUAL_PROB_FIRST_STROKE'] - 0.02) < 0.004
+            assert abs(accepted_set['inputs']['PROB_SURVIVE_FIRST_STROKE'] - 0.7) < 0.08
+
+        # a second run evaluates the same candidates, so every outcome comes from the cache
+        start = time.perf_counter()
+        rerun = CalibrationRunner(targets=targets, bounds=bounds, pop_size=20000, cache_file=cache_file)
+        assert rerun.run() == accepted_sets
+        print('The second run took {:.2f} seconds.'.format(time.perf_counter() - start))
+
+        # outcomes evaluated with other values of the inputs that are not calibrated are not reused
+        all_cause_mortality = D.ANNUAL_PROB_ALL_CAUSE_MORT
+        D.ANNUAL_PROB_ALL_CAUSE_MORT = 0.2
+        changed = CalibrationRunner(targets=targets, bounds=bounds, pop_size=20000, cache_file=cache_file,
+                                    n_rounds=1)
+        changed.run()
+        D.ANNUAL_PROB_ALL_CAUSE_MORT = all_cause_mortality
+        assert min(changed.scores) > 5, min(changed.scores)
+
+    print('Accepted inputs are close to the inputs that generated the targets.')
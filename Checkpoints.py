@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+
+def save_checkpoint(file_name, metadata, arrays):
+    """ saves a checkpoint in an uncompressed .npz file
+    (the file is written under a temporary name and then renamed, so an interrupted write
+    never replaces the previous checkpoint)
+    :param file_name: name of the checkpoint file
+    :param metadata: (dictionary) numbers describing the run (e.g. the index of the next patient to simulate)
+    :param arrays: (dictionary) numpy.arrays of partial outcomes
+    """
+
+    temp_file_name = file_name + '.tmp'
+    with open(temp_file_name, 'wb') as file:
+        np.savez(file,
+                 **{'metadata.' + key: np.array(value) for key, value in metadata.items()},
+                 **{'arrays.' + key: value for key, value in arrays.items()})
+    os.replace(temp_file_name, file_name)
+
+
+def load_checkpoint(file_name):
+    """
+    :param file_name: name of a checkpoint file saved by save_checkpoint
+    :return: (metadata, arrays) as passed to save_checkpoint
+    """
+
+    metadata = {}
+    arrays = {}
+    with np.load(file_name) as data:
+        for key in data.files:
+            kind, name = key.split('.', 1)
+            if kind == 'metadata':
+                metadata[name] = data[key].item()
+            else:
+                arrays[name] = data[key]
+    return metadata, arrays
+
+
+def get_state_of_stats(stats_by_name):
+    """
+    :param stats_by_name: (dictionary) of objects with a get_state() method, keyed by their names
+    :return: (dictionary) numpy.arrays of the states of all objects (keys are 'name.key')
+    """
+
+    return {name + '.' + key: value
+            for name, stat in stats_by_name.items() for key, value in stat.get_state().items()}
+
+
+def set_state_of_stats(stats_by_name, arrays):
+    """
+    :param stats_by_name: (dictionary) of objects with a set_state() method, keyed by their names
+    :param arrays: (dictionary) returned by get_state_of_stats
+    """
+
+    for name, stat in stats_by_name.items():
+        prefix = name + '.'
+        stat.set_state({key[len(prefix):]: value for key, value in arrays.items() if key.startswith(prefix)})
@@ -1,38 +1,107 @@
+import os
+
 import InputData as D
 import MarkovClasses as Cls
 import ParameterClasses as P
+import SequentialClasses as Seq
 import Support as Support
+from Profiling import Profiler, time_phase
+from ResultCache import ResultCache
+
+if __name__ == '__main__':
+
+    if D.IF_SHARED_PREFIX and D.IF_SEQUENTIAL:
+        raise ValueError('IF_SHARED_PREFIX and IF_SEQUENTIAL cannot both be True.')
+    if D.IF_SEQUENTIAL and D.POP_SIZE < Seq.get_batch_size(batch_size=D.SEQUENTIAL_BATCH_SIZE, sampling=D.SAMPLING):
+        raise ValueError('POP_SIZE should be at least SEQUENTIAL_BATCH_SIZE (rounded up to the groups of SAMPLING).')
+
+    # seed of common random numbers (if paired, patient i faces the same underlying risks in both cohorts)
+    crn_seed = 0 if D.IF_PAIRED else None
+    # patient i of both cohorts is the same patient if they share their trajectory until the first stroke
+    if_paired = D.IF_PAIRED or D.IF_SHARED_PREFIX
+
+    # create a cohort to simulate no therapy
+    cohort_none = Cls.Cohort(id=0,
+                             pop_size=D.POP_SIZE,
+                             parameters=P.Parameters(therapy=P.Therapies.NONE),
+                             crn_seed=crn_seed,
+                             if_profile=D.IF_PROFILE,
+                             sampling=D.SAMPLING,
+                             trace_dir=None if D.TRACE_DIR is None else os.path.join(D.TRACE_DIR, 'None'))
+
+    # create a cohort to simulate anticoagulation therapy
+    cohort_anti = Cls.Cohort(id=1,
+                             pop_size=D.POP_SIZE,
+                             parameters=P.Parameters(therapy=P.Therapies.ANTICOAG),
+                             crn_seed=crn_seed,
+                             if_profile=D.IF_PROFILE,
+                             sampling=D.SAMPLING,
+                             trace_dir=None if D.TRACE_DIR is None else os.path.join(D.TRACE_DIR, 'Anticoag'))
+
+    # cache of simulated outcomes (cohorts simulated before with the same inputs are loaded instead)
+    cache = ResultCache(max_size_mb=D.CACHE_MAX_SIZE_MB) if D.IF_CACHE_RESULTS else None
+
+    if D.IF_SHARED_PREFIX:
+        # simulate the trajectory of each patient until they enter post-stroke once
+        # and continue it under both therapies
+        Cls.simulate_arms(cohorts=[cohort_none, cohort_anti],
+                          sim_length=D.SIM_LENGTH,
+                          n_workers=D.N_WORKERS)
+    elif D.IF_SEQUENTIAL:
+        # simulate batches of patients under both therapies until the confidence intervals
+        # of the mean cost and utility of each therapy and of the incremental NMB are narrow enough
+        targets = [Seq.PrecisionTarget(outcome=outcome, half_width=half_width, cohort_index=k)
+                   for k in range(2)
+                   for outcome, half_width in (('cost', D.TARGET_HALF_WIDTH_COST),
+                                               ('utility', D.TARGET_HALF_WIDTH_UTILITY))]
+        targets.append(Seq.PrecisionTarget(outcome='nmb', half_width=D.TARGET_HALF_WIDTH_NMB,
+                                           cohort_index=1, cohort_index_ref=0, wtp=D.TARGET_WTP))
+        sequential_runner = Seq.SequentialRunner(cohorts=[cohort_none, cohort_anti],
+                                                 targets=targets,
+                                                 batch_size=D.SEQUENTIAL_BATCH_SIZE,
+                                                 alpha=D.ALPHA,
+                                                 max_seconds=D.MAX_SECONDS)
+        sequential_runner.run(sim_length=D.SIM_LENGTH, engine='vectorized')
+        Support.print_sequential_run(runner=sequential_runner)
+    else:
+        # simulate both cohorts (at the same time if more than one worker process is used)
+        Cls.simulate_cohorts(cohorts=[cohort_none, cohort_anti],
+                             sim_length=D.SIM_LENGTH,
+                             n_workers=D.N_WORKERS,
+                             cache=cache)
+
+    # profiler of the reporting phases (None if profiling is turned off)
+    reporting_profiler = Profiler(name='Reporting') if D.IF_PROFILE else None
+
+    # print the estimates for the mean survival time and mean time to AIDS
+    Support.print_outcomes(sim_outcomes=cohort_none.cohortOutcomes,
+                           therapy_name=P.Therapies.NONE)
+    Support.print_outcomes(sim_outcomes=cohort_anti.cohortOutcomes,
+                           therapy_name=P.Therapies.ANTICOAG)
+
+    # print outcomes of patients calculated from their recorded transitions
+    if D.TRACE_DIR is not None:
+        Support.print_trace_outcomes(trace_dir=cohort_none.traceDir, therapy_name=P.Therapies.NONE)
+        Support.print_trace_outcomes(trace_dir=cohort_anti.traceDir, therapy_name=P.Therapies.ANTICOAG)
+
+    # plot survival curves and histograms
+    with time_phase(reporting_profiler, 'plotting'):
+        Support.plot_survival_curves_and_histograms(sim_outcomes_mono=cohort_none.cohortOutcomes,
+                                                    sim_outcomes_combo=cohort_anti.cohortOutcomes)
+
+    # print comparative outcomes
+    Support.print_comparative_outcomes(sim_outcomes_none=cohort_none.cohortOutcomes,
+                                       sim_outcomes_anti=cohort_anti.cohortOutcomes,
+                                       if_paired=if_paired)
+
+    # report the CEA results
+    with time_phase(reporting_profiler, 'CEA and CBA'):
+        Support.report_CEA_CBA(sim_outcomes_none=cohort_none.cohortOutcomes,
+                               sim_outcomes_anti=cohort_anti.cohortOutcomes,
+                               if_paired=if_paired)
 
-# simulating no therapy
-# create a cohort
-cohort_none = Cls.Cohort(id=0,
-                         pop_size=D.POP_SIZE,
-                         parameters=P.Parameters(therapy=P.Therapies.NONE))
-# simulate the cohort
-cohort_none.simulate(sim_length=D.SIM_LENGTH)
-
-# simulating anticoagulation therapy
-# create a cohort
-cohort_anti = Cls.Cohort(id=1,
-                         pop_size=D.POP_SIZE,
-                         parameters=P.Parameters(therapy=P.Therapies.ANTICOAG))
-# simulate the cohort
-cohort_anti.simulate(sim_length=D.SIM_LENGTH)
-
-# print the estimates for the mean survival time and mean time to AIDS
-Support.print_outcomes(sim_outcomes=cohort_none.cohortOutcomes,
-                       therapy_name=P.Therapies.NONE)
-Support.print_outcomes(sim_outcomes=cohort_anti.cohortOutcomes,
-                       therapy_name=P.Therapies.ANTICOAG)
-
-# plot survival curves and histograms
-Support.plot_survival_curves_and_histograms(sim_outcomes_mono=cohort_none.cohortOutcomes,
-                                            sim_outcomes_combo=cohort_anti.cohortOutcomes)
-
-# print comparative outcomes
-Support.print_comparative_outcomes(sim_outcomes_none=cohort_none.cohortOutcomes,
-                                   sim_outcomes_anti=cohort_anti.cohortOutcomes)
-
-# report the CEA results
-Support.report_CEA_CBA(sim_outcomes_none=cohort_none.cohortOutcomes,
-                       sim_outcomes_anti=cohort_anti.cohortOutcomes)
+    # print and save the profile of this run
+    if D.IF_PROFILE:
+        Support.report_profiles(profilers=[cohort_none.cohortOutcomes.profiler,
+                                           cohort_anti.cohortOutcomes.profiler,
+                                           reporting_profiler])
@@ -0,0 +1,156 @@
+import numpy as np
+
+from InputData import HealthStates
+
+
+class Discounter:
+    def __init__(self, parameters):
+        """ calculates discounted cost and utility accrued over intervals between transitions
+        using the closed form of continuous discounting
+        :param parameters: parameters
+        """
+
+        if parameters.discountRate < 0 or parameters.discountRate > 1:
+            raise ValueError("discount_rate should be a number between 0 and 1.")
+
+        self.discountRate = parameters.discountRate
+        self.strokeCost = parameters.strokeCost
+
+        # annual cost of each state (including the cost of anticoagulation in the post-stroke state)
+        self.annualCosts = np.array(parameters.annualStateCosts, dtype=float)
+        self.annualCosts[HealthStates.POST_STROKE.value] += parameters.annuaAntiCoagCost
+        self.annualUtilities = np.array(parameters.annualStateUtilities, dtype=float)
+
+    def get_discount_factors(self, t_starts, t_ends):
+        """
+        :param t_starts: (number or numpy.array) start of intervals
+        :param t_ends: (number or numpy.array) end of intervals
+        :return: present value of a continuous payment of 1 per year over each interval
+            (exp(-discount_rate * t_start) - exp(-discount_rate * t_end)) / discount_rate
+        """
+
+        if self.discountRate == 0:
+            return np.subtract(t_ends, t_starts)
+        else:
+            return (np.exp(-self.discountRate * t_starts) - np.exp(-self.discountRate * t_ends)) / self.discountRate
+
+    def get_discounted_stroke_entries(self, t_ends, next_states):
+        """
+        :param t_ends: (number or numpy.array) end of intervals (when the transition to the next state occurs)
+        :param next_states: (number or numpy.array) index of the state after each interval
+        :return: exp(-discount_rate * t_end) if the next state is stroke and 0 otherwise
+        """
+
+        return (next_states == HealthStates.STROKE.value) * np.exp(-self.discountRate * t_ends)
+
+    def get_discounted_payoffs(self, states, t_starts, t_ends, next_states):
+        """ discounted cost and utility accrued while in 'states' from t_starts until t_ends,
+        plus the stroke cost if the next state is stroke
+        (works with numbers or with numpy.arrays of intervals)
+        :param states: index of the state during each interval
+        :param t_starts: start of intervals
+        :param t_ends: end of intervals (when the transition to the next state occurs)
+        :param next_states: index of the state after each interval
+        :return: (discounted costs, discounted utilities)
+        """
+
+        return self.get_discounted_payoffs_from_weights(
+            states=states,
+            discount_factors=self.get_discount_factors(t_starts=t_starts, t_ends=t_ends),
+            discounted_stroke_entries=self.get_discounted_stroke_entries(t_ends=t_ends, next_states=next_states))
+
+    def get_discounted_payoffs_from_weights(self, states, discount_factors, discounted_stroke_entries):
+        """
+        :param states: index of the state during each interval
+        :param discount_factors: discount factors of intervals (see get_discount_factors)
+        :param discounted_stroke_entries: discounted stroke entries at the end of intervals
+            (see get_discounted_stroke_entries)
+        :return: (discounted costs, discounted utilities)
+        """
+
+        # discounted cost and utility (continuously compounded)
+        # plus the discounted stoke cost, if stroke occurred
+        discounted_costs = self.annualCosts[states] * discount_factors + self.strokeCost * discounted_stroke_entries
+        discounted_utilities = self.annualUtilities[states] * discount_factors
+
+        return discounted_costs, discounted_utilities
+
+
+class SubgroupDiscounter(Discounter):
+    def __init__(self, subgroup_parameters):
+        """ calculates discounted cost and utility of patients of several subgroups with their own costs and
+        utilities; states passed to this calculator are rows indexed by subgroup * number of states + state
+        (as in ParameterClasses.SubgroupCompetingRisksSampler), while next states are states
+        :param subgroup_parameters: (list) parameters of each subgroup (with the same discount rate)
+        """
+
+        discounters = [Discounter(parameters=parameters) for parameters in subgroup_parameters]
+        if any(discounter.discountRate != discounters[0].discountRate for discounter in discounters):
+            raise ValueError('All subgroups should have the same discount rate.')
+
+        self.discountRate = discounters[0].discountRate
+
+        # stroke cost, annual cost and annual utility of each row
+        self.strokeCosts = np.repeat([discounter.strokeCost for discounter in discounters], len(HealthStates))
+        self.annualCosts = np.concatenate([discounter.annualCosts for discounter in discounters])
+        self.annualUtilities = np.concatenate([discounter.annualUtilities for discounter in discounters])
+
+    def get_discounted_payoffs_from_weights(self, states, discount_factors, discounted_stroke_entries):
+        """
+        :param states: row of the state during each interval (subgroup * number of states + state)
+        :param discount_factors: discount factors of intervals (see get_discount_factors)
+        :param discounted_stroke_entries: discounted stroke entries at the end of intervals
+            (see get_discounted_stroke_entries)
+        :return: (discounted costs, discounted utilities)
+        """
+
+        discounted_costs = (self.annualCosts[states] * discount_factors
+                            + self.strokeCosts[states] * discounted_stroke_entries)
+        discounted_utilities = self.annualUtilities[states] * discount_factors
+
+        return discounted_costs, discounted_utilities
+
+
+if __name__ == '__main__':
+
+    # check that the discounted payoffs agree with deampy
+    import deampy.econ_eval as econ
+
+    import ParameterClasses as P
+
+    rng = np.random.RandomState(seed=1)
+    for therapy in P.Therapies:
+        params = P.Parameters(therapy=therapy)
+        discounter = Discounter(parameters=params)
+
+        states = rng.randint(0, 3, size=1000)
+        next_states = rng.randint(0, 5, size=1000)
+        t_starts = rng.uniform(0, 50, size=1000)
+        t_ends = t_starts + rng.exponential(scale=5, size=1000)
+
+        costs, utilities = discounter.get_discounted_payoffs(
+            states=states, t_starts=t_starts, t_ends=t_ends, next_states=next_states)
+
+        for i in range(1000):
+            cost = params.annualStateCosts[states[i]]
+            if states[i] == HealthStates.POST_STROKE.value:
+                cost += params.annuaAntiCoagCost
+            expected_cost = econ.pv_continuous_payment(payment=cost,
+                                                       discount_rate=params.discountRate,
+                                                       discount_period=(t_starts[i], t_ends[i]))
+            if next_states[i] == HealthStates.STROKE.value:
+                expected_cost += econ.pv_single_payment(payment=params.strokeCost,
+                                                        discount_rate=params.discountRate,
+                                                        discount_period=t_ends[i],
+                                                        discount_continuously=True)
+            expected_utility = econ.pv_continuous_payment(payment=params.annualStateUtilities[states[i]],
+                                                          discount_rate=params.discountRate,
+                                                          discount_period=(t_starts[i], t_ends[i]))
+
+            # scalar and batched results should both agree with deampy
+            scalar_cost, scalar_utility = discounter.get_discounted_payoffs(
+                states=states[i], t_starts=t_starts[i], t_ends=t_ends[i], next_states=next_states[i])
+            assert np.allclose([costs[i], scalar_cost], expected_cost, rtol=1e-12, atol=1e-9)
+            assert np.allclose([utilities[i], scalar_utility], expected_utility, rtol=1e-12, atol=1e-9)
+
+    print('Discounted costs and utilities agree with deampy.')
@@ -0,0 +1,139 @@
+import numpy as np
+from scipy.linalg import expm
+
+from InputData import HealthStates
+
+
+class ExpectedCohort:
+    def __init__(self, pop_size, parameters):
+        """ a cohort of patients whose expected outcomes are calculated exactly from the
+        transition rate matrix (no simulation)
+        :param pop_size: population size of this cohort
+        :param parameters: parameters
+        """
+        self.popSize = pop_size
+        self.params = parameters
+        self.cohortOutcomes = None  # expected outcomes of this cohort
+
+    def calculate(self, sim_length, time_step=0.1):
+        """ calculates the expected outcomes of this cohort over the simulation length
+        :param sim_length: simulation length
+        :param time_step: distance between the time points where state occupancy is reported
+        """
+
+        self.cohortOutcomes = ExpectedCohortOutcomes(
+            parameters=self.params, pop_size=self.popSize, sim_length=sim_length, time_step=time_step)
+
+
+class ExpectedCohortOutcomes:
+    def __init__(self, parameters, pop_size, sim_length, time_step):
+        """ expected outcomes of a cohort calculated from the generator of the continuous-time Markov chain
+        :param parameters: parameters
+        :param pop_size: population size
+        :param sim_length: simulation length
+        :param time_step: distance between the time points where state occupancy is reported
+        """
+
+        if parameters.ifAgeDependent:
+            raise ValueError('Expected outcomes can only be calculated when transition rates do not depend on age.')
+
+        n_states = len(HealthStates)
+        dead_states = [HealthStates.STROKE_DEAD.value, HealthStates.NATURAL_DEATH.value]
+        stroke = HealthStates.STROKE.value
+
+        # generator of the continuous-time Markov chain (diagonal = - sum of rates out of each state)
+        generator = np.array(parameters.transRateMatrix, dtype=float)
+        np.fill_diagonal(generator, 0)
+        np.fill_diagonal(generator, -generator.sum(axis=1))
+
+        # initial state distribution
+        p0 = np.zeros(n_states)
+        p0[parameters.initialHealthState.value] = 1
+
+        # probability of being in each state at each time point (p(t) = p0 * exp(Q * t))
+        self.times = np.append(np.arange(0, sim_length, time_step), sim_length)
+        self.stateOccupancy = np.empty((len(self.times), n_states))
+        self.stateOccupancy[0] = p0
+        step_matrix = expm(generator * time_step)
+        for k in range(1, len(self.times) - 1):
+            self.stateOccupancy[k] = self.stateOccupancy[k-1] @ step_matrix
+        self.stateOccupancy[-1] = self.stateOccupancy[-2] @ expm(generator * (self.times[-1] - self.times[-2]))
+
+        # expected (undiscounted and discounted) time spent in each state until sim_length
+        self.timeInStates = p0 @ _integrate_expm(generator, sim_length)
+        self.discountedTimeInStates = p0 @ _integrate_expm(
+            generator - parameters.discountRate * np.identity(n_states), sim_length)
+
+        # survival curve
+        self.survivalProbabilities = 1 - self.stateOccupancy[:, dead_states].sum(axis=1)
+        self.nLivingPatients = pop_size * self.survivalProbabilities
+
+        # mean survival time of patients who die before sim_length
+        # (E[T | T <= L] = L - integral of P(T <= t) from 0 to L / P(T <= L))
+        prob_dead = 1 - self.survivalProbabilities[-1]
+        self.meanSurvivalTime = sim_length - self.timeInStates[dead_states].sum() / prob_dead
+        # expected survival time restricted to the simulation length
+        self.restrictedMeanSurvivalTime = sim_length - self.timeInStates[dead_states].sum()
+
+        # as in the simulation, a patient who is in the stroke state at the end of
+        # the simulation is recorded as having another stroke
+        prob_stroke_at_end = self.stateOccupancy[-1, stroke]
+
+        # expected number of strokes (fatal or not)
+        stroke_rates = generator[:, [stroke, HealthStates.STROKE_DEAD.value]].sum(axis=1)
+        stroke_rates[[stroke, HealthStates.STROKE_DEAD.value]] = 0
+        self.expectedNumStrokes = self.timeInStates @ stroke_rates + prob_stroke_at_end
+
+        # expected discounted cost and utility
+        discounter = parameters.discounter
+        rates_into_stroke = generator[:, stroke].copy()
+        rates_into_stroke[stroke] = 0
+        discounted_num_stroke_entries = (self.discountedTimeInStates @ rates_into_stroke
+                                         + prob_stroke_at_end * np.exp(-parameters.discountRate * sim_length))
+        self.expectedCost = (self.discountedTimeInStates @ discounter.annualCosts
+                             + discounted_num_stroke_entries * discounter.strokeCost)
+        self.expectedUtility = self.discountedTimeInStates @ discounter.annualUtilities
+
+
+def _integrate_expm(matrix, length):
+    """
+    :param matrix: square matrix A
+    :param length: upper limit of integration L
+    :return: integral of exp(A * t) from 0 to L
+        (calculated from the upper-right block of exp([[A, I], [0, 0]] * L))
+    """
+
+    n = matrix.shape[0]
+    augmented = np.zeros((2 * n, 2 * n))
+    augmented[:n, :n] = matrix
+    augmented[:n, n:] = np.identity(n)
+
+    return expm(augmented * length)[:n, n:]
+
+
+if __name__ == '__main__':
+
+    # compare the expected outcomes with the outcomes of a large simulated cohort
+    import InputData as D
+    import MarkovClasses as Cls
+    import ParameterClasses as P
+
+    for therapy in P.Therapies:
+        params = P.Parameters(therapy=therapy)
+
+        expected_cohort = ExpectedCohort(pop_size=D.POP_SIZE, parameters=params)
+        expected_cohort.calculate(sim_length=D.SIM_LENGTH)
+
+        cohort = Cls.Cohort(id=therapy.value, pop_size=D.POP_SIZE, parameters=params)
+        cohort.simulate(sim_length=D.SIM_LENGTH, engine='vectorized')
+
+        expected = expected_cohort.cohortOutcomes
+        simulated = cohort.cohortOutcomes
+        print(therapy)
+        for name, value, stat in (
+                ('survival time', expected.meanSurvivalTime, simulated.statSurvivalTime),
+                ('number of strokes', expected.expectedNumStrokes, simulated.statNumStrokes),
+                ('discounted cost', expected.expectedCost, simulated.statCost),
+                ('discounted utility', expected.expectedUtility, simulated.statUtility)):
+            print('  Expected {}: {:.4f}, simulated: {:.4f} {}'.format(
+                name, value, stat.get_mean(), stat.get_t_CI(alpha=D.ALPHA)))
@@ -6,7 +6,82 @@ import numpy as np
 POP_SIZE = 100000         # cohort population size
 SIM_LENGTH = 50    # length of simulation (years)
 ALPHA = 0.05        # significance level for calculating confidence intervals
+N_WORKERS = 1       # number of worker processes used to simulate cohorts
+IF_PAIRED = False   # set to True to simulate alternatives with common random numbers and report paired differences
+IF_SHARED_PREFIX = False    # set to True to simulate each patient until their first post-stroke state once
+                            # and branch it into both therapies (outcomes of therapies are then paired)
 DISCOUNT = 0.03     # annual discount rate
+SAMPLING = 'random'     # scheme to sample the random numbers of events: 'random', 'antithetic' (antithetic pairs
+                        # of patients), or 'sobol' or 'stratified' (quasi-random points for the first events)
+IF_SEQUENTIAL = False   # set to True to simulate patients in batches until the confidence intervals below are
+                        # narrow enough (POP_SIZE is then the largest number of patients simulated per therapy)
+SEQUENTIAL_BATCH_SIZE = 5000        # number of patients per therapy simulated between checks of the targets
+                                    # (rounded up to a multiple of 2 for 'antithetic' and 256 for 'sobol' or
+                                    # 'stratified' SAMPLING; POP_SIZE is then rounded down to a multiple of it)
+TARGET_HALF_WIDTH_COST = 50         # target half-width of the CI of the mean discounted cost of each therapy
+TARGET_HALF_WIDTH_UTILITY = 0.05    # target half-width of the CI of the mean discounted utility of each therapy
+TARGET_HALF_WIDTH_NMB = 500         # target half-width of the CI of the incremental net monetary benefit
+TARGET_WTP = 30000                  # willingness-to-pay per QALY of the incremental net monetary benefit
+MAX_SECONDS = None                  # time budget of a sequential run in seconds (None for no time budget)
+TRACE_DIR = None    # directory to record every transition of every patient in (one subdirectory per therapy;
+                    # None to keep no trace); not available with IF_SHARED_PREFIX
+IF_PROFILE = False  # set to True to report the time spent in each phase of a run and counts of simulated events
+IF_CACHE_RESULTS = True     # set to True to reuse the outcomes of cohorts simulated before with the same inputs
+CACHE_MAX_SIZE_MB = 1024    # largest size of the cache of simulated outcomes (MB)
+SERVICE_SOCKET_FILE = 'ScenarioService.sock'   # Unix socket of the scenario-evaluation service (RunScenarioService.py)
+
+# probabilistic sensitivity analysis settings
+PSA_N_DRAWS = 1000      # number of parameter draws
+PSA_POP_SIZE = 2000     # cohort population size simulated for each parameter draw
+# groups of inputs whose expected value of partial perfect information is reported after the PSA
+# (inputs are labelled as in PSAClasses.get_input_label)
+VOI_GROUPS = {
+    'Stroke reduction': ['ANTICOAG_STROKE_REDUCTION'],
+    'Costs': ['ANTICOAG_COST', 'STROKE_COST', 'ANNUAL_STATE_COST[2]'],
+    'Utilities': ['ANNUAL_STATE_UTILITY[1]', 'ANNUAL_STATE_UTILITY[2]'],
+    'Stroke risks': ['ANNUAL_PROB_FIRST_STROKE', 'FIVE_YEAR_PROB_RECURRENT_STROKE'],
+}
+
+# calibration settings (RunCalibration.py)
+# targets as dictionaries of the 'outcome' ('survival_probability', 'mean_survival_time',
+# 'restricted_mean_survival_time' or 'n_strokes'), target 'value', 'tolerance' and, for 'survival_probability',
+# the 'time' (targets are outcomes of a cohort under no therapy)
+CALIBRATION_TARGETS = [
+    {'outcome': 'survival_probability', 'time': 10, 'value': 0.60, 'tolerance': 0.01},
+    {'outcome': 'restricted_mean_survival_time', 'value': 18.2, 'tolerance': 0.2},
+    {'outcome': 'n_strokes', 'value': 0.38, 'tolerance': 0.015},
+]
+# [lower, upper] bounds of the calibrated inputs
+CALIBRATION_BOUNDS = {
+    'ANNUAL_PROB_FIRST_STROKE': [0.005, 0.04],
+    'FIVE_YEAR_PROB_RECURRENT_STROKE': [0.05, 0.4],
+    'PROB_SURVIVE_FIRST_STROKE': [0.5, 0.95],
+    'PROB_SURVIVE_RECURRENT_STROKE': [0.4, 0.95],
+}
+CALIBRATION_EVALUATOR = 'expected'  # 'expected' (exact expected outcomes, confirmed by simulation) or 'simulation'
+CALIBRATION_POP_SIZE = 50000        # population size of the cohorts simulated to evaluate or confirm candidates
+CALIBRATION_N_ACCEPTED = 50         # number of accepted parameter sets to search for
+
+# heterogeneous population settings (RunHeterogeneousCohort.py)
+POPULATION_FILE = None  # CSV file of the covariates of patients (a header row with the name of each covariate, e.g.
+                        # age, female, prior_stroke, and one row per patient); None to sample POP_SIZE patients
+# lower edges of the bins of numeric covariates (patients are grouped into subgroups by the bin of these covariates
+# and the value of other covariates)
+SUBGROUP_BINS = {'age': [60, 65, 70, 75, 80, 85, 90]}
+# values of model inputs for each value (or lower edge of the bin) of a covariate; the inputs of a subgroup combine
+# the inputs of its covariates (covariates and values that are not listed keep the inputs defined below)
+SUBGROUP_INPUTS = {
+    'age': {60: {'ANNUAL_PROB_ALL_CAUSE_MORT': 0.0095},
+            65: {'ANNUAL_PROB_ALL_CAUSE_MORT': 0.0145},
+            70: {'ANNUAL_PROB_ALL_CAUSE_MORT': 0.0220},
+            75: {'ANNUAL_PROB_ALL_CAUSE_MORT': 0.0340},
+            80: {'ANNUAL_PROB_ALL_CAUSE_MORT': 0.0540},
+            85: {'ANNUAL_PROB_ALL_CAUSE_MORT': 0.0900},
+            90: {'ANNUAL_PROB_ALL_CAUSE_MORT': 0.1600}},
+    'female': {0: {'ANNUAL_PROB_FIRST_STROKE': 17 / 1000},
+               1: {'ANNUAL_PROB_FIRST_STROKE': 13 / 1000}},
+    'prior_stroke': {1: {'INITIAL_HEALTH_STATE': 'POST_STROKE'}},
+}
 
 ANNUAL_PROB_ALL_CAUSE_MORT = 4466.9 / 100000
 ANNUAL_PROB_STROKE_MORT = 36.2 / 100000
@@ -15,6 +90,20 @@ PROB_SURVIVE_FIRST_STROKE = 0.75
 PROB_SURVIVE_RECURRENT_STROKE = 0.7
 FIVE_YEAR_PROB_RECURRENT_STROKE = 0.17
 STROKE_DURATION = 1/52  # 1 week
+INITIAL_HEALTH_STATE = 'WELL'   # health state in which patients start ('WELL' or 'POST_STROKE')
+
+# age-specific inputs: an input X above can be given by age in X_BY_AGE as a list of [age, value] pairs
+# in increasing order of age (each value applies from its age until the next age, the first value also
+# applies to younger ages and the last value to all older ages); set X_BY_AGE to None to use X at every age
+# (e.g. ANNUAL_PROB_ALL_CAUSE_MORT_BY_AGE = [[60, 0.0108], [61, 0.0116], ..., [100, 0.3500]])
+ANNUAL_PROB_ALL_CAUSE_MORT_BY_AGE = None
+ANNUAL_PROB_STROKE_MORT_BY_AGE = None
+ANNUAL_PROB_FIRST_STROKE_BY_AGE = None
+FIVE_YEAR_PROB_RECURRENT_STROKE_BY_AGE = None
+
+# distribution of the age of patients at the start of the simulation as a list of [age, probability] pairs
+# (only affects the simulation if an input is given by age)
+STARTING_AGE_DIST = [[65, 1]]
 
 ANTICOAG_STROKE_REDUCTION = 0.8
 ANTICOAG_BLEEDING_DEATH_INCREASE = 0.05
@@ -48,44 +137,99 @@ ANNUAL_STATE_COST = [
 ANTICOAG_COST = 2000
 STROKE_COST = 5000
 
+# names of the model inputs (the inputs read by ParameterClasses.Parameters and get_trans_rate_matrix,
+# which are the only inputs that can be given new values, e.g. by PSA draws, calibration or subgroups)
+MODEL_INPUTS = frozenset((
+    'ANNUAL_PROB_ALL_CAUSE_MORT', 'ANNUAL_PROB_STROKE_MORT', 'ANNUAL_PROB_FIRST_STROKE',
+    'PROB_SURVIVE_FIRST_STROKE', 'PROB_SURVIVE_RECURRENT_STROKE', 'FIVE_YEAR_PROB_RECURRENT_STROKE',
+    'STROKE_DURATION', 'INITIAL_HEALTH_STATE',
+    'ANNUAL_PROB_ALL_CAUSE_MORT_BY_AGE', 'ANNUAL_PROB_STROKE_MORT_BY_AGE', 'ANNUAL_PROB_FIRST_STROKE_BY_AGE',
+    'FIVE_YEAR_PROB_RECURRENT_STROKE_BY_AGE', 'STARTING_AGE_DIST',
+    'ANTICOAG_STROKE_REDUCTION', 'ANTICOAG_BLEEDING_DEATH_INCREASE',
+    'ANNUAL_STATE_UTILITY', 'ANNUAL_STATE_COST', 'ANTICOAG_COST', 'STROKE_COST', 'DISCOUNT'))
+
+
+def get_input(name, inputs=None, age=None):
+    """
+    :param name: name of a model input defined in this module (e.g. 'ANNUAL_PROB_FIRST_STROKE')
+    :param inputs: (dictionary) values of model inputs (keyed by their names) to use
+        instead of the values defined in this module
+    :param age: if provided and the input is given by age (in name + '_BY_AGE'), the value at this age is returned
+    :return: value of the model input
+    """
+
+    if age is not None and name + '_BY_AGE' in globals():
+        table = get_input(name + '_BY_AGE', inputs)
+        if table is not None:
+            ages = [row[0] for row in table]
+            # index of the last age that is not greater than this age (the first row for younger ages)
+            return table[max(0, int(np.searchsorted(ages, age, side='right')) - 1)][1]
+
+    if inputs is not None and name in inputs:
+        return inputs[name]
+    else:
+        return globals()[name]
+
+
+def get_age_breaks(inputs=None):
+    """
+    :param inputs: (dictionary) values of model inputs (keyed by their names) to use
+        instead of the values defined in this module
+    :return: (list) sorted ages at which an input given by age changes (empty if no input is given by age);
+        the transition rates are constant between consecutive ages
+    """
+
+    ages = set()
+    for name in globals():
+        if name.endswith('_BY_AGE'):
+            table = get_input(name, inputs)
+            if table is not None:
+                ages.update(row[0] for row in table)
+    return sorted(ages)
+
 
-def get_trans_rate_matrix(with_treatment):
+def get_trans_rate_matrix(with_treatment, inputs=None, age=None):
     """
     :param with_treatment: set to True to calculate the transition rate matrix when the anticoagulation is used
     in the post-stroke state
+    :param inputs: (dictionary) values of model inputs (keyed by their names) to use
+        instead of the values defined in this module
+    :param age: age of patients (inputs given by age are evaluated at this age; if None, they are ignored)
     :return: transition rate matrix
     """
 
     # Part 1: find the annual rate of all-cause mortality
-    annual_rate_all_cause_mort = -np.log(1 - ANNUAL_PROB_ALL_CAUSE_MORT)
+    annual_rate_all_cause_mort = -np.log(1 - get_input('ANNUAL_PROB_ALL_CAUSE_MORT', inputs, age))
 
     # Part 2: find the annual rate of non-stroke death
-    annual_rate_stroke_mort = -np.log(1 - ANNUAL_PROB_STROKE_MORT)
+    annual_rate_stroke_mort = -np.log(1 - get_input('ANNUAL_PROB_STROKE_MORT', inputs, age))
     # annual rate of background mortality
     lambda0 = annual_rate_all_cause_mort - annual_rate_stroke_mort
 
     # Part 3: lambda 1 + lambda 2
-    lambda1_plus2 = -np.log(1 - ANNUAL_PROB_FIRST_STROKE)
+    lambda1_plus2 = -np.log(1 - get_input('ANNUAL_PROB_FIRST_STROKE', inputs, age))
 
     # Part 4
-    lambda1 = lambda1_plus2 * PROB_SURVIVE_FIRST_STROKE
-    lambda2 = lambda1_plus2 * (1 - PROB_SURVIVE_FIRST_STROKE)
+    prob_survive_first_stroke = get_input('PROB_SURVIVE_FIRST_STROKE', inputs)
+    lambda1 = lambda1_plus2 * prob_survive_first_stroke
+    lambda2 = lambda1_plus2 * (1 - prob_survive_first_stroke)
 
     # Part 5
-    lambda3_plus4 = -1 / 5 * np.log(1 - FIVE_YEAR_PROB_RECURRENT_STROKE)
+    lambda3_plus4 = -1 / 5 * np.log(1 - get_input('FIVE_YEAR_PROB_RECURRENT_STROKE', inputs, age))
 
     # Part 6
-    lambda3 = lambda3_plus4 * PROB_SURVIVE_RECURRENT_STROKE
-    lambda4 = lambda3_plus4 * (1 - PROB_SURVIVE_RECURRENT_STROKE)
+    prob_survive_recurrent_stroke = get_input('PROB_SURVIVE_RECURRENT_STROKE', inputs)
+    lambda3 = lambda3_plus4 * prob_survive_recurrent_stroke
+    lambda4 = lambda3_plus4 * (1 - prob_survive_recurrent_stroke)
 
     # Part 7
-    lambda5 = 1 / STROKE_DURATION
+    lambda5 = 1 / get_input('STROKE_DURATION', inputs)
 
     # find multipliers to adjust the rates out of "Post-Stroke" depending on whether the patient
     # is receiving anticoagulation or not
     if with_treatment:
-        r1 = 1-ANTICOAG_STROKE_REDUCTION
-        r2 = 1+ANTICOAG_BLEEDING_DEATH_INCREASE
+        r1 = 1-get_input('ANTICOAG_STROKE_REDUCTION', inputs)
+        r2 = 1+get_input('ANTICOAG_BLEEDING_DEATH_INCREASE', inputs)
     else:
         r1 = 1
         r2 = 1
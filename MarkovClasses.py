@@ -1,36 +1,83 @@
-import deampy.econ_eval as econ
-import deampy.statistics as stats
+import copy
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-from deampy.markov import Gillespie
-from deampy.plots.sample_paths import PrevalencePathBatchUpdate
 
+from Checkpoints import get_state_of_stats, load_checkpoint, save_checkpoint, set_state_of_stats
 from InputData import HealthStates
+from ParameterClasses import SubgroupParameters
+from Profiling import Profiler
+from RandomStreams import STARTING_AGE_STREAM, AntitheticStreams, CommonRandomStreams, QuasiRandomStreams, \
+    get_group_size, get_uniform_keys
+from StreamingStatistics import BinnedCounts, GroupedStat, OnlineStat
+from TraceClasses import TraceWriter, get_part_directory, remove_trace
+
+# deampy (used for summary statistics and survival curves) is imported in calculate_cohort_outcomes
+# because importing it loads its plotting modules, which simulations and worker processes do not need
+
+# version of the simulation engines (increase when a change alters the simulated outcomes
+# or how they are stored, so that outcomes cached by ResultCache are not reused)
+ENGINE_VERSION = 2
 
 
 class Patient:
-    def __init__(self, id, parameters):
+    def __init__(self, id, parameters, random_streams=None, profiler=None, starting_age=None, trace_writer=None,
+                 position=0):
+        """
+        :param id: patient ID (used to seed the random number generator of this patient)
+        :param parameters: parameters
+        :param random_streams: (CommonRandomStreams) common random numbers of this patient
+            (if not provided, random numbers are drawn from a generator seeded by the patient ID)
+        :param profiler: (Profiler) to collect the time spent in each phase and counts of events
+        :param starting_age: age of the patient at the start of the simulation
+            (only needed if transition rates depend on age)
+        :param trace_writer: (TraceWriter) to record the transitions of this patient in
+        :param position: position of this patient in the set of patients of random_streams
+        """
 
         self.id = id
         self.params = parameters
-        self.stateMonitor = PatientStateMonitor(parameters=parameters)
+        self.randomStreams = random_streams
+        self.position = position
+        self.profiler = profiler
+        self.startingAge = starting_age
+        self.stateMonitor = PatientStateMonitor(parameters=parameters, trace_writer=trace_writer, patient_id=id)
 
     def simulate(self, sim_length):
 
         # random number generator for this patient
         rng = np.random.RandomState(seed=self.id)
-        # gillespie algorithm
-        gillespie = Gillespie(transition_rate_matrix=self.params.transRateMatrix)
+        # sampler of the time until next event and the next state (shared by all patients)
+        sampler = self.params.sampler
+        profiler = self.profiler
 
         t = 0  # simulation time
         if_stop = False
 
         while not if_stop:
+            if profiler is not None:
+                start = time.perf_counter()
+
             # find time until next event (dt), and next state
-            # (note that the gillespie algorithm returns None for dt if the process
+            # (note that the sampler returns None for dt if the process
             # is in an absorbing state)
-            dt, new_state_index = gillespie.get_next_state(
-                current_state_index=self.stateMonitor.currentState.value,
-                rng=rng)
+            age = None if self.startingAge is None else self.startingAge + t
+            if self.randomStreams is None:
+                dt, new_state_index = sampler.get_next_state(
+                    current_state_index=self.stateMonitor.currentState.value,
+                    rng=rng,
+                    age=age)
+            else:
+                dt, new_state_index = self.randomStreams.get_next_state(
+                    sampler=sampler,
+                    current_state_index=self.stateMonitor.currentState.value,
+                    position=self.position,
+                    age=age)
+
+            if profiler is not None:
+                profiler.record_time(phase='sampling', start=start)
 
             # stop if time to next event (dt) is None (i.e. we have reached an absorbing state)
             if dt is None:
@@ -38,7 +85,8 @@ class Patient:
 
             else:
                 # else if next event occurs beyond simulation length
-                if dt + t > sim_length:
+                if_censored = dt + t > sim_length
+                if if_censored:
                     # advance time to the end of the simulation and stop
                     t = sim_length
                     # the individual stays in the current state until the end of the simulation
@@ -47,26 +95,63 @@ class Patient:
                 else:
                     # advance time to the time of next event
                     t += dt
-                # update health state
-                self.stateMonitor.update(time=t, new_state=HealthStates(new_state_index))
+
+                if profiler is None:
+                    # update health state
+                    self.stateMonitor.update(time=t, new_state=HealthStates(new_state_index))
+                else:
+                    self._update_with_profiler(t=t, new_state_index=new_state_index, if_censored=if_censored)
+
+    def _update_with_profiler(self, t, new_state_index, if_censored):
+        """ updates the health state while timing the enum construction and the state monitor
+        (where discounting happens) and counting the event """
+
+        profiler = self.profiler
+        current_state_index = self.stateMonitor.currentState.value
+
+        start = time.perf_counter()
+        new_state = HealthStates(new_state_index)
+        profiler.record_time(phase='state construction', start=start)
+
+        start = time.perf_counter()
+        self.stateMonitor.update(time=t, new_state=new_state)
+        profiler.record_time(phase='discounting and state monitor', start=start)
+
+        profiler.record_events(current_states=current_state_index,
+                               next_states=new_state_index,
+                               if_censored=if_censored,
+                               if_absorbing=self.params.sampler.ifAbsorbing[new_state_index])
 
 
 class PatientStateMonitor:
-    def __init__(self, parameters):
+    def __init__(self, parameters, trace_writer=None, patient_id=None):
+        """
+        :param parameters: parameters
+        :param trace_writer: (TraceWriter) to record every transition of the patient in (if None, no trace is kept)
+        :param patient_id: id of the patient (recorded in the trace)
+        """
 
         self.currentState = parameters.initialHealthState    # assuming everyone starts in "Well"
         self.survivalTime = None
         self.nStrokes = 0
+        self.nEvents = 0    # number of state transitions (including the end of the simulation)
         self.costUtilityMonitor = PatientCostUtilityMonitor(parameters=parameters)
+        self.traceWriter = trace_writer
+        self.patientId = patient_id
 
     def update(self, time, new_state):
 
+        if self.traceWriter is not None:
+            self.traceWriter.record_event(patient_id=self.patientId, time=time,
+                                          from_state=self.currentState.value, to_state=new_state.value)
+
         if new_state in (HealthStates.STROKE_DEAD, HealthStates.NATURAL_DEATH):
             self.survivalTime = time
 
         if new_state in (HealthStates.STROKE, HealthStates.STROKE_DEAD):
             self.nStrokes += 1
 
+        self.nEvents += 1
         self.costUtilityMonitor.update(time=time,
                                        current_state=self.currentState,
                                        next_state=new_state)
@@ -89,79 +174,750 @@ class PatientCostUtilityMonitor:
         self.totalDiscountedCost = 0
         self.totalDiscountedUtility = 0
 
+        # discounted time spent in each state and discounted number of stroke entries
+        # (enough to re-calculate discounted cost and utility for new state costs and utilities)
+        self.discountedStateTimes = np.zeros(len(HealthStates))
+        self.discountedStrokeEntries = 0
+
     def update(self, time, current_state, next_state):
 
-        # cost (per unit of time) during the period since the last recording until now
-        cost = self.params.annualStateCosts[current_state.value]
-        if current_state == HealthStates.POST_STROKE:
-            cost += self.params.annuaAntiCoagCost
-
-        # discounted cost and utility (continuously compounded)
-        discounted_cost = econ.pv_continuous_payment(payment=cost,
-                                                     discount_rate=self.params.discountRate,
-                                                     discount_period=(self.tLastRecorded, time))
-
-        # add discounted stoke cost, if stroke occurred
-        if next_state == HealthStates.STROKE:
-            discounted_cost += econ.pv_single_payment(payment=self.params.strokeCost,
-                                                      discount_rate=self.params.discountRate,
-                                                      discount_period=time,
-                                                      discount_continuously=True)
-
-        # utility (per unit of time) during the period since the last recording until now
-        utility = self.params.annualStateUtilities[current_state.value]
-        discounted_utility = econ.pv_continuous_payment(payment=utility,
-                                                        discount_rate=self.params.discountRate,
-                                                        discount_period=(self.tLastRecorded, time))
+        discounter = self.params.discounter
+
+        # discounted time in the current state during the period since the last recording until now
+        # and the discounted stroke entry, if stroke occurred
+        discount_factor = discounter.get_discount_factors(t_starts=self.tLastRecorded, t_ends=time)
+        discounted_stroke_entry = discounter.get_discounted_stroke_entries(t_ends=time, next_states=next_state.value)
+
+        # discounted cost and utility (continuously compounded) during this period
+        # (including the discounted stroke cost, if stroke occurred)
+        discounted_cost, discounted_utility = discounter.get_discounted_payoffs_from_weights(
+            states=current_state.value,
+            discount_factors=discount_factor,
+            discounted_stroke_entries=discounted_stroke_entry)
 
         # update total discounted cost and utility
         self.totalDiscountedCost += discounted_cost
         self.totalDiscountedUtility += discounted_utility
+        self.discountedStateTimes[current_state.value] += discount_factor
+        self.discountedStrokeEntries += discounted_stroke_entry
 
         # update the time since last recording to the current time
         self.tLastRecorded = time
 
 
+class PatientBatch:
+    def __init__(self, id, size, parameters, random_streams=None, profiler=None, starting_ages=None,
+                 trace_writer=None, subgroups=None):
+        """ a batch of patients that are simulated together using NumPy arrays
+        :param id: batch ID (used to seed the random number generator of this batch;
+            patient n of this batch has id + n as patient id)
+        :param size: number of patients in this batch
+        :param parameters: parameters
+        :param random_streams: (CommonRandomStreams) common random numbers of the patients in this batch
+            (if not provided, random numbers are drawn from a generator seeded by the batch ID)
+        :param profiler: (Profiler) to collect the time spent in each phase and counts of events
+        :param starting_ages: (numpy.array) age of each patient at the start of the simulation
+            (only needed if transition rates depend on age)
+        :param trace_writer: (TraceWriter) to record the transitions of patients in
+        :param subgroups: (numpy.array) subgroup of each patient (needed if parameters are SubgroupParameters)
+        """
+
+        self.id = id
+        self.size = size
+        self.params = parameters
+        self.randomStreams = random_streams
+        self.profiler = profiler
+        self.startingAges = starting_ages
+        self.traceWriter = trace_writer
+        self.subgroups = subgroups
+
+        # state of each patient in this batch (everyone starts in the initial health state of their subgroup)
+        if subgroups is None:
+            self.currentStates = np.full(size, parameters.initialHealthState.value, dtype=int)
+        else:
+            self.currentStates = parameters.initialHealthStates[subgroups]
+        # time of the last event of each patient
+        self.times = np.zeros(size)
+        # survival time of each patient (nan if the patient is alive at the end of the simulation)
+        self.survivalTimes = np.full(size, np.nan)
+        self.nStrokes = np.zeros(size, dtype=int)
+        self.totalDiscountedCosts = np.zeros(size)
+        self.totalDiscountedUtilities = np.zeros(size)
+        # discounted time spent in each state and discounted number of stroke entries of each patient
+        self.discountedStateTimes = np.zeros((size, len(HealthStates)))
+        self.discountedStrokeEntries = np.zeros(size)
+        # number of state transitions of all patients (including the end of the simulation)
+        self.nEvents = 0
+
+    def simulate(self, sim_length, stop_states=None, stream=0):
+        """ simulate all patients in this batch, advancing every patient that is still alive by one event
+        per iteration
+        :param sim_length: simulation length
+        :param stop_states: indices of states where patients stop being simulated
+            (so that they can be continued later, e.g. by a branch of this batch)
+        :param stream: index of the random number stream used by this call
+            (0 for the first call; calls that continue the simulation of patients should use another stream)
+        """
+
+        # random number generator for this batch
+        rng = np.random.RandomState(seed=self.id if stream == 0 else [self.id, stream])
+
+        # sampler of the time until next event and the next state
+        sampler = self.params.sampler
+        if_absorbing = sampler.ifAbsorbing
+
+        # states where patients stop being simulated
+        if_stop = if_absorbing.copy()
+        if stop_states is not None:
+            if_stop[stop_states] = True
+
+        # calculator of discounted cost and utility
+        discounter = self.params.discounter
+        profiler = self.profiler
+
+        # indices of patients who are not in an absorbing (or stop) state and
+        # have not reached the end of the simulation
+        active = np.flatnonzero(~if_stop[self.currentStates] & (self.times < sim_length))
+
+        while active.size > 0:
+
+            if profiler is not None:
+                start = time.perf_counter()
+
+            current_states = self.currentStates[active]
+            self.nEvents += active.size
+            ages = None if self.startingAges is None else self.startingAges[active] + self.times[active]
+            # rows of the current states in the tables of the sampler and the discounter
+            # (subgroup * number of states + state if patients belong to subgroups)
+            rows = current_states if self.subgroups is None \
+                else self.subgroups[active] * len(HealthStates) + current_states
+
+            # find time until next event (dt), and next state
+            if self.randomStreams is None:
+                dt, next_states = sampler.get_next_states(current_state_indices=rows, rng=rng, ages=ages)
+            else:
+                dt, next_states = self.randomStreams.get_next_states(
+                    sampler=sampler, positions=active, current_state_indices=current_states, ages=ages, rows=rows)
+
+            if profiler is not None:
+                profiler.record_time(phase='sampling', start=start)
+                start = time.perf_counter()
+
+            # if next event occurs beyond simulation length, the patient stays in the current state
+            # until the end of the simulation
+            t_start = self.times[active]
+            t_end = t_start + dt
+            if_censored = t_end > sim_length
+            t_end[if_censored] = sim_length
+            next_states[if_censored] = current_states[if_censored]
+
+            # record survival time and number of strokes
+            if_dead = np.isin(next_states, (HealthStates.STROKE_DEAD.value, HealthStates.NATURAL_DEATH.value))
+            self.survivalTimes[active[if_dead]] = t_end[if_dead]
+            self.nStrokes[active] += np.isin(next_states, (HealthStates.STROKE.value,
+                                                           HealthStates.STROKE_DEAD.value))
+
+            if self.traceWriter is not None:
+                self.traceWriter.record_events(patient_ids=self.id + active, times=t_end,
+                                               from_states=current_states, to_states=next_states)
+
+            if profiler is not None:
+                profiler.record_time(phase='state monitor', start=start)
+                start = time.perf_counter()
+
+            # discounted time in the current state during the period since the last event
+            # and the discounted stroke entry, if stroke occurred
+            discount_factors = discounter.get_discount_factors(t_starts=t_start, t_ends=t_end)
+            discounted_stroke_entries = discounter.get_discounted_stroke_entries(
+                t_ends=t_end, next_states=next_states)
+
+            # discounted cost and utility (continuously compounded) during this period
+            # (including the discounted stroke cost, if stroke occurred)
+            discounted_costs, discounted_utilities = discounter.get_discounted_payoffs_from_weights(
+                states=rows,
+                discount_factors=discount_factors,
+                discounted_stroke_entries=discounted_stroke_entries)
+            self.totalDiscountedCosts[active] += discounted_costs
+            self.totalDiscountedUtilities[active] += discounted_utilities
+            self.discountedStateTimes[active, current_states] += discount_factors
+            self.discountedStrokeEntries[active] += discounted_stroke_entries
+
+            if profiler is not None:
+                profiler.record_time(phase='discounting', start=start)
+                profiler.record_events(current_states=current_states,
+                                       next_states=next_states,
+                                       if_censored=if_censored,
+                                       if_absorbing=if_absorbing[next_states])
+
+            # update health states and times
+            self.currentStates[active] = next_states
+            self.times[active] = t_end
+
+            # patients who need to be simulated further
+            active = active[~if_censored & ~if_stop[next_states]]
+
+    def branch(self, parameters, profiler=None):
+        """
+        :param parameters: parameters to continue the simulation of patients with
+        :param profiler: (Profiler) of the branch
+        :return: (PatientBatch) a copy of this batch whose patients continue under the given parameters
+            (the discounted cost and utility accrued so far are re-calculated with the new costs and utilities)
+        """
+
+        branch = PatientBatch(id=self.id, size=0, parameters=parameters,
+                              random_streams=copy.deepcopy(self.randomStreams), profiler=profiler,
+                              starting_ages=self.startingAges)
+        branch.size = self.size
+        branch.currentStates = self.currentStates.copy()
+        branch.times = self.times.copy()
+        branch.survivalTimes = self.survivalTimes.copy()
+        branch.nStrokes = self.nStrokes.copy()
+        branch.discountedStateTimes = self.discountedStateTimes.copy()
+        branch.discountedStrokeEntries = self.discountedStrokeEntries.copy()
+        branch.nEvents = self.nEvents
+
+        discounter = parameters.discounter
+        branch.totalDiscountedCosts = (self.discountedStateTimes @ discounter.annualCosts
+                                       + discounter.strokeCost * self.discountedStrokeEntries)
+        branch.totalDiscountedUtilities = self.discountedStateTimes @ discounter.annualUtilities
+
+        return branch
+
+
 class Cohort:
-    def __init__(self, id, pop_size, parameters):
+    def __init__(self, id, pop_size, parameters, if_streaming=False, crn_seed=None,
+                 if_record_discounted_times=False, if_profile=False, sampling='random', trace_dir=None):
         """ create a cohort of patients
         :param id: cohort ID
         :param pop_size: population size of this cohort
         :param parameters: parameters
+        :param if_streaming: set to True to summarize outcomes with constant-memory accumulators
+            instead of storing the outcomes of every patient
+        :param crn_seed: if provided, patient n draws its random numbers from streams identified by
+            (crn_seed, n, type of event) so that cohorts with the same crn_seed use common random numbers
+        :param if_record_discounted_times: set to True to store the discounted time each patient spends in
+            each state and their discounted number of stroke entries (needed to re-cost the cohort
+            with Recosting.recost_cohort without simulating it again)
+        :param if_profile: set to True to collect the time spent in each phase of the simulation and
+            counts of events (stored in cohortOutcomes.profiler)
+        :param sampling: scheme to sample the random numbers of events (see RandomStreams.SAMPLING_SCHEMES):
+            'random', 'antithetic' (antithetic pairs of patients), or 'sobol' or 'stratified' (randomized
+            quasi-Monte Carlo points for the first events of patients); confidence intervals of outcomes
+            treat the groups of patients whose random numbers are dependent as independent observations
+        :param trace_dir: if provided, every transition of every patient is recorded in memory-mapped files
+            in this directory (read them with TraceClasses.EventTrace to calculate new outcomes of patients
+            without simulating the cohort again); outcomes are then not loaded from or saved in a ResultCache
         """
+
+        if if_streaming and if_record_discounted_times:
+            raise ValueError('Discounted times of patients cannot be recorded with streaming outcomes.')
+        if if_streaming and get_group_size(sampling) > 1:
+            raise ValueError("Streaming outcomes can only be used with sampling='random'.")
+
         self.id = id
         self.popSize = pop_size
         self.params = parameters
-        self.cohortOutcomes = CohortOutcomes()  # outcomes of the this simulated cohort
+        self.ifStreaming = if_streaming
+        self.crnSeed = crn_seed
+        self.ifRecordDiscountedTimes = if_record_discounted_times
+        self.ifProfile = if_profile
+        self.sampling = sampling
+        self.traceDir = trace_dir
+        self.cohortOutcomes = self.create_cohort_outcomes()  # outcomes of the this simulated cohort
 
-    def simulate(self, sim_length):
+    def create_cohort_outcomes(self):
+        """
+        :return: an empty CohortOutcomes or StreamingCohortOutcomes to store the outcomes of this cohort
+        """
+        profiler = Profiler(name='Cohort ' + str(self.id)) if self.ifProfile else None
+        if self.ifStreaming:
+            return StreamingCohortOutcomes(profiler=profiler)
+        else:
+            return CohortOutcomes(if_record_discounted_times=self.ifRecordDiscountedTimes, profiler=profiler,
+                                  group_size=get_group_size(self.sampling))
+
+    def simulate(self, sim_length, engine='object', batch_size=100000, n_workers=1,
+                 checkpoint_dir=None, checkpoint_interval=100000, if_resume=False, cache=None):
         """ simulate the cohort of patients over the specified number of time-steps
         :param sim_length: simulation length
+        :param engine: 'object' to simulate patients one at a time or
+                       'vectorized' to simulate batches of patients with NumPy arrays
+        :param batch_size: number of patients simulated together (only used by the 'vectorized' engine)
+        :param n_workers: number of worker processes to split the patients of this cohort across
+        :param checkpoint_dir: directory to save checkpoints in (if None, no checkpoint is saved)
+        :param checkpoint_interval: number of patients simulated between checkpoints
+            (for the 'vectorized' engine, checkpoints are saved after the first batch that reaches this number)
+        :param if_resume: set to True to continue from the latest checkpoint in checkpoint_dir, if any
+            (since every patient is seeded by id * pop_size + n, the results are the same as
+            an uninterrupted run)
+        :param cache: (ResultCache) to load the outcomes of this cohort from, if it was simulated before
+            with the same parameters and settings, or to save them in after the simulation
         """
 
-        # populate and simulate the cohort
-        for i in range(self.popSize):
-            # create a new patient (use id * pop_size + n as patient id)
-            patient = Patient(id=self.id * self.popSize + i,
-                              parameters=self.params)
-            # simulate
-            patient.simulate(sim_length)
+        if n_workers > 1:
+            simulate_cohorts(cohorts=[self], sim_length=sim_length,
+                             engine=engine, batch_size=batch_size, n_workers=n_workers,
+                             checkpoint_dir=checkpoint_dir, checkpoint_interval=checkpoint_interval,
+                             if_resume=if_resume, cache=cache)
+            return
+
+        # a cohort whose outcomes cannot be cached (e.g. whose trace is recorded) is always simulated
+        if not self.get_if_cacheable():
+            cache = None
+        if self.traceDir is not None:
+            remove_trace(self.traceDir)
 
-            # store outputs of this simulation
-            self.cohortOutcomes.extract_outcome(simulated_patient=patient)
+        # load the outcomes of this cohort if it is cached
+        if cache is not None and cache.load(cohort=self, sim_length=sim_length, engine=engine, batch_size=batch_size):
+            self.cohortOutcomes.calculate_cohort_outcomes(initial_pop_size=self.popSize)
+            return
+
+        # simulate all patients of this cohort
+        self.simulate_patients(sim_length=sim_length,
+                               first_index=0, last_index=self.popSize,
+                               cohort_outcomes=self.cohortOutcomes,
+                               engine=engine, batch_size=batch_size,
+                               checkpoint_dir=checkpoint_dir, checkpoint_interval=checkpoint_interval,
+                               if_resume=if_resume)
 
         # calculate cohort outcomes
         self.cohortOutcomes.calculate_cohort_outcomes(initial_pop_size=self.popSize)
 
+        if cache is not None:
+            cache.save(cohort=self, sim_length=sim_length, engine=engine, batch_size=batch_size)
+
+    def simulate_patients(self, sim_length, first_index, last_index, cohort_outcomes,
+                          engine='object', batch_size=100000,
+                          checkpoint_dir=None, checkpoint_interval=100000, if_resume=False):
+        """ simulate patients first_index, ..., last_index - 1 of this cohort
+        :param sim_length: simulation length
+        :param first_index: index of the first patient to simulate
+        :param last_index: index of the patient after the last patient to simulate
+        :param cohort_outcomes: (CohortOutcomes) to store the outcomes of simulated patients in
+        :param engine: 'object' or 'vectorized'
+        :param batch_size: number of patients simulated together (only used by the 'vectorized' engine)
+        :param checkpoint_dir: directory to save checkpoints in (if None, no checkpoint is saved)
+        :param checkpoint_interval: number of patients simulated between checkpoints
+        :param if_resume: set to True to continue from the checkpoint of these patients in checkpoint_dir, if any
+        """
+
+        if engine not in ('object', 'vectorized'):
+            raise ValueError("engine should be either 'object' or 'vectorized'.")
+        if self.traceDir is not None and if_resume:
+            raise ValueError('The trace of patients cannot be recorded when resuming from a checkpoint.')
+
+        profiler = cohort_outcomes.profiler
+
+        # writer of the transitions of these patients (a part of the trace of the cohort)
+        trace_writer = None
+        if self.traceDir is not None:
+            trace_writer = TraceWriter(directory=get_part_directory(self.traceDir, first_index, last_index),
+                                       id_offset=self.id * self.popSize,
+                                       first_index=first_index, last_index=last_index)
+
+        # index of the next patient to simulate
+        next_index = first_index
+        checkpoint = None
+        if checkpoint_dir is not None:
+            checkpoint = _Checkpoint(
+                file_name=os.path.join(checkpoint_dir, 'cohort{}_{}_{}.npz'.format(self.id, first_index, last_index)),
+                metadata={'cohort_id': self.id, 'pop_size': self.popSize,
+                          'first_index': first_index, 'last_index': last_index,
+                          'sim_length': sim_length, 'engine': engine, 'batch_size': batch_size,
+                          'crn_seed': -1 if self.crnSeed is None else self.crnSeed,
+                          'sampling': self.sampling},
+                interval=checkpoint_interval)
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            if if_resume:
+                next_index = checkpoint.load(cohort_outcomes=cohort_outcomes, default_next_index=first_index)
+
+        if engine == 'object':
+            # random numbers and starting ages are created once for the patients of each group of dependent
+            # patients (e.g. the quasi-random points of a group are randomized once, not once per patient)
+            group_size = get_group_size(self.sampling)
+            group_first_index = group_last_index = next_index
+            random_streams = starting_ages = None
+
+            # populate and simulate the cohort
+            for i in range(next_index, last_index):
+                if i == group_last_index:
+                    group_first_index = i
+                    group_last_index = min(last_index, (i // group_size + 1) * group_size)
+                    random_streams = self.get_random_streams(first_index=i, size=group_last_index - i)
+                    starting_ages = self.get_starting_ages(first_index=i, size=group_last_index - i,
+                                                           random_streams=random_streams)
+
+                # create a new patient (use id * pop_size + n as patient id)
+                position = i - group_first_index
+                patient = Patient(id=self.id * self.popSize + i,
+                                  parameters=self.params,
+                                  random_streams=random_streams,
+                                  profiler=profiler,
+                                  starting_age=None if starting_ages is None else float(starting_ages[position]),
+                                  trace_writer=trace_writer,
+                                  position=position)
+                # simulate
+                patient.simulate(sim_length)
+
+                # store outputs of this simulation
+                if profiler is None:
+                    cohort_outcomes.extract_outcome(simulated_patient=patient)
+                else:
+                    with profiler.phase('outcome extraction'):
+                        cohort_outcomes.extract_outcome(simulated_patient=patient)
+
+                if checkpoint is not None:
+                    checkpoint.save_if_due(cohort_outcomes=cohort_outcomes, next_index=i + 1)
+
+        else:
+            # simulate the cohort in batches of patients
+            for i in range(next_index, last_index, batch_size):
+                # create a new batch of patients
+                size = min(batch_size, last_index - i)
+                batch = self.create_batch(first_index=i, size=size, profiler=profiler, trace_writer=trace_writer)
+                # simulate
+                batch.simulate(sim_length)
+
+                # store outputs of this simulation
+                if profiler is None:
+                    cohort_outcomes.extract_outcomes(simulated_batch=batch)
+                else:
+                    with profiler.phase('outcome extraction'):
+                        cohort_outcomes.extract_outcomes(simulated_batch=batch)
+
+                if checkpoint is not None:
+                    checkpoint.save_if_due(cohort_outcomes=cohort_outcomes, next_index=i + size)
+
+        # save the outcomes of all patients
+        if checkpoint is not None:
+            checkpoint.save(cohort_outcomes=cohort_outcomes, next_index=last_index)
+        if trace_writer is not None:
+            trace_writer.close()
+
+    def create_batch(self, first_index, size, profiler=None, trace_writer=None):
+        """
+        :param first_index: index of the first patient
+        :param size: number of patients
+        :param profiler: (Profiler) to collect the time spent in each phase and counts of events
+        :param trace_writer: (TraceWriter) to record the transitions of patients in
+        :return: (PatientBatch) a batch of these patients (its id is id * pop_size + first_index)
+        """
+
+        random_streams = self.get_random_streams(first_index=first_index, size=size)
+        return PatientBatch(id=self.id * self.popSize + first_index,
+                            size=size,
+                            parameters=self.params,
+                            random_streams=random_streams,
+                            profiler=profiler,
+                            starting_ages=self.get_starting_ages(first_index=first_index, size=size,
+                                                                 random_streams=random_streams),
+                            trace_writer=trace_writer)
+
+    def get_if_cacheable(self):
+        """
+        :return: True if the outcomes of this cohort can be loaded from or saved in a ResultCache
+            (the trace of patients is not cached, so a cohort whose trace is recorded is not cacheable)
+        """
+        return self.traceDir is None
+
+    def get_random_streams(self, first_index, size):
+        """
+        :param first_index: index of the first patient
+        :param size: number of patients
+        :return: (CommonRandomStreams) common random numbers of these patients
+            (None if this cohort uses neither common random numbers nor a variance-reduction sampling scheme;
+            without common random numbers, the streams of a variance-reduction scheme are seeded by the cohort id)
+        """
+
+        if self.crnSeed is None and self.sampling == 'random':
+            return None
+
+        seed = self.id if self.crnSeed is None else self.crnSeed
+        patient_indices = np.arange(first_index, first_index + size)
+        if self.sampling == 'random':
+            return CommonRandomStreams(seed=seed, patient_indices=patient_indices)
+        elif self.sampling == 'antithetic':
+            return AntitheticStreams(seed=seed, patient_indices=patient_indices)
+        else:
+            return QuasiRandomStreams(seed=seed, patient_indices=patient_indices, scheme=self.sampling)
+
+    def get_starting_ages(self, first_index, size, random_streams=None):
+        """
+        :param first_index: index of the first patient
+        :param size: number of patients
+        :param random_streams: (CommonRandomStreams) common random numbers of these patients, if any
+        :return: (numpy.array) age of these patients at the start of the simulation
+            (None if transition rates do not depend on age). The age of patient n depends only on
+            the patient id (or on (crn_seed, n) with common random numbers), so it does not depend on
+            the engine or on how patients are split into batches.
+        """
+
+        if not self.params.ifAgeDependent:
+            return None
+        if random_streams is None:
+            uniforms = get_uniform_keys(ids=np.arange(first_index, first_index + size) + self.id * self.popSize,
+                                        stream=STARTING_AGE_STREAM)
+        else:
+            uniforms = random_streams.get_uniforms(stream=STARTING_AGE_STREAM)
+        return self.params.get_starting_ages(uniforms=uniforms)
+
+    def get_shards(self, n_shards, engine='object', batch_size=100000):
+        """
+        :param n_shards: number of shards to split the patients of this cohort into
+        :param engine: 'object' or 'vectorized'
+        :param batch_size: number of patients simulated together (only used by the 'vectorized' engine)
+        :return: list of (first_index, last_index) of patients in each shard
+            (for the 'vectorized' engine, shards start at a multiple of batch_size so that every batch,
+            and hence its random number stream, is the same as in a single-process run)
+        """
+
+        unit = batch_size if engine == 'vectorized' else 1
+        n_units = -(-self.popSize // unit)
+        n_shards = max(1, min(n_shards, n_units))
+
+        shards = []
+        for k in range(n_shards):
+            first_index = min(self.popSize, (k * n_units // n_shards) * unit)
+            last_index = min(self.popSize, ((k + 1) * n_units // n_shards) * unit)
+            shards.append((first_index, last_index))
+        return shards
+
+
+def simulate_cohorts(cohorts, sim_length, engine='object', batch_size=100000, n_workers=1,
+                     checkpoint_dir=None, checkpoint_interval=100000, if_resume=False, cache=None):
+    """ simulate several cohorts at the same time by splitting each cohort into shards of patients
+    and simulating every shard in a worker process
+    (since each patient is seeded by id * pop_size + n, the results are the same as simulating
+    the cohorts one after another in a single process)
+    :param cohorts: list of cohorts to simulate
+    :param sim_length: simulation length
+    :param engine: 'object' or 'vectorized'
+    :param batch_size: number of patients simulated together (only used by the 'vectorized' engine)
+    :param n_workers: number of worker processes
+    :param checkpoint_dir: directory to save checkpoints in (if None, no checkpoint is saved;
+        each shard of patients has its own checkpoint, so resuming needs the same number of workers)
+    :param checkpoint_interval: number of patients of a shard simulated between checkpoints
+    :param if_resume: set to True to continue each shard from its latest checkpoint in checkpoint_dir, if any
+    :param cache: (ResultCache) to load the outcomes of cohorts that were simulated before from,
+        and to save the outcomes of newly simulated cohorts in
+    """
+
+    if n_workers <= 1:
+        for cohort in cohorts:
+            cohort.simulate(sim_length=sim_length, engine=engine, batch_size=batch_size,
+                            checkpoint_dir=checkpoint_dir, checkpoint_interval=checkpoint_interval,
+                            if_resume=if_resume, cache=cache)
+        return
+
+    # load the outcomes of cached cohorts and only simulate the others
+    # (cohorts that are not cacheable, e.g. whose trace is recorded, are always simulated)
+    for cohort in cohorts:
+        if cohort.traceDir is not None:
+            remove_trace(cohort.traceDir)
+    if cache is not None:
+        cohorts_to_simulate = []
+        for cohort in cohorts:
+            if cohort.get_if_cacheable() and cache.load(cohort=cohort, sim_length=sim_length, engine=engine,
+                                                        batch_size=batch_size):
+                cohort.cohortOutcomes.calculate_cohort_outcomes(initial_pop_size=cohort.popSize)
+            else:
+                cohorts_to_simulate.append(cohort)
+        cohorts = cohorts_to_simulate
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+
+        # submit the shards of all cohorts
+        futures = []
+        for cohort in cohorts:
+            futures.append([
+                executor.submit(_simulate_shard, cohort, sim_length, first_index, last_index, engine, batch_size,
+                                checkpoint_dir, checkpoint_interval, if_resume)
+                for first_index, last_index in cohort.get_shards(
+                    n_shards=n_workers, engine=engine, batch_size=batch_size)])
+
+        # merge the outcomes of shards (in the order of patients) and calculate cohort outcomes
+        for cohort, cohort_futures in zip(cohorts, futures):
+            for future in cohort_futures:
+                cohort.cohortOutcomes.merge(future.result())
+            cohort.cohortOutcomes.calculate_cohort_outcomes(initial_pop_size=cohort.popSize)
+            if cache is not None and cohort.get_if_cacheable():
+                cache.save(cohort=cohort, sim_length=sim_length, engine=engine, batch_size=batch_size)
+
+
+def _simulate_shard(cohort, sim_length, first_index, last_index, engine, batch_size,
+                    checkpoint_dir=None, checkpoint_interval=100000, if_resume=False):
+    """ simulates a shard of patients of a cohort (runs in a worker process)
+    :return: (CohortOutcomes) outcomes of the patients in this shard
+    """
+
+    shard_outcomes = cohort.create_cohort_outcomes()
+    cohort.simulate_patients(sim_length=sim_length,
+                             first_index=first_index, last_index=last_index,
+                             cohort_outcomes=shard_outcomes,
+                             engine=engine, batch_size=batch_size,
+                             checkpoint_dir=checkpoint_dir, checkpoint_interval=checkpoint_interval,
+                             if_resume=if_resume)
+    return shard_outcomes
+
+
+def simulate_arms(cohorts, sim_length, batch_size=100000, n_workers=1):
+    """ simulates the same patients under several arms (e.g. therapies) with the vectorized engine;
+    the trajectory of every patient is simulated once while it only visits states whose rates out
+    are the same in all arms, and is then branched into each arm
+    (patient n of every arm shares this prefix, so the outcomes of arms are paired)
+    :param cohorts: one cohort per arm (with the same population size and crn_seed; the id of the first
+        cohort seeds the random number streams of all arms)
+    :param sim_length: simulation length
+    :param batch_size: number of patients simulated together
+    :param n_workers: number of worker processes
+    """
+
+    reference = cohorts[0]
+    if any(isinstance(cohort.params, SubgroupParameters) for cohort in cohorts):
+        raise ValueError('Arms cannot share the trajectories of patients who belong to subgroups.')
+    for cohort in cohorts[1:]:
+        if cohort.popSize != reference.popSize or cohort.crnSeed != reference.crnSeed \
+                or cohort.sampling != reference.sampling:
+            raise ValueError('Cohorts of all arms should have the same population size, crn_seed and sampling.')
+        if cohort.params.initialHealthState != reference.params.initialHealthState:
+            raise ValueError('Cohorts of all arms should start in the same health state.')
+        if list(cohort.params.ageBreaks) != list(reference.params.ageBreaks) \
+                or not np.array_equal(cohort.params.startingAges, reference.params.startingAges) \
+                or not np.array_equal(cohort.params.startingAgeCumProbs, reference.params.startingAgeCumProbs):
+            raise ValueError('Cohorts of all arms should have the same age bands and starting age distribution.')
+    if any(cohort.traceDir is not None for cohort in cohorts):
+        raise ValueError('The trace of patients cannot be recorded when arms share the trajectories of patients.')
+
+    # patients stop the shared part of their trajectory when they enter a state whose rates out differ across arms
+    # (at any age)
+    trans_rate_matrices = np.array([cohort.params.transRateMatrices for cohort in cohorts], dtype=float)
+    stop_states = np.flatnonzero((trans_rate_matrices != trans_rate_matrices[0]).any(axis=(0, 1, 3)))
+
+    shards = reference.get_shards(n_shards=n_workers, engine='vectorized', batch_size=batch_size)
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            shard_outcomes = list(executor.map(
+                _simulate_arms_shard, *zip(*[(cohorts, sim_length, first_index, last_index, batch_size, stop_states)
+                                             for first_index, last_index in shards])))
+    else:
+        shard_outcomes = [_simulate_arms_shard(cohorts, sim_length, first_index, last_index, batch_size, stop_states)
+                          for first_index, last_index in shards]
+
+    # merge the outcomes of shards (in the order of patients) and calculate cohort outcomes
+    for k, cohort in enumerate(cohorts):
+        for arm_outcomes in shard_outcomes:
+            cohort.cohortOutcomes.merge(arm_outcomes[k])
+        cohort.cohortOutcomes.calculate_cohort_outcomes(initial_pop_size=cohort.popSize)
+
+
+def _simulate_arms_shard(cohorts, sim_length, first_index, last_index, batch_size, stop_states):
+    """ simulates a shard of patients under all arms (runs in a worker process if n_workers > 1)
+    :return: (list) outcomes of the patients in this shard under each arm
+    """
+
+    reference = cohorts[0]
+    arm_outcomes = [cohort.create_cohort_outcomes() for cohort in cohorts]
+
+    for i in range(first_index, last_index, batch_size):
+        size = min(batch_size, last_index - i)
+
+        # simulate patients until they enter a state whose rates out differ across arms
+        shared_batch = reference.create_batch(first_index=i, size=size, profiler=arm_outcomes[0].profiler)
+        shared_batch.simulate(sim_length, stop_states=stop_states)
+
+        # continue the simulation of patients under each arm
+        for cohort, cohort_outcomes in zip(cohorts, arm_outcomes):
+            batch = shared_batch.branch(parameters=cohort.params, profiler=cohort_outcomes.profiler)
+            batch.simulate(sim_length, stream=1)
+            cohort_outcomes.extract_outcomes(simulated_batch=batch)
+
+    return arm_outcomes
+
+
+class _Checkpoint:
+    def __init__(self, file_name, metadata, interval):
+        """ periodically saves the outcomes of the patients simulated so far and the index of
+        the next patient to simulate (no random number generator state is needed since
+        every patient or batch is seeded by its index)
+        :param file_name: name of the checkpoint file
+        :param metadata: (dictionary) settings of the run that must not change when it is resumed
+        :param interval: number of patients simulated between checkpoints
+        """
+
+        self.fileName = file_name
+        self.metadata = metadata
+        self.interval = interval
+        self.lastSavedIndex = None  # index of the next patient when the last checkpoint was saved
+
+    def load(self, cohort_outcomes, default_next_index):
+        """ restores the outcomes saved in the checkpoint file, if it exists
+        :param cohort_outcomes: (CohortOutcomes) to restore the saved outcomes into
+        :param default_next_index: index of the next patient if there is no checkpoint
+        :return: index of the next patient to simulate
+        """
+
+        if not os.path.exists(self.fileName):
+            self.lastSavedIndex = default_next_index
+            return default_next_index
+
+        metadata, arrays = load_checkpoint(self.fileName)
+        next_index = metadata.pop('next_index')
+        if metadata != self.metadata:
+            raise ValueError('The checkpoint {} was saved by a run with different settings: {}.'.format(
+                self.fileName, metadata))
+
+        cohort_outcomes.set_state(arrays)
+        self.lastSavedIndex = next_index
+        return next_index
+
+    def save_if_due(self, cohort_outcomes, next_index):
+        """ saves a checkpoint if at least 'interval' patients were simulated since the last one """
+
+        if self.lastSavedIndex is None:
+            self.lastSavedIndex = self.metadata['first_index']
+        if next_index - self.lastSavedIndex >= self.interval:
+            self.save(cohort_outcomes=cohort_outcomes, next_index=next_index)
+
+    def save(self, cohort_outcomes, next_index):
+        """ saves the outcomes of patients simulated so far and the index of the next patient """
+
+        if next_index == self.lastSavedIndex:
+            return
+        save_checkpoint(file_name=self.fileName,
+                        metadata=dict(self.metadata, next_index=next_index),
+                        arrays=cohort_outcomes.get_state())
+        self.lastSavedIndex = next_index
+
 
 class CohortOutcomes:
-    def __init__(self):
+    def __init__(self, if_record_discounted_times=False, death_time_bin_width=0.1, profiler=None, group_size=1,
+                 first_index=0):
+        """
+        :param if_record_discounted_times: set to True to store the discounted time each patient spends in
+            each state and their discounted number of stroke entries
+        :param death_time_bin_width: width of the bins of death times used to build the survival curve
+        :param profiler: (Profiler) to collect the time spent in each phase and counts of events
+        :param group_size: number of consecutive patients whose outcomes are dependent
+            (e.g. 2 for antithetic pairs; confidence intervals are calculated from the totals of these groups)
+        :param first_index: index in the cohort of the first patient whose outcomes are stored here
+            (groups of dependent patients start at multiples of group_size in the cohort)
+        """
 
         self.survivalTimes = []
+        self.deathIndices = []      # index of the patient of each survival time
         self.nTotalStrokes = []
         self.nLivingPatients = None
         self.costs = []
         self.utilities = []
+        self.nEvents = 0    # number of state transitions simulated
+        self.profiler = profiler
+
+        self.deathTimeBinWidth = death_time_bin_width
+        self.ifRecordDiscountedTimes = if_record_discounted_times
+        self.groupSize = group_size
+        self.firstIndex = first_index
+        self.discountedStateTimes = []      # one row per patient and one column per state
+        self.discountedStrokeEntries = []
 
         self.statSurvivalTime = None
         self.statNumStrokes = None
@@ -175,25 +931,299 @@ class CohortOutcomes:
         # record survival time and time until AIDS
         if not (simulated_patient.stateMonitor.survivalTime is None):
             self.survivalTimes.append(simulated_patient.stateMonitor.survivalTime)
+            self.deathIndices.append(len(self.costs))
         self.nTotalStrokes.append(simulated_patient.stateMonitor.nStrokes)
+        self.nEvents += simulated_patient.stateMonitor.nEvents
         self.costs.append(simulated_patient.stateMonitor.costUtilityMonitor.totalDiscountedCost)
         self.utilities.append(simulated_patient.stateMonitor.costUtilityMonitor.totalDiscountedUtility)
+        if self.ifRecordDiscountedTimes:
+            self.discountedStateTimes.append(simulated_patient.stateMonitor.costUtilityMonitor.discountedStateTimes)
+            self.discountedStrokeEntries.append(
+                simulated_patient.stateMonitor.costUtilityMonitor.discountedStrokeEntries)
+
+    def extract_outcomes(self, simulated_batch):
+        """ extracts outcomes of a simulated batch of patients
+        :param simulated_batch: a simulated batch of patients"""
+
+        # record survival times of patients who died, number of strokes, costs and utilities
+        survival_times = simulated_batch.survivalTimes
+        self.survivalTimes.extend(survival_times[~np.isnan(survival_times)].tolist())
+        self.deathIndices.extend((len(self.costs) + np.flatnonzero(~np.isnan(survival_times))).tolist())
+        self.nTotalStrokes.extend(simulated_batch.nStrokes.tolist())
+        self.nEvents += simulated_batch.nEvents
+        self.costs.extend(simulated_batch.totalDiscountedCosts.tolist())
+        self.utilities.extend(simulated_batch.totalDiscountedUtilities.tolist())
+        if self.ifRecordDiscountedTimes:
+            self.discountedStateTimes.extend(simulated_batch.discountedStateTimes)
+            self.discountedStrokeEntries.extend(simulated_batch.discountedStrokeEntries.tolist())
+
+    def merge(self, other):
+        """ appends the outcomes of patients stored in another CohortOutcomes
+        :param other: (CohortOutcomes) outcomes of another shard of patients
+        """
+
+        self.survivalTimes.extend(other.survivalTimes)
+        self.deathIndices.extend((len(self.costs) + np.asarray(other.deathIndices, dtype=int)).tolist())
+        self.nTotalStrokes.extend(other.nTotalStrokes)
+        self.nEvents += other.nEvents
+        self.costs.extend(other.costs)
+        self.utilities.extend(other.utilities)
+        self.discountedStateTimes.extend(other.discountedStateTimes)
+        self.discountedStrokeEntries.extend(other.discountedStrokeEntries)
+        if self.profiler is not None and other.profiler is not None:
+            self.profiler.merge(other.profiler)
+
+    def get_mean_cost_and_utility(self):
+        """
+        :return: (mean discounted cost, mean discounted utility) of patients extracted so far
+        """
+        return np.mean(self.costs), np.mean(self.utilities)
+
+    def get_subsets(self, boundaries):
+        """
+        :param boundaries: (list) index of the first patient of each subset of consecutive patients,
+            followed by the number of patients
+        :return: (list) a CohortOutcomes with the outcomes of the patients in each subset (cohort outcomes are
+            not calculated; the number of events is not split into subsets and is 0). Subsets share the arrays of
+            the outcomes of patients, so the outcomes of more patients cannot be extracted into them.
+        """
+
+        state = self.get_state()
+        boundaries = np.asarray(boundaries, dtype=int)
+        death_boundaries = np.searchsorted(state['death_indices'], boundaries)
+        if_record_discounted_times = len(state['discounted_state_times']) > 0
+
+        subsets = []
+        for k in range(len(boundaries) - 1):
+            first, last = boundaries[k], boundaries[k + 1]
+            first_death, last_death = death_boundaries[k], death_boundaries[k + 1]
+            subset = CohortOutcomes(if_record_discounted_times=self.ifRecordDiscountedTimes,
+                                    death_time_bin_width=self.deathTimeBinWidth,
+                                    group_size=self.groupSize,
+                                    first_index=self.firstIndex + first)
+            subset.set_state({
+                'survival_times': state['survival_times'][first_death:last_death],
+                'death_indices': state['death_indices'][first_death:last_death] - first,
+                'n_total_strokes': state['n_total_strokes'][first:last],
+                'costs': state['costs'][first:last],
+                'utilities': state['utilities'][first:last],
+                'n_events': 0,
+                'discounted_state_times': state['discounted_state_times'][first:last]
+                if if_record_discounted_times else state['discounted_state_times'],
+                'discounted_stroke_entries': state['discounted_stroke_entries'][first:last]
+                if if_record_discounted_times else state['discounted_stroke_entries']},
+                if_copy=False)
+            subsets.append(subset)
+
+        return subsets
+
+    def get_state(self):
+        """
+        :return: (dictionary) numpy.arrays of the outcomes of patients extracted so far (used for checkpoints)
+        """
+
+        return {'survival_times': np.array(self.survivalTimes, dtype=float),
+                'death_indices': np.array(self.deathIndices, dtype=int),
+                'n_total_strokes': np.array(self.nTotalStrokes, dtype=int),
+                'costs': np.array(self.costs, dtype=float),
+                'utilities': np.array(self.utilities, dtype=float),
+                'n_events': np.array(self.nEvents),
+                'discounted_state_times': np.array(self.discountedStateTimes, dtype=float).reshape(
+                    -1, len(HealthStates)),
+                'discounted_stroke_entries': np.array(self.discountedStrokeEntries, dtype=float)}
+
+    def set_state(self, state, if_copy=True):
+        """
+        :param state: (dictionary) returned by get_state
+        :param if_copy: set to False to use the arrays of state (e.g. memory-mapped arrays) without copying them
+            (the outcomes of more patients cannot be extracted afterwards)
+        """
+
+        self.nEvents = int(state['n_events'])
+        if if_copy:
+            self.survivalTimes = state['survival_times'].tolist()
+            self.deathIndices = state['death_indices'].tolist()
+            self.nTotalStrokes = state['n_total_strokes'].tolist()
+            self.costs = state['costs'].tolist()
+            self.utilities = state['utilities'].tolist()
+            self.discountedStateTimes = list(state['discounted_state_times'])
+            self.discountedStrokeEntries = state['discounted_stroke_entries'].tolist()
+        else:
+            self.survivalTimes = state['survival_times']
+            self.deathIndices = state['death_indices']
+            self.nTotalStrokes = state['n_total_strokes']
+            self.costs = state['costs']
+            self.utilities = state['utilities']
+            self.discountedStateTimes = state['discounted_state_times']
+            self.discountedStrokeEntries = state['discounted_stroke_entries']
 
     def calculate_cohort_outcomes(self, initial_pop_size):
         """ calculates the cohort outcomes
         :param initial_pop_size: initial population size
         """
+        import deampy.statistics as stats
+
+        from SurvivalCurves import SurvivalCurve
+
+        if self.profiler is not None:
+            start = time.perf_counter()
 
         # summary statistics
-        self.statNumStrokes = stats.SummaryStat(name='Number of strokes', data=self.nTotalStrokes)
-        self.statSurvivalTime = stats.SummaryStat(name='Survival Time', data=self.survivalTimes)
-        self.statCost = stats.SummaryStat(name='Discounted Cost', data=self.costs)
-        self.statUtility = stats.SummaryStat(name='Discounted Utility', data=self.utilities)
+        if self.groupSize == 1:
+            self.statNumStrokes = stats.SummaryStat(name='Number of strokes', data=self.nTotalStrokes)
+            self.statSurvivalTime = stats.SummaryStat(name='Survival Time', data=self.survivalTimes)
+            self.statCost = stats.SummaryStat(name='Discounted Cost', data=self.costs)
+            self.statUtility = stats.SummaryStat(name='Discounted Utility', data=self.utilities)
+        else:
+            # outcomes are independent across groups of patients, not across patients
+            # (the first group may be incomplete if these patients do not start at the start of a group)
+            offset = self.firstIndex % self.groupSize
+            groups = (offset + np.arange(len(self.costs))) // self.groupSize
+            n_groups = -(-(offset + len(self.costs)) // self.groupSize)
+            self.statNumStrokes = GroupedStat(name='Number of strokes', data=self.nTotalStrokes,
+                                              groups=groups, n_groups=n_groups)
+            self.statSurvivalTime = GroupedStat(name='Survival Time', data=self.survivalTimes,
+                                                groups=(offset + np.asarray(self.deathIndices, dtype=int))
+                                                // self.groupSize,
+                                                n_groups=n_groups)
+            self.statCost = GroupedStat(name='Discounted Cost', data=self.costs, groups=groups, n_groups=n_groups)
+            self.statUtility = GroupedStat(name='Discounted Utility', data=self.utilities,
+                                           groups=groups, n_groups=n_groups)
+
+        if self.profiler is not None:
+            self.profiler.record_time(phase='summary statistics', start=start)
+            start = time.perf_counter()
+
+        # survival curve
+        self.nLivingPatients = SurvivalCurve(
+            name='# of living patients',
+            initial_size=initial_pop_size,
+            time_step=self.deathTimeBinWidth,
+            survival_times=self.survivalTimes
+        )
+
+        if self.profiler is not None:
+            self.profiler.record_time(phase='survival curve', start=start)
+
+
+class StreamingCohortOutcomes:
+    def __init__(self, reservoir_size=10000, death_time_bin_width=0.1, profiler=None):
+        """ outcomes of a cohort summarized by accumulators that use constant memory
+        and can be merged across shards
+        :param reservoir_size: size of the random sample of patient outcomes kept for percentiles and plots
+        :param death_time_bin_width: width of the bins of death times used to build the survival curve
+        :param profiler: (Profiler) to collect the time spent in each phase and counts of events
+        """
+
+        self.statSurvivalTime = OnlineStat(name='Survival Time', reservoir_size=reservoir_size)
+        self.statNumStrokes = OnlineStat(name='Number of strokes', reservoir_size=reservoir_size)
+        self.statCost = OnlineStat(name='Discounted Cost', reservoir_size=reservoir_size)
+        self.statUtility = OnlineStat(name='Discounted Utility', reservoir_size=reservoir_size)
+        self.deathTimeCounts = BinnedCounts(bin_width=death_time_bin_width)
+        self.nEvents = 0    # number of state transitions simulated
+        self.profiler = profiler
+
+        # random samples of patient outcomes (populated by calculate_cohort_outcomes)
+        self.survivalTimes = None
+        self.nTotalStrokes = None
+        self.costs = None
+        self.utilities = None
+        self.nLivingPatients = None
+
+    def extract_outcome(self, simulated_patient):
+        """ extracts outcomes of a simulated patient
+        :param simulated_patient: a simulated patient"""
+
+        key = get_uniform_keys(simulated_patient.id)
+        state_monitor = simulated_patient.stateMonitor
+
+        if not (state_monitor.survivalTime is None):
+            self.statSurvivalTime.record(values=state_monitor.survivalTime, keys=key)
+            self.deathTimeCounts.record(values=state_monitor.survivalTime)
+        self.statNumStrokes.record(values=state_monitor.nStrokes, keys=key)
+        self.nEvents += state_monitor.nEvents
+        self.statCost.record(values=state_monitor.costUtilityMonitor.totalDiscountedCost, keys=key)
+        self.statUtility.record(values=state_monitor.costUtilityMonitor.totalDiscountedUtility, keys=key)
+
+    def extract_outcomes(self, simulated_batch):
+        """ extracts outcomes of a simulated batch of patients
+        :param simulated_batch: a simulated batch of patients"""
+
+        keys = get_uniform_keys(simulated_batch.id + np.arange(simulated_batch.size))
+        if_dead = ~np.isnan(simulated_batch.survivalTimes)
+
+        self.statSurvivalTime.record(values=simulated_batch.survivalTimes[if_dead], keys=keys[if_dead])
+        self.deathTimeCounts.record(values=simulated_batch.survivalTimes[if_dead])
+        self.statNumStrokes.record(values=simulated_batch.nStrokes, keys=keys)
+        self.nEvents += simulated_batch.nEvents
+        self.statCost.record(values=simulated_batch.totalDiscountedCosts, keys=keys)
+        self.statUtility.record(values=simulated_batch.totalDiscountedUtilities, keys=keys)
+
+    def merge(self, other):
+        """ merges the accumulators of another shard of patients
+        :param other: (StreamingCohortOutcomes) outcomes of another shard of patients
+        """
+
+        self.statSurvivalTime.merge(other.statSurvivalTime)
+        self.statNumStrokes.merge(other.statNumStrokes)
+        self.statCost.merge(other.statCost)
+        self.statUtility.merge(other.statUtility)
+        self.deathTimeCounts.merge(other.deathTimeCounts)
+        self.nEvents += other.nEvents
+        if self.profiler is not None and other.profiler is not None:
+            self.profiler.merge(other.profiler)
+
+    def get_mean_cost_and_utility(self):
+        """
+        :return: (mean discounted cost, mean discounted utility) of patients extracted so far
+        """
+        return self.statCost.get_mean(), self.statUtility.get_mean()
+
+    def get_state(self):
+        """
+        :return: (dictionary) numpy.arrays of the accumulators (used for checkpoints)
+        """
+
+        state = get_state_of_stats(self._get_accumulators())
+        state['n_events'] = np.array(self.nEvents)
+        return state
+
+    def set_state(self, state):
+        """
+        :param state: (dictionary) returned by get_state
+        """
+
+        set_state_of_stats(self._get_accumulators(), state)
+        self.nEvents = int(state['n_events'])
+
+    def _get_accumulators(self):
+        return {'statSurvivalTime': self.statSurvivalTime,
+                'statNumStrokes': self.statNumStrokes,
+                'statCost': self.statCost,
+                'statUtility': self.statUtility,
+                'deathTimeCounts': self.deathTimeCounts}
+
+    def calculate_cohort_outcomes(self, initial_pop_size):
+        """ calculates the cohort outcomes
+        :param initial_pop_size: initial population size
+        """
+        from SurvivalCurves import SurvivalCurve
+
+        if self.profiler is not None:
+            start = time.perf_counter()
+
+        # random samples of patient outcomes
+        self.survivalTimes = self.statSurvivalTime.get_reservoir_sample()
+        self.nTotalStrokes = self.statNumStrokes.get_reservoir_sample()
+        self.costs = self.statCost.get_reservoir_sample()
+        self.utilities = self.statUtility.get_reservoir_sample()
 
         # survival curve
-        self.nLivingPatients = PrevalencePathBatchUpdate(
+        self.nLivingPatients = SurvivalCurve(
             name='# of living patients',
             initial_size=initial_pop_size,
-            times_of_changes=self.survivalTimes,
-            increments=[-1] * len(self.survivalTimes)
+            death_counts=self.deathTimeCounts
         )
+
+        if self.profiler is not None:
+            self.profiler.record_time(phase='summary statistics and survival curve', start=start)
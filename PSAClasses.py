@@ -0,0 +1,180 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import InputData as D
+import MarkovClasses as Cls
+import ParameterClasses as P
+from InputData import HealthStates
+
+
+def get_input_distributions():
+    """
+    :return: (dictionary) distributions of uncertain model inputs; keys are names of inputs in InputData,
+        or (name, index) for an element of an input that is a list (e.g. ('ANNUAL_STATE_COST', 2))
+    """
+    # imported here because deampy loads its plotting modules, which worker processes do not need
+    import deampy.random_variates as rvgs
+
+    return {
+        'ANNUAL_PROB_FIRST_STROKE': rvgs.Beta(**rvgs.Beta.fit_mm(mean=D.ANNUAL_PROB_FIRST_STROKE, st_dev=0.003)),
+        'PROB_SURVIVE_FIRST_STROKE': rvgs.Beta(**rvgs.Beta.fit_mm(mean=D.PROB_SURVIVE_FIRST_STROKE, st_dev=0.05)),
+        'PROB_SURVIVE_RECURRENT_STROKE': rvgs.Beta(
+            **rvgs.Beta.fit_mm(mean=D.PROB_SURVIVE_RECURRENT_STROKE, st_dev=0.05)),
+        'FIVE_YEAR_PROB_RECURRENT_STROKE': rvgs.Beta(
+            **rvgs.Beta.fit_mm(mean=D.FIVE_YEAR_PROB_RECURRENT_STROKE, st_dev=0.03)),
+        'ANTICOAG_STROKE_REDUCTION': rvgs.Beta(**rvgs.Beta.fit_mm(mean=D.ANTICOAG_STROKE_REDUCTION, st_dev=0.05)),
+        'ANTICOAG_BLEEDING_DEATH_INCREASE': rvgs.Gamma(
+            **rvgs.Gamma.fit_mm(mean=D.ANTICOAG_BLEEDING_DEATH_INCREASE, st_dev=0.01)),
+        'ANTICOAG_COST': rvgs.Gamma(**rvgs.Gamma.fit_mm(mean=D.ANTICOAG_COST, st_dev=400)),
+        'STROKE_COST': rvgs.Gamma(**rvgs.Gamma.fit_mm(mean=D.STROKE_COST, st_dev=1000)),
+        ('ANNUAL_STATE_COST', HealthStates.POST_STROKE.value): rvgs.Gamma(
+            **rvgs.Gamma.fit_mm(mean=D.ANNUAL_STATE_COST[HealthStates.POST_STROKE.value], st_dev=50)),
+        ('ANNUAL_STATE_UTILITY', HealthStates.STROKE.value): rvgs.Beta(
+            **rvgs.Beta.fit_mm(mean=D.ANNUAL_STATE_UTILITY[HealthStates.STROKE.value], st_dev=0.05)),
+        ('ANNUAL_STATE_UTILITY', HealthStates.POST_STROKE.value): rvgs.Beta(
+            **rvgs.Beta.fit_mm(mean=D.ANNUAL_STATE_UTILITY[HealthStates.POST_STROKE.value], st_dev=0.03)),
+    }
+
+
+def get_input_label(key):
+    """
+    :param key: name of an input or (name, index) for an element of a list input
+    :return: (string) label of the input (e.g. 'ANNUAL_STATE_COST[2]')
+    """
+    if isinstance(key, tuple):
+        return '{}[{}]'.format(key[0], key[1])
+    else:
+        return key
+
+
+def get_inputs_from_draw(keys, values):
+    """
+    :param keys: keys of sampled inputs (as in get_input_distributions)
+    :param values: sampled values of these inputs
+    :return: (dictionary) inputs to pass to ParameterClasses.Parameters
+    """
+
+    inputs = {}
+    for key, value in zip(keys, values):
+        if isinstance(key, tuple):
+            name, index = key
+            if name not in inputs:
+                inputs[name] = list(getattr(D, name))
+            inputs[name][index] = float(value)
+        else:
+            inputs[key] = float(value)
+    return inputs
+
+
+class PSARunner:
+    def __init__(self, n_draws, pop_size, sim_length, distributions=None, seed=0):
+        """ probabilistic sensitivity analysis: simulates cohorts under every therapy for each draw
+        of the uncertain model inputs
+        :param n_draws: number of parameter draws
+        :param pop_size: population size of the cohort simulated for each draw and therapy
+        :param sim_length: simulation length
+        :param distributions: (dictionary) distributions of uncertain inputs
+            (if not provided, get_input_distributions() is used)
+        :param seed: seed of the random number generator used to sample inputs
+        """
+
+        self.nDraws = n_draws
+        self.popSize = pop_size
+        self.simLength = sim_length
+        self.distributions = get_input_distributions() if distributions is None else distributions
+        self.keys = list(self.distributions)
+
+        # sample inputs (one row per draw)
+        rng = np.random.RandomState(seed=seed)
+        self.inputSamples = np.array(
+            [[self.distributions[key].sample(rng=rng) for key in self.keys] for _ in range(n_draws)])
+
+    def run(self, n_workers=1, draws_per_batch=10, file_name='PSAResults.npz'):
+        """ simulates all draws in batches (in parallel if n_workers > 1) and saves the results
+        :param n_workers: number of worker processes
+        :param draws_per_batch: number of draws simulated by a worker process at a time
+        :param file_name: name of the .npz file to save the results in
+        :return: (PSAResults) results of the probabilistic sensitivity analysis
+        """
+
+        batches = [(first, min(first + draws_per_batch, self.nDraws))
+                   for first in range(0, self.nDraws, draws_per_batch)]
+        batch_args = [(self.keys, self.inputSamples[first:last], first, self.popSize, self.simLength)
+                      for first, last in batches]
+
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                batch_results = list(executor.map(_simulate_draws, *zip(*batch_args)))
+        else:
+            batch_results = [_simulate_draws(*args) for args in batch_args]
+
+        results = PSAResults(input_labels=[get_input_label(key) for key in self.keys],
+                             input_samples=self.inputSamples,
+                             costs=np.concatenate([costs for costs, effects in batch_results]),
+                             effects=np.concatenate([effects for costs, effects in batch_results]))
+        if file_name is not None:
+            results.save(file_name=file_name)
+
+        return results
+
+
+def _simulate_draws(keys, input_samples, first_draw, pop_size, sim_length):
+    """ simulates a batch of parameter draws (runs in a worker process)
+    :return: (costs, effects) mean discounted cost and utility with one row per draw and one column per therapy
+    """
+
+    costs = np.empty((len(input_samples), len(P.Therapies)))
+    effects = np.empty((len(input_samples), len(P.Therapies)))
+
+    for i, values in enumerate(input_samples):
+        inputs = get_inputs_from_draw(keys=keys, values=values)
+        for therapy in P.Therapies:
+            # cohorts of the same draw share cohort id (and hence random number streams) across therapies
+            cohort = Cls.Cohort(id=first_draw + i,
+                                pop_size=pop_size,
+                                parameters=P.Parameters(therapy=therapy, inputs=inputs),
+                                if_streaming=True)
+            cohort.simulate(sim_length=sim_length, engine='vectorized')
+
+            costs[i, therapy.value] = cohort.cohortOutcomes.statCost.get_mean()
+            effects[i, therapy.value] = cohort.cohortOutcomes.statUtility.get_mean()
+
+    return costs, effects
+
+
+class PSAResults:
+    def __init__(self, input_labels, input_samples, costs, effects):
+        """ results of a probabilistic sensitivity analysis
+        :param input_labels: labels of sampled inputs
+        :param input_samples: (numpy.array) sampled inputs with one row per draw
+        :param costs: (numpy.array) mean discounted cost with one row per draw and one column per therapy
+        :param effects: (numpy.array) mean discounted utility with one row per draw and one column per therapy
+        """
+
+        self.inputLabels = list(input_labels)
+        self.inputSamples = input_samples
+        self.costs = costs
+        self.effects = effects
+
+    def save(self, file_name):
+        """ saves the results in a .npz file """
+
+        np.savez_compressed(file_name,
+                            input_labels=np.array(self.inputLabels),
+                            input_samples=self.inputSamples,
+                            costs=self.costs,
+                            effects=self.effects)
+
+    @staticmethod
+    def load(file_name):
+        """
+        :param file_name: name of a .npz file saved by PSAResults.save
+        :return: (PSAResults)
+        """
+
+        with np.load(file_name) as data:
+            return PSAResults(input_labels=data['input_labels'].tolist(),
+                              input_samples=data['input_samples'],
+                              costs=data['costs'],
+                              effects=data['effects'])
@@ -1,6 +1,9 @@
 from enum import Enum
 
+import numpy as np
+
 import InputData as D
+from Discounting import Discounter, SubgroupDiscounter
 
 
 class HealthStates(Enum):
@@ -19,36 +22,382 @@ class Therapies(Enum):
 
 
 class Parameters:
-    def __init__(self, therapy):
+    def __init__(self, therapy, inputs=None):
+        """
+        :param therapy: selected therapy
+        :param inputs: (dictionary) values of model inputs (keyed by their names in InputData)
+            to use instead of the values defined in InputData
+        """
+
+        # error checking
+        if inputs is not None:
+            for name in inputs:
+                if name not in D.MODEL_INPUTS:
+                    raise ValueError("'{}' is not a model input defined in InputData.".format(name))
 
         # selected therapy
         self.therapy = therapy
 
         # initial health state
-        self.initialHealthState = HealthStates.WELL
+        self.initialHealthState = HealthStates[D.get_input('INITIAL_HEALTH_STATE', inputs)]
+
+        # ages at which the transition rates change (rates are constant between consecutive ages;
+        # a single age if no input is given by age)
+        self.ageBreaks = D.get_age_breaks(inputs=inputs)
+        self.ifAgeDependent = len(self.ageBreaks) > 1
+
+        # transition rate matrix of the selected therapy in each age band
+        # (inputs given by age are ignored if no input is given by age)
+        with_treatment = therapy != Therapies.NONE
+        if len(self.ageBreaks) == 0:
+            self.ageBreaks = [0]
+            self.transRateMatrices = [D.get_trans_rate_matrix(with_treatment=with_treatment, inputs=inputs)]
+        else:
+            self.transRateMatrices = [D.get_trans_rate_matrix(with_treatment=with_treatment, inputs=inputs, age=age)
+                                      for age in self.ageBreaks]
+        # transition rate matrix of the youngest age band (the only one if rates do not depend on age)
+        self.transRateMatrix = self.transRateMatrices[0]
 
-        # transition probability matrix of the selected therapy
-        self.transRateMatrix = []
+        # ages of patients at the start of the simulation and their probabilities
+        starting_age_dist = np.array(D.get_input('STARTING_AGE_DIST', inputs), dtype=float)
+        self.startingAges = starting_age_dist[:, 0]
+        self.startingAgeCumProbs = starting_age_dist[:, 1].cumsum() / starting_age_dist[:, 1].sum()
 
-        # calculate transition rate matrices depending on which therapy options is in use
-        if therapy == Therapies.NONE:
-            self.transRateMatrix = D.get_trans_rate_matrix(with_treatment=False)
+        # sampler of the time until the next event and the next state (shared by all patients)
+        if self.ifAgeDependent:
+            self.sampler = AgeDependentCompetingRisksSampler(age_breaks=self.ageBreaks,
+                                                             trans_rate_matrices=self.transRateMatrices)
         else:
-            self.transRateMatrix = D.get_trans_rate_matrix(with_treatment=True)
+            self.sampler = CompetingRisksSampler(trans_rate_matrix=self.transRateMatrix)
 
         # annual treatment cost
         if self.therapy == Therapies.NONE:
             self.annuaAntiCoagCost = 0
         elif self.therapy == Therapies.ANTICOAG:
-            self.annuaAntiCoagCost = D.ANTICOAG_COST
+            self.annuaAntiCoagCost = D.get_input('ANTICOAG_COST', inputs)
 
         # stroke cost
-        self.strokeCost = D.STROKE_COST
+        self.strokeCost = D.get_input('STROKE_COST', inputs)
 
         # state costs and utilities
-        self.annualStateCosts = D.ANNUAL_STATE_COST
-        self.annualStateUtilities = D.ANNUAL_STATE_UTILITY
+        self.annualStateCosts = D.get_input('ANNUAL_STATE_COST', inputs)
+        self.annualStateUtilities = D.get_input('ANNUAL_STATE_UTILITY', inputs)
+
+        # discount rate
+        self.discountRate = D.get_input('DISCOUNT', inputs)
+
+        # calculator of discounted cost and utility accrued between transitions (shared by all patients)
+        self.discounter = Discounter(parameters=self)
+
+    def get_starting_ages(self, uniforms):
+        """
+        :param uniforms: (numpy.array) uniform numbers in [0, 1), one per patient
+        :return: (numpy.array) ages of these patients at the start of the simulation
+            (sampled from the starting age distribution by inversion)
+        """
+        return self.startingAges[np.searchsorted(self.startingAgeCumProbs, uniforms, side='right')]
+
+
+class SubgroupParameters:
+    def __init__(self, therapy, subgroup_inputs):
+        """ parameters of a population whose subgroups have their own model inputs (e.g. mortality by age and sex);
+        the transition rates, costs and utilities of all subgroups are stacked into the tables of one sampler and
+        one discounter, whose rows are indexed by subgroup * number of states + state, so that patients of
+        all subgroups are simulated together (see MarkovClasses.PatientBatch)
+        :param therapy: selected therapy
+        :param subgroup_inputs: (list) values of model inputs of each subgroup (dictionaries keyed by their names
+            in InputData) to use instead of the values defined in InputData
+        """
+
+        # selected therapy
+        self.therapy = therapy
+
+        # parameters of each subgroup
+        self.subgroupParameters = [Parameters(therapy=therapy, inputs=inputs) for inputs in subgroup_inputs]
+        self.nSubgroups = len(self.subgroupParameters)
+        if self.nSubgroups == 0:
+            raise ValueError('At least one subgroup is needed.')
+        if any(params.ifAgeDependent for params in self.subgroupParameters):
+            raise ValueError('Transition rates of subgroups cannot depend on age (use subgroups of ages instead).')
+        self.ifAgeDependent = False
+
+        # initial health state of patients in each subgroup
+        self.initialHealthStates = np.array([params.initialHealthState.value for params in self.subgroupParameters])
+
+        # sampler of the time until the next event and the next state (shared by all subgroups)
+        self.sampler = SubgroupCompetingRisksSampler(
+            trans_rate_matrices=[params.transRateMatrix for params in self.subgroupParameters])
 
         # discount rate
-        self.discountRate = D.DISCOUNT
+        self.discountRate = self.subgroupParameters[0].discountRate
+
+        # calculator of discounted cost and utility accrued between transitions (shared by all subgroups)
+        self.discounter = SubgroupDiscounter(subgroup_parameters=self.subgroupParameters)
+
+
+class CompetingRisksSampler:
+    def __init__(self, trans_rate_matrix):
+        """ precompiles the transition rate matrix of a continuous-time Markov model into NumPy arrays
+        so that the time until the next event and the next state can be sampled without rebuilding
+        the exit rates and jump probabilities
+        :param trans_rate_matrix: transition rate matrix
+        """
+
+        rate_matrix = np.array(trans_rate_matrix, dtype=float)
+        np.fill_diagonal(rate_matrix, 0)
+
+        # sum of rates out of each state
+        self.ratesOut = rate_matrix.sum(axis=1)
+        # states with no rate out of them
+        self.ifAbsorbing = self.ratesOut == 0
+        # mean holding time in each state (inf for absorbing states)
+        self.scales = np.full(len(self.ratesOut), np.inf)
+        self.scales[~self.ifAbsorbing] = 1 / self.ratesOut[~self.ifAbsorbing]
+
+        # cumulative probabilities of jumping from each state to every other state
+        # (prob_j = rate_j / (sum over j of rate_j); rows of absorbing states are set to 0)
+        self.cumProbs = np.zeros_like(rate_matrix)
+        for i in np.flatnonzero(~self.ifAbsorbing):
+            cum_probs = (rate_matrix[i] / self.ratesOut[i]).cumsum()
+            self.cumProbs[i] = cum_probs / cum_probs[-1]
+
+    def get_next_state(self, current_state_index, rng, age=None):
+        """
+        :param current_state_index: index of the current state
+        :param rng: random number generator object
+        :param age: not used (rates do not depend on age)
+        :return: (dt, i) where dt is the time until next event, and i is the index of the next state.
+                 It returns None for dt if the process is in an absorbing state
+        """
+
+        # if this is an absorbing state, the process stays in the current state
+        if self.ifAbsorbing[current_state_index]:
+            return None, current_state_index
+
+        # find the time until next event and the next state
+        # (draws are made in the same order as deampy.markov.Gillespie so results are the same for a given seed)
+        dt = rng.exponential(scale=self.scales[current_state_index])
+        i = int(self.cumProbs[current_state_index].searchsorted(rng.random_sample(), side='right'))
+
+        return dt, i
+
+    def get_next_states(self, current_state_indices, rng, ages=None):
+        """
+        :param current_state_indices: (np.array) indices of the current states of a set of non-absorbed processes
+        :param rng: random number generator object
+        :param ages: not used (rates do not depend on age)
+        :return: (dts, next_state_indices) as NumPy arrays
+        """
+
+        dts = rng.exponential(size=len(current_state_indices)) * self.scales[current_state_indices]
+        next_state_indices = (rng.random_sample(len(current_state_indices))[:, np.newaxis]
+                              >= self.cumProbs[current_state_indices]).sum(axis=1)
+
+        return dts, next_state_indices
+
+    def get_next_states_given_uniforms(self, current_state_indices, u_times, u_jumps, ages=None):
+        """
+        :param current_state_indices: (np.array) indices of the current states of a set of non-absorbed processes
+        :param u_times: (np.array) uniform numbers used to sample the time until next event (by inversion)
+        :param u_jumps: (np.array) uniform numbers used to sample the next state
+        :param ages: not used (rates do not depend on age)
+        :return: (dts, next_state_indices) as NumPy arrays
+        """
+
+        dts = -np.log1p(-u_times) * self.scales[current_state_indices]
+        next_state_indices = (u_jumps[:, np.newaxis] >= self.cumProbs[current_state_indices]).sum(axis=1)
+
+        return dts, next_state_indices
+
+
+class SubgroupCompetingRisksSampler(CompetingRisksSampler):
+    def __init__(self, trans_rate_matrices):
+        """ stacks the precompiled transition rate matrices of several subgroups of patients into one table
+        whose rows are indexed by subgroup * number of states + state, so that the time until the next event and
+        the next state of patients of all subgroups are sampled together (the current state indices passed to
+        the sampling methods are these rows, while the next state indices returned are states)
+        :param trans_rate_matrices: (list) transition rate matrix of each subgroup
+        """
+
+        samplers = [CompetingRisksSampler(trans_rate_matrix=trans_rate_matrix)
+                    for trans_rate_matrix in trans_rate_matrices]
+        if any((sampler.ifAbsorbing != samplers[0].ifAbsorbing).any() for sampler in samplers):
+            raise ValueError('The same states should be absorbing in all subgroups.')
+
+        self.nStates = len(samplers[0].ratesOut)
+        # sum of rates out, mean holding time and cumulative jump probabilities of each row
+        self.ratesOut = np.concatenate([sampler.ratesOut for sampler in samplers])
+        self.scales = np.concatenate([sampler.scales for sampler in samplers])
+        self.cumProbs = np.concatenate([sampler.cumProbs for sampler in samplers])
+        # states with no rate out of them (indexed by state, not by row)
+        self.ifAbsorbing = samplers[0].ifAbsorbing
+
+    def get_next_state(self, current_state_index, rng, age=None):
+        """
+        :param current_state_index: row of the current state (subgroup * number of states + state)
+        :param rng: random number generator object
+        :param age: not used (rates do not depend on age)
+        :return: (dt, i) where dt is the time until next event, and i is the index of the next state.
+                 It returns None for dt if the process is in an absorbing state
+        """
+
+        if self.ifAbsorbing[current_state_index % self.nStates]:
+            return None, current_state_index % self.nStates
+
+        dt = rng.exponential(scale=self.scales[current_state_index])
+        i = int(self.cumProbs[current_state_index].searchsorted(rng.random_sample(), side='right'))
+
+        return dt, i
+
+
+class AgeDependentCompetingRisksSampler:
+    def __init__(self, age_breaks, trans_rate_matrices):
+        """ samples the time until the next event and the next state when transition rates are
+        piecewise constant in age: the time until the next event is found by inverting the cumulative
+        hazard of leaving the current state, which is tabulated at the ages where rates change
+        (so sampling an event takes two binary searches no matter how many age bands it crosses)
+        :param age_breaks: (list) sorted ages at which rates change (the first band also covers younger ages
+            and the last band all older ages)
+        :param trans_rate_matrices: (list) transition rate matrix of each age band
+        """
+
+        rate_matrices = np.array(trans_rate_matrices, dtype=float)
+        for rate_matrix in rate_matrices:
+            np.fill_diagonal(rate_matrix, 0)
+
+        self.ageBreaks = np.array(age_breaks, dtype=float)
+        # sum of rates out of each state in each age band (n_bands x n_states)
+        self.ratesOut = rate_matrices.sum(axis=2)
+        # states with no rate out of them at any age
+        self.ifAbsorbing = (self.ratesOut == 0).all(axis=0)
+
+        # cumulative hazard of leaving each state from the first age break until each age break (n_states x n_bands)
+        hazards = self.ratesOut[:-1] * np.diff(self.ageBreaks)[:, np.newaxis]
+        self.cumHazards = np.vstack((np.zeros(len(HealthStates)), hazards.cumsum(axis=0))).T
+
+        # cumulative probabilities of jumping from each state to every other state in each age band
+        self.cumProbs = np.zeros_like(rate_matrices)
+        for k, i in zip(*np.nonzero(self.ratesOut)):
+            cum_probs = rate_matrices[k, i].cumsum()
+            self.cumProbs[k, i] = cum_probs / cum_probs[-1]
+
+    def get_next_state(self, current_state_index, rng, age):
+        """
+        :param current_state_index: index of the current state
+        :param rng: random number generator object
+        :param age: current age
+        :return: (dt, i) where dt is the time until next event, and i is the index of the next state.
+                 It returns None for dt if the process is in an absorbing state
+        """
+
+        if self.ifAbsorbing[current_state_index]:
+            return None, current_state_index
+
+        dts, next_state_indices = self.get_next_states_given_hazards(
+            current_state_indices=np.array([current_state_index]), ages=np.array([age]),
+            hazards=np.array([rng.exponential()]), u_jumps=np.array([rng.random_sample()]))
+        return float(dts[0]), int(next_state_indices[0])
+
+    def get_next_states(self, current_state_indices, rng, ages):
+        """
+        :param current_state_indices: (np.array) indices of the current states of a set of non-absorbed processes
+        :param rng: random number generator object
+        :param ages: (np.array) current ages
+        :return: (dts, next_state_indices) as NumPy arrays
+        """
+
+        return self.get_next_states_given_hazards(
+            current_state_indices=current_state_indices, ages=ages,
+            hazards=rng.exponential(size=len(current_state_indices)),
+            u_jumps=rng.random_sample(len(current_state_indices)))
+
+    def get_next_states_given_uniforms(self, current_state_indices, u_times, u_jumps, ages):
+        """
+        :param current_state_indices: (np.array) indices of the current states of a set of non-absorbed processes
+        :param u_times: (np.array) uniform numbers used to sample the time until next event (by inversion)
+        :param u_jumps: (np.array) uniform numbers used to sample the next state
+        :param ages: (np.array) current ages
+        :return: (dts, next_state_indices) as NumPy arrays
+        """
+
+        return self.get_next_states_given_hazards(
+            current_state_indices=current_state_indices, ages=ages, hazards=-np.log1p(-u_times), u_jumps=u_jumps)
+
+    def get_next_states_given_hazards(self, current_state_indices, ages, hazards, u_jumps):
+        """
+        :param current_state_indices: (np.array) indices of the current states of a set of non-absorbed processes
+        :param ages: (np.array) current ages
+        :param hazards: (np.array) standard exponential numbers (the cumulative hazard until the next event)
+        :param u_jumps: (np.array) uniform numbers used to sample the next state
+        :return: (dts, next_state_indices) as NumPy arrays (dt is inf if no event occurs at any older age)
+        """
+
+        event_ages = np.empty(len(current_state_indices))
+        event_bands = np.empty(len(current_state_indices), dtype=int)
+
+        for state in np.unique(current_state_indices):
+            in_state = current_state_indices == state
+            cum_hazards = self.cumHazards[state]
+            rates = self.ratesOut[:, state]
+
+            # cumulative hazard at the current age
+            bands = np.maximum(np.searchsorted(self.ageBreaks, ages[in_state], side='right') - 1, 0)
+            targets = cum_hazards[bands] + rates[bands] * (ages[in_state] - self.ageBreaks[bands]) + hazards[in_state]
+
+            # age at which the cumulative hazard reaches the target
+            bands = np.maximum(np.searchsorted(cum_hazards, targets, side='right') - 1, 0)
+            with np.errstate(divide='ignore'):
+                event_ages[in_state] = self.ageBreaks[bands] + (targets - cum_hazards[bands]) / rates[bands]
+            event_bands[in_state] = bands
+
+        next_state_indices = (u_jumps[:, np.newaxis]
+                              >= self.cumProbs[event_bands, current_state_indices]).sum(axis=1)
+
+        return event_ages - ages, next_state_indices
+
+
+if __name__ == '__main__':
+
+    # check event times sampled by inverting the cumulative hazard against the exact survival function
+    ages = np.arange(50, 101)
+    inputs = {'ANNUAL_PROB_ALL_CAUSE_MORT_BY_AGE': [[a, min(0.5, 0.005 * np.exp(0.09 * (a - 50)))] for a in ages],
+              'ANNUAL_PROB_FIRST_STROKE_BY_AGE': [[a, min(0.2, 0.005 * np.exp(0.05 * (a - 50)))] for a in ages]}
+    params = Parameters(therapy=Therapies.NONE, inputs=inputs)
+    sampler = params.sampler
+    assert isinstance(sampler, AgeDependentCompetingRisksSampler) and len(params.ageBreaks) == len(ages)
+
+    rng = np.random.RandomState(seed=1)
+    well = HealthStates.WELL.value
+    n = 200000
+    for starting_age in (40, 65.5, 99, 120):
+        dts, next_states = sampler.get_next_states(
+            current_state_indices=np.full(n, well), rng=rng, ages=np.full(n, starting_age))
+
+        # exact probability of leaving the well state within t years (by integrating the piecewise-constant rate)
+        for t in (0.5, 5, 20):
+            grid = np.linspace(starting_age, starting_age + t, 20001)
+            bands = np.maximum(np.searchsorted(params.ageBreaks, grid[:-1], side='right') - 1, 0)
+            hazard = (sampler.ratesOut[bands, well] * np.diff(grid)).sum()
+            expected = 1 - np.exp(-hazard)
+            observed = (dts <= t).mean()
+            assert abs(observed - expected) < 4 * np.sqrt(expected * (1 - expected) / n) + 1e-3, \
+                (starting_age, t, observed, expected)
+
+        # the next state is sampled with the probabilities of the age band where the event occurs
+        event_bands = np.maximum(np.searchsorted(params.ageBreaks, starting_age + dts, side='right') - 1, 0)
+        to_stroke = next_states == HealthStates.STROKE.value
+        rates = np.array(params.transRateMatrices)[event_bands, well]
+        expected = (rates[:, HealthStates.STROKE.value] / rates.sum(axis=1)).mean()
+        assert abs(to_stroke.mean() - expected) < 4 * np.sqrt(expected * (1 - expected) / n) + 1e-3
+
+    # with rates that do not depend on age, both samplers give the same results for the same uniform numbers
+    constant = Parameters(therapy=Therapies.ANTICOAG)
+    repeated = AgeDependentCompetingRisksSampler(age_breaks=[0, 10, 20],
+                                                 trans_rate_matrices=[constant.transRateMatrix] * 3)
+    states = rng.randint(0, 3, size=n)
+    u_times, u_jumps, current_ages = rng.random_sample(n), rng.random_sample(n), rng.uniform(0, 30, size=n)
+    dts_1, next_1 = constant.sampler.get_next_states_given_uniforms(states, u_times, u_jumps)
+    dts_2, next_2 = repeated.get_next_states_given_uniforms(states, u_times, u_jumps, ages=current_ages)
+    assert np.allclose(dts_1, dts_2, rtol=1e-9) and (next_1 == next_2).all()
 
+    print('Sampled event times agree with the cumulative hazard of age-dependent rates.')
@@ -0,0 +1,247 @@
+import numpy as np
+
+import InputData as D
+from MarkovClasses import Cohort, PatientBatch
+
+
+def read_covariates(file_name):
+    """
+    :param file_name: name of a CSV file with a header row (the name of each covariate) and one row per patient
+    :return: (dictionary) numpy.array of the values of each covariate, keyed by its name
+    """
+
+    table = np.genfromtxt(file_name, delimiter=',', names=True, dtype=None, encoding='utf-8')
+    return {name: np.atleast_1d(table[name]) for name in table.dtype.names}
+
+
+def get_subgroups(covariates, bins=None):
+    """ groups patients into subgroups of patients with the same covariates
+    :param covariates: (dictionary) numpy.array of the values of each covariate of patients, keyed by its name
+        (e.g. {'age': ..., 'female': ..., 'prior_stroke': ...})
+    :param bins: (dictionary) lower edges of the bins of numeric covariates (e.g. {'age': [60, 70, 80]});
+        patients are grouped by the bin of these covariates (values below the first edge are in the first bin)
+    :return: (keys, subgroups) where keys is a list of dictionaries with the value (or lower edge of the bin)
+        of each covariate in each subgroup, and subgroups is a numpy.array of the index of the subgroup of
+        each patient (only subgroups with patients are returned, in increasing order of their covariates)
+    """
+
+    bins = bins or {}
+    names = list(covariates)
+
+    # distinct values of each covariate and the index of the value of each patient
+    values, codes = [], []
+    for name in names:
+        column = np.asarray(covariates[name])
+        if name in bins:
+            edges = np.asarray(bins[name])
+            column = edges[np.maximum(np.searchsorted(edges, column, side='right') - 1, 0)]
+        distinct_values, value_codes = np.unique(column, return_inverse=True)
+        values.append(distinct_values)
+        codes.append(value_codes.ravel())
+
+    # index of the combination of covariates of each patient among combinations that occur
+    shape = [len(distinct_values) for distinct_values in values]
+    combinations, subgroups = np.unique(np.ravel_multi_index(codes, dims=shape), return_inverse=True)
+
+    keys = [{name: distinct_values[code].item() for name, distinct_values, code in zip(names, values, key_codes)}
+            for key_codes in zip(*np.unravel_index(combinations, shape=shape))]
+
+    return keys, subgroups.ravel()
+
+
+def get_subgroup_inputs(key, covariate_inputs=None, inputs=None):
+    """
+    :param key: (dictionary) value of each covariate of a subgroup (see get_subgroups)
+    :param covariate_inputs: (dictionary) for each covariate, the values of model inputs (dictionaries keyed by
+        their names in InputData) for each value of the covariate (if None, InputData.SUBGROUP_INPUTS is used);
+        covariates and values that are not listed do not change inputs
+    :param inputs: (dictionary) values of model inputs of all subgroups (which covariates take precedence over)
+    :return: (dictionary) values of model inputs of this subgroup to use instead of the values defined in InputData
+    """
+
+    if covariate_inputs is None:
+        covariate_inputs = D.SUBGROUP_INPUTS
+
+    subgroup_inputs = dict(inputs or {})
+    for name, value in key.items():
+        subgroup_inputs.update(covariate_inputs.get(name, {}).get(value, {}))
+    return subgroup_inputs
+
+
+class HeterogeneousCohort(Cohort):
+    def __init__(self, id, subgroups, parameters, crn_seed=None,
+                 if_record_discounted_times=False, if_profile=False, sampling='random', trace_dir=None):
+        """ a cohort of patients who belong to subgroups with their own transition rates, costs, utilities and
+        initial health states; patients are simulated with the vectorized engine in the order of their subgroups
+        (patient n of this cohort is patient patientOrder[n] of the covariate table), so that the outcomes of each
+        subgroup are the outcomes of consecutive patients
+        :param id: cohort ID
+        :param subgroups: (numpy.array) index of the subgroup of each patient (see get_subgroups)
+        :param parameters: (SubgroupParameters) parameters of each subgroup
+        :param crn_seed: if provided, patient n draws its random numbers from streams identified by
+            (crn_seed, n, type of event) so that cohorts with the same crn_seed use common random numbers
+        :param if_record_discounted_times: set to True to store the discounted time each patient spends in
+            each state and their discounted number of stroke entries
+        :param if_profile: set to True to collect the time spent in each phase of the simulation and
+            counts of events (stored in cohortOutcomes.profiler)
+        :param sampling: scheme to sample the random numbers of events (see RandomStreams.SAMPLING_SCHEMES)
+        :param trace_dir: if provided, every transition of every patient is recorded in memory-mapped files
+            in this directory (patient n of the trace is patient n of this cohort)
+        """
+
+        subgroups = np.asarray(subgroups, dtype=int)
+        if len(subgroups) == 0:
+            raise ValueError('A heterogeneous cohort needs at least one patient.')
+        if subgroups.min() < 0 or subgroups.max() >= parameters.nSubgroups:
+            raise ValueError('The subgroup of every patient should have parameters.')
+
+        # covariate row of each patient of this cohort and subgroup of each patient of this cohort
+        self.patientOrder = np.argsort(subgroups, kind='stable')
+        self.subgroups = subgroups[self.patientOrder]
+        # number of patients in each subgroup and index of the first patient of each subgroup
+        # (followed by the number of patients)
+        self.subgroupSizes = np.bincount(subgroups, minlength=parameters.nSubgroups)
+        self.subgroupBoundaries = np.concatenate(([0], self.subgroupSizes.cumsum()))
+
+        Cohort.__init__(self, id=id, pop_size=len(subgroups), parameters=parameters, crn_seed=crn_seed,
+                        if_record_discounted_times=if_record_discounted_times, if_profile=if_profile,
+                        sampling=sampling, trace_dir=trace_dir)
+        self.subgroupOutcomes = None    # outcomes of the patients of each subgroup
+
+    def simulate(self, sim_length, engine='vectorized', batch_size=100000, n_workers=1,
+                 checkpoint_dir=None, checkpoint_interval=100000, if_resume=False, cache=None):
+        """ simulate the cohort of patients over the specified number of time-steps and calculate the outcomes of
+        the cohort (in cohortOutcomes) and of each subgroup (in subgroupOutcomes)
+        (the arguments are as in Cohort.simulate; only the 'vectorized' engine can simulate patients of
+        several subgroups and the outcomes of this cohort are not cached)
+        """
+
+        Cohort.simulate(self, sim_length=sim_length, engine=engine, batch_size=batch_size, n_workers=n_workers,
+                        checkpoint_dir=checkpoint_dir, checkpoint_interval=checkpoint_interval,
+                        if_resume=if_resume, cache=None)
+        self.calculate_subgroup_outcomes()
+
+    def simulate_patients(self, sim_length, first_index, last_index, cohort_outcomes,
+                          engine='vectorized', batch_size=100000,
+                          checkpoint_dir=None, checkpoint_interval=100000, if_resume=False):
+        """ simulate patients first_index, ..., last_index - 1 of this cohort
+        (the arguments are as in Cohort.simulate_patients) """
+
+        if engine != 'vectorized':
+            raise ValueError("Patients of several subgroups can only be simulated with the 'vectorized' engine.")
+
+        Cohort.simulate_patients(self, sim_length=sim_length, first_index=first_index, last_index=last_index,
+                                 cohort_outcomes=cohort_outcomes, engine=engine, batch_size=batch_size,
+                                 checkpoint_dir=checkpoint_dir, checkpoint_interval=checkpoint_interval,
+                                 if_resume=if_resume)
+
+    def create_batch(self, first_index, size, profiler=None, trace_writer=None):
+        """
+        :return: (PatientBatch) a batch of patients first_index, ..., first_index + size - 1 and their subgroups
+        """
+
+        return PatientBatch(id=self.id * self.popSize + first_index,
+                            size=size,
+                            parameters=self.params,
+                            random_streams=self.get_random_streams(first_index=first_index, size=size),
+                            profiler=profiler,
+                            trace_writer=trace_writer,
+                            subgroups=self.subgroups[first_index:first_index + size])
+
+    def get_if_cacheable(self):
+        """
+        :return: False (the key of a ResultCache does not describe the subgroups of patients)
+        """
+        return False
+
+    def calculate_subgroup_outcomes(self):
+        """ splits the outcomes of this cohort into the outcomes of each subgroup and calculates them
+        (called by simulate; call it after simulating this cohort with MarkovClasses.simulate_cohorts)
+        the outcomes of subgroups without patients are not calculated
+        """
+
+        self.subgroupOutcomes = self.cohortOutcomes.get_subsets(boundaries=self.subgroupBoundaries)
+        for subgroup_outcomes, size in zip(self.subgroupOutcomes, self.subgroupSizes):
+            if size > 0:
+                subgroup_outcomes.calculate_cohort_outcomes(initial_pop_size=size)
+
+
+if __name__ == '__main__':
+
+    # check the outcomes of each subgroup against their expected outcomes and against simulating
+    # each subgroup as a separate cohort, and time a cohort of a million patients in hundreds of subgroups
+    import time
+
+    import ParameterClasses as P
+    from ExpectedClasses import ExpectedCohort
+    from RandomStreams import CommonRandomStreams
+
+    rng = np.random.RandomState(seed=1)
+    n_patients = 200000
+    covariates = {'age': rng.uniform(60, 95, size=n_patients),
+                  'female': rng.randint(0, 2, size=n_patients),
+                  'prior_stroke': (rng.random_sample(n_patients) < 0.15).astype(int)}
+    keys, subgroups = get_subgroups(covariates=covariates, bins=D.SUBGROUP_BINS)
+    assert len(keys) == 28 and np.bincount(subgroups).min() > 0
+    assert all(keys[subgroups[i]]['prior_stroke'] == covariates['prior_stroke'][i] for i in range(100))
+
+    for therapy in P.Therapies:
+        params = P.SubgroupParameters(therapy=therapy,
+                                      subgroup_inputs=[get_subgroup_inputs(key) for key in keys])
+        cohort = HeterogeneousCohort(id=1, subgroups=subgroups, parameters=params)
+        cohort.simulate(sim_length=D.SIM_LENGTH, batch_size=50000)
+
+        # overall outcomes are the outcomes of all subgroups
+        assert len(cohort.cohortOutcomes.costs) == n_patients
+        assert np.isclose(cohort.cohortOutcomes.statCost.get_mean(),
+                          sum(outcomes.statCost.get_mean() * len(outcomes.costs)
+                              for outcomes in cohort.subgroupOutcomes) / n_patients)
+
+        # outcomes of each subgroup agree with their expected outcomes
+        n_outside = 0
+        for key, subgroup_params, outcomes in zip(keys, params.subgroupParameters, cohort.subgroupOutcomes):
+            expected = ExpectedCohort(pop_size=len(outcomes.costs), parameters=subgroup_params)
+            expected.calculate(sim_length=D.SIM_LENGTH)
+            for stat, value in ((outcomes.statCost, expected.cohortOutcomes.expectedCost),
+                                (outcomes.statUtility, expected.cohortOutcomes.expectedUtility),
+                                (outcomes.statNumStrokes, expected.cohortOutcomes.expectedNumStrokes)):
+                lower, upper = stat.get_t_CI(alpha=0.001)
+                n_outside += not lower <= value <= upper
+        assert n_outside <= 2, n_outside
+
+        # patients of a subgroup simulated with the other subgroups have the same outcomes as simulated alone
+        # (with common random numbers, patient n uses the same random numbers in both simulations)
+        crn_cohort = HeterogeneousCohort(id=1, subgroups=subgroups, parameters=params, crn_seed=7)
+        crn_cohort.simulate(sim_length=D.SIM_LENGTH)
+        for k in (0, 5, len(keys) - 1):
+            first, last = crn_cohort.subgroupBoundaries[k], crn_cohort.subgroupBoundaries[k + 1]
+            batch = PatientBatch(id=0, size=last - first, parameters=params.subgroupParameters[k],
+                                 random_streams=CommonRandomStreams(seed=7, patient_indices=np.arange(first, last)))
+            batch.simulate(sim_length=D.SIM_LENGTH)
+            assert np.allclose(batch.totalDiscountedCosts, crn_cohort.subgroupOutcomes[k].costs)
+            assert np.allclose(batch.totalDiscountedUtilities, crn_cohort.subgroupOutcomes[k].utilities)
+
+        # the starting state of every patient is the initial health state of their subgroup
+        small_cohort = HeterogeneousCohort(id=2, subgroups=subgroups[:2000], parameters=params)
+        batch = small_cohort.create_batch(first_index=0, size=2000)
+        assert (batch.currentStates == P.HealthStates.POST_STROKE.value).sum() \
+            == covariates['prior_stroke'][:2000].sum()
+
+    print('Outcomes of subgroups agree with their expected outcomes and with simulating them separately.')
+
+    # a million patients in hundreds of subgroups
+    n_patients = 1000000
+    covariates = {'age': rng.randint(60, 100, size=n_patients),
+                  'female': rng.randint(0, 2, size=n_patients),
+                  'prior_stroke': (rng.random_sample(n_patients) < 0.15).astype(int)}
+    start = time.perf_counter()
+    keys, subgroups = get_subgroups(covariates=covariates)
+    subgroup_inputs = [get_subgroup_inputs(key, covariate_inputs={
+        'age': {age: {'ANNUAL_PROB_ALL_CAUSE_MORT': 0.0095 * np.exp(0.09 * (age - 60))} for age in range(60, 100)},
+        'female': D.SUBGROUP_INPUTS['female'],
+        'prior_stroke': D.SUBGROUP_INPUTS['prior_stroke']}) for key in keys]
+    params = P.SubgroupParameters(therapy=P.Therapies.ANTICOAG, subgroup_inputs=subgroup_inputs)
+    cohort = HeterogeneousCohort(id=1, subgroups=subgroups, parameters=params)
+    cohort.simulate(sim_length=D.SIM_LENGTH)
+    print('Simulated {:,} patients in {} subgroups in {:.1f} seconds.'.format(
+        n_patients, len(keys), time.perf_counter() - start))
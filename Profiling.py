@@ -0,0 +1,149 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+from InputData import HealthStates
+
+
+class Profiler:
+    def __init__(self, name=None):
+        """ collects the wall time spent in each phase of a run and counts of simulated events
+        (profilers of shards of a cohort can be merged)
+        :param name: name of this profiler (e.g. the name of the simulated cohort)
+        """
+
+        self.name = name
+        self.phaseTimes = {}    # wall time (seconds) spent in each phase
+        self.phaseCalls = {}    # number of times each phase was timed
+
+        n_states = len(HealthStates)
+        self.nTransitions = 0       # number of state transitions
+        self.nAbsorbingExits = 0    # number of patients who left the simulation by entering an absorbing state
+        self.nCensorings = 0        # number of patients who were censored at the end of the simulation
+        # number of transitions from each state (rows) to each state (columns)
+        self.transitionCounts = np.zeros((n_states, n_states), dtype=np.int64)
+        # number of patients censored in each state
+        self.censoringCounts = np.zeros(n_states, dtype=np.int64)
+
+    def record_time(self, phase, start):
+        """ adds the wall time since start to a phase
+        :param phase: (string) name of the phase
+        :param start: value of time.perf_counter() when the phase started
+        """
+
+        self.phaseTimes[phase] = self.phaseTimes.get(phase, 0) + time.perf_counter() - start
+        self.phaseCalls[phase] = self.phaseCalls.get(phase, 0) + 1
+
+    @contextmanager
+    def phase(self, phase):
+        """ times the enclosed block of code as a phase
+        :param phase: (string) name of the phase
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(phase=phase, start=start)
+
+    def record_events(self, current_states, next_states, if_censored, if_absorbing):
+        """ counts events (works with numbers or with numpy.arrays of events)
+        :param current_states: index of the state before each event
+        :param next_states: index of the state after each event
+        :param if_censored: True for events where the patient reached the end of the simulation
+        :param if_absorbing: True for events where the next state is absorbing
+        """
+
+        current_states = np.atleast_1d(current_states)
+        next_states = np.atleast_1d(next_states)
+        if_censored = np.atleast_1d(if_censored)
+        if_transition = ~if_censored
+
+        np.add.at(self.transitionCounts, (current_states[if_transition], next_states[if_transition]), 1)
+        self.censoringCounts += np.bincount(current_states[if_censored], minlength=len(self.censoringCounts))
+
+        n_censored = int(if_censored.sum())
+        self.nTransitions += len(current_states) - n_censored
+        self.nCensorings += n_censored
+        self.nAbsorbingExits += int((np.atleast_1d(if_absorbing) & if_transition).sum())
+
+    def merge(self, other):
+        """ adds the times and counts collected by another profiler to this one
+        :param other: (Profiler) profiler of another shard of patients
+        """
+
+        for phase, seconds in other.phaseTimes.items():
+            self.phaseTimes[phase] = self.phaseTimes.get(phase, 0) + seconds
+            self.phaseCalls[phase] = self.phaseCalls.get(phase, 0) + other.phaseCalls[phase]
+        self.nTransitions += other.nTransitions
+        self.nAbsorbingExits += other.nAbsorbingExits
+        self.nCensorings += other.nCensorings
+        self.transitionCounts += other.transitionCounts
+        self.censoringCounts += other.censoringCounts
+
+    def to_dict(self):
+        """
+        :return: (dictionary) the collected times and counts in a form that can be saved as JSON
+        """
+
+        state_names = [state.name for state in HealthStates]
+        return {
+            'name': self.name,
+            'phase_times': self.phaseTimes,
+            'phase_calls': self.phaseCalls,
+            'n_transitions': self.nTransitions,
+            'n_absorbing_exits': self.nAbsorbingExits,
+            'n_censorings': self.nCensorings,
+            'transition_counts': {
+                from_state: {to_state: int(count) for to_state, count in zip(state_names, row) if count > 0}
+                for from_state, row in zip(state_names, self.transitionCounts)},
+            'censoring_counts': {state: int(count) for state, count in zip(state_names, self.censoringCounts)}
+        }
+
+    def get_summary(self):
+        """
+        :return: (string) a short text summary of the collected times and counts
+        """
+
+        lines = ['Profile' + ('' if self.name is None else ' of ' + str(self.name))]
+
+        total_time = sum(self.phaseTimes.values())
+        for phase, seconds in sorted(self.phaseTimes.items(), key=lambda item: -item[1]):
+            lines.append('  {:<38} {:>10.3f} s {:>6.1%}'.format(phase, seconds, seconds / total_time))
+
+        if self.nTransitions + self.nCensorings > 0:
+            lines.append('  Transitions: {:,}, absorbing exits: {:,}, censorings: {:,}'.format(
+                self.nTransitions, self.nAbsorbingExits, self.nCensorings))
+            for state in HealthStates:
+                n_out = self.transitionCounts[state.value].sum()
+                if n_out + self.censoringCounts[state.value] > 0:
+                    lines.append('  {:<14} transitions out: {:>12,}, censorings: {:>12,}'.format(
+                        state.name, n_out, self.censoringCounts[state.value]))
+
+        return '\n'.join(lines)
+
+
+def time_phase(profiler, phase):
+    """
+    :param profiler: (Profiler) or None if profiling is turned off
+    :param phase: (string) name of the phase
+    :return: a context manager that times the enclosed block of code as a phase of the profiler
+        (or does nothing if the profiler is None)
+    """
+
+    if profiler is None:
+        return nullcontext()
+    else:
+        return profiler.phase(phase)
+
+
+def save_profiles(profilers, file_name):
+    """ saves profiles as JSON
+    :param profilers: (list) of Profiler objects
+    :param file_name: name of the JSON file
+    """
+
+    with open(file_name, 'w') as file:
+        json.dump([profiler.to_dict() for profiler in profilers], file, indent=2)
@@ -0,0 +1,260 @@
+import numpy as np
+
+from InputData import HealthStates
+
+# stream of uniform numbers used to sample the starting age of patients
+# (differs from the streams of events, whose keys hold the index of a health state in the top 8 bits)
+STARTING_AGE_STREAM = np.uint64(0xFF << 56)
+
+# schemes to sample the uniform numbers of events: 'random' (independent draws), 'antithetic'
+# (patients 2m and 2m + 1 use u and 1 - u), and 'sobol' or 'stratified' (the first N_QMC_EVENTS events
+# of patients are drawn from a scrambled Sobol' sequence or a Latin hypercube sample)
+SAMPLING_SCHEMES = ('random', 'antithetic', 'sobol', 'stratified')
+N_QMC_EVENTS = 4        # number of first events of each patient drawn from quasi-random points
+QMC_GROUP_SIZE = 256    # number of consecutive patients that share a randomization of the quasi-random points
+                        # (a power of 2; outcomes are independent across these groups, not across patients)
+SOBOL_BITS = 30         # number of binary digits of scrambled Sobol' points
+
+
+def get_uniform_keys(ids, stream=None):
+    """ maps integer ids to uniform numbers in [0, 1) with the splitmix64 hash
+    (the same id always gets the same number, so samples drawn with these keys
+    do not depend on how observations are split into shards)
+    :param ids: (int, list or numpy.array) non-negative integer ids
+    :param stream: (numpy.uint64) if provided, ids are mapped to a different set of uniform numbers
+        for each stream (e.g. STARTING_AGE_STREAM)
+    :return: (numpy.array) uniform numbers in [0, 1)
+    """
+
+    z = _splitmix64(np.atleast_1d(np.asarray(ids)).astype(np.uint64))
+    if stream is not None:
+        z = _splitmix64(z ^ stream)
+    return _to_uniform(z)
+
+
+class CommonRandomStreams:
+    def __init__(self, seed, patient_indices):
+        """ counter-based random numbers for a set of patients: the k-th time patient n leaves state s,
+        the uniform numbers used to sample the time until the next event and the next state depend only on
+        (seed, n, s, k). Cohorts simulated with the same seed therefore face the same underlying risks for
+        every type of event, no matter how their trajectories diverge or how patients are split into batches.
+        :param seed: seed shared by the cohorts that should use common random numbers
+        :param patient_indices: (numpy.array) indices of patients in the cohort
+        """
+
+        with np.errstate(over='ignore'):
+            self.patientKeys = _splitmix64(
+                _splitmix64(np.uint64(seed)) ^ np.asarray(patient_indices).astype(np.uint64))
+        # number of times each patient has left each state
+        self.nDepartures = np.zeros((len(self.patientKeys), len(HealthStates)), dtype=np.uint64)
+
+    def get_uniforms(self, stream):
+        """
+        :param stream: (numpy.uint64) stream of uniform numbers (e.g. STARTING_AGE_STREAM)
+        :return: (numpy.array) one uniform number per patient that depends only on (seed, n, stream)
+        """
+        return _to_uniform(_splitmix64(self.patientKeys ^ stream))
+
+    def get_next_state(self, sampler, current_state_index, position=0, age=None):
+        """
+        :param sampler: (CompetingRisksSampler) sampler of the time until next event and the next state
+        :param current_state_index: index of the current state
+        :param position: position of the patient in this set of patients
+        :param age: current age of the patient (only used if rates depend on age)
+        :return: (dt, i) where dt is the time until next event, and i is the index of the next state.
+                 It returns None for dt if the process is in an absorbing state
+        """
+
+        if sampler.ifAbsorbing[current_state_index]:
+            return None, current_state_index
+
+        dts, next_state_indices = self.get_next_states(
+            sampler=sampler, positions=np.array([position]), current_state_indices=np.array([current_state_index]),
+            ages=None if age is None else np.array([age]))
+        return float(dts[0]), int(next_state_indices[0])
+
+    def get_next_states(self, sampler, positions, current_state_indices, ages=None, rows=None):
+        """
+        :param sampler: (CompetingRisksSampler) sampler of the time until next event and the next state
+        :param positions: (numpy.array) positions of non-absorbed patients in this set of patients
+        :param current_state_indices: (numpy.array) indices of the current states of these patients
+        :param ages: (numpy.array) current ages of these patients (only used if rates depend on age)
+        :param rows: (numpy.array) rows of the sampler for these patients if they are not their current states
+            (see ParameterClasses.SubgroupCompetingRisksSampler)
+        :return: (dts, next_state_indices) as NumPy arrays
+        """
+
+        u_times, u_jumps = self.get_event_uniforms(positions=positions, current_state_indices=current_state_indices)
+
+        return sampler.get_next_states_given_uniforms(
+            current_state_indices=current_state_indices if rows is None else rows,
+            u_times=u_times, u_jumps=u_jumps, ages=ages)
+
+    def get_event_uniforms(self, positions, current_state_indices):
+        """ counts the departure of these patients from their current states
+        :param positions: (numpy.array) positions of non-absorbed patients in this set of patients
+        :param current_state_indices: (numpy.array) indices of the current states of these patients
+        :return: (u_times, u_jumps) uniform numbers to sample the time until the next event and the next state
+        """
+
+        departures = self.nDepartures[positions, current_state_indices]
+        self.nDepartures[positions, current_state_indices] += np.uint64(1)
+
+        with np.errstate(over='ignore'):
+            keys = _splitmix64(self.patientKeys[positions]
+                               ^ (current_state_indices.astype(np.uint64) << np.uint64(56))
+                               ^ (departures << np.uint64(1)))
+            u_times = _to_uniform(_splitmix64(keys))
+            u_jumps = _to_uniform(_splitmix64(keys ^ np.uint64(1)))
+
+        return u_times, u_jumps
+
+
+class AntitheticStreams(CommonRandomStreams):
+    def __init__(self, seed, patient_indices):
+        """ common random numbers in which patients 2m and 2m + 1 form an antithetic pair: whenever patient 2m
+        uses the uniform number u, patient 2m + 1 uses 1 - u for the same event (the k-th departure from state s)
+        :param seed: seed shared by the cohorts that should use common random numbers
+        :param patient_indices: (numpy.array) indices of patients in the cohort
+        """
+
+        patient_indices = np.asarray(patient_indices)
+        CommonRandomStreams.__init__(self, seed=seed, patient_indices=patient_indices // 2)
+        self.ifAntithetic = patient_indices % 2 == 1
+
+    def get_uniforms(self, stream):
+        return _get_antithetic(CommonRandomStreams.get_uniforms(self, stream), self.ifAntithetic)
+
+    def get_event_uniforms(self, positions, current_state_indices):
+        u_times, u_jumps = CommonRandomStreams.get_event_uniforms(
+            self, positions=positions, current_state_indices=current_state_indices)
+        if_antithetic = self.ifAntithetic[positions]
+        return _get_antithetic(u_times, if_antithetic), _get_antithetic(u_jumps, if_antithetic)
+
+
+class QuasiRandomStreams(CommonRandomStreams):
+    def __init__(self, seed, patient_indices, scheme='sobol', n_qmc_events=N_QMC_EVENTS, group_size=QMC_GROUP_SIZE):
+        """ common random numbers in which the first n_qmc_events events of each patient are sampled from
+        randomized quasi-Monte Carlo points (most of the variance of costs and QALYs comes from these events);
+        patient n uses point n % group_size of a point set that is randomized independently for every group
+        of group_size consecutive patients, so the means of groups are independent and identically distributed
+        :param seed: seed shared by the cohorts that should use common random numbers
+        :param patient_indices: (numpy.array) indices of patients in the cohort
+        :param scheme: 'sobol' for scrambled Sobol' points or 'stratified' for Latin hypercube samples
+        :param n_qmc_events: number of first events of each patient drawn from quasi-random points
+            (later events use the uniform numbers of CommonRandomStreams)
+        :param group_size: number of patients that share a point set (a power of 2)
+        """
+
+        if scheme not in ('sobol', 'stratified'):
+            raise ValueError("scheme should be either 'sobol' or 'stratified'.")
+        if group_size < 2 or group_size & (group_size - 1) != 0:
+            raise ValueError('group_size should be a power of 2.')
+
+        patient_indices = np.asarray(patient_indices)
+        CommonRandomStreams.__init__(self, seed=seed, patient_indices=patient_indices)
+        self.nQMCEvents = n_qmc_events
+        # number of events sampled for each patient so far
+        self.nEvents = np.zeros(len(patient_indices), dtype=int)
+
+        # the uniform numbers of event k of each patient are in columns 2k (time) and 2k + 1 (next state)
+        groups, group_positions = np.unique(patient_indices // group_size, return_inverse=True)
+        points = _get_qmc_points(scheme=scheme, seed=seed, groups=groups,
+                                 group_size=group_size, n_dims=2 * n_qmc_events)
+        self.points = points[group_positions, patient_indices % group_size]
+
+    def get_event_uniforms(self, positions, current_state_indices):
+        u_times, u_jumps = CommonRandomStreams.get_event_uniforms(
+            self, positions=positions, current_state_indices=current_state_indices)
+
+        events = self.nEvents[positions]
+        self.nEvents[positions] += 1
+        if_qmc = events < self.nQMCEvents
+        u_times[if_qmc] = self.points[positions[if_qmc], 2 * events[if_qmc]]
+        u_jumps[if_qmc] = self.points[positions[if_qmc], 2 * events[if_qmc] + 1]
+        return u_times, u_jumps
+
+
+def get_group_size(sampling):
+    """
+    :param sampling: sampling scheme (see SAMPLING_SCHEMES)
+    :return: number of consecutive patients whose outcomes are dependent under this scheme
+        (confidence intervals should treat the means of these groups, not patients, as independent observations)
+    """
+
+    if sampling == 'random':
+        return 1
+    elif sampling == 'antithetic':
+        return 2
+    elif sampling in ('sobol', 'stratified'):
+        return QMC_GROUP_SIZE
+    else:
+        raise ValueError('sampling should be one of ' + ', '.join(SAMPLING_SCHEMES) + '.')
+
+
+def _splitmix64(z):
+    """ splitmix64 hash of unsigned 64-bit integers """
+
+    with np.errstate(over='ignore'):
+        z = z + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def _to_uniform(z):
+    """ converts unsigned 64-bit integers to uniform numbers in [0, 1) """
+
+    return (z >> np.uint64(11)) / float(2 ** 53)
+
+
+def _get_qmc_points(scheme, seed, groups, group_size, n_dims):
+    """
+    :param scheme: 'sobol' for Sobol' points randomized by a random linear matrix scramble and a digital shift
+        (as in scipy.stats.qmc.Sobol) or 'stratified' for Latin hypercube samples
+    :param seed: seed of the randomizations
+    :param groups: (numpy.array) indices of groups (the randomization of a group depends only on (seed, group))
+    :param group_size: number of points of each group (a power of 2)
+    :param n_dims: number of dimensions
+    :return: (numpy.array) points of each group with shape (len(groups), group_size, n_dims)
+    """
+
+    rngs = [np.random.default_rng([seed, group]) for group in groups]
+
+    if scheme == 'stratified':
+        # each dimension has one point in each of the group_size intervals [i / group_size, (i + 1) / group_size)
+        strata = np.tile(np.arange(group_size)[:, np.newaxis], (1, n_dims))
+        return np.stack([(rng.permuted(strata, axis=0) + rng.random((group_size, n_dims))) / group_size
+                         for rng in rngs])
+
+    from scipy.stats import qmc
+
+    # direction numbers of the first group_size unscrambled points (point i is the XOR of the direction numbers
+    # of the binary digits of i; in scipy's Gray code order, the direction number k is point 2^(k+1) - 1)
+    n_digits = group_size.bit_length() - 1
+    unscrambled = qmc.Sobol(d=n_dims, scramble=False, bits=SOBOL_BITS).random(group_size)
+    directions = np.round(unscrambled[2 ** np.arange(1, n_digits + 1) - 1] * 2 ** SOBOL_BITS).astype(np.uint64)
+
+    # random lower triangular matrices with unit diagonals (one per group and dimension), stored by columns:
+    # column j holds the binary digit j (from the most significant) and random less significant digits
+    bits = np.uint64(1) << np.arange(SOBOL_BITS - 1, -1, -1, dtype=np.uint64)
+    columns = np.stack([rng.integers(0, 2 ** SOBOL_BITS, size=(n_dims, SOBOL_BITS), dtype=np.uint64)
+                        for rng in rngs]) & (bits - np.uint64(1)) | bits
+    shifts = np.stack([rng.integers(0, 2 ** SOBOL_BITS, size=n_dims, dtype=np.uint64) for rng in rngs])
+
+    # scrambled direction numbers (the scramble is linear, so it can be applied to direction numbers)
+    scrambled = np.zeros((len(groups), n_digits, n_dims), dtype=np.uint64)
+    for j in range(SOBOL_BITS):
+        scrambled ^= ((directions & bits[j]) > 0)[np.newaxis] * columns[:, np.newaxis, :, j]
+
+    points = np.tile(shifts[:, np.newaxis, :], (1, group_size, 1))
+    for k in range(n_digits):
+        with_digit = (np.arange(group_size) >> k) & 1 == 1
+        points[:, with_digit] ^= scrambled[:, k, np.newaxis, :]
+    return points / float(2 ** SOBOL_BITS)
+
+
+def _get_antithetic(uniforms, if_antithetic):
+    """ replaces u by 1 - u where if_antithetic is True (on the grid of _to_uniform, so the result stays in [0, 1)) """
+
+    return np.where(if_antithetic, (1 - 2 ** -53) - uniforms, uniforms)
@@ -0,0 +1,123 @@
+import copy
+
+import numpy as np
+
+from Discounting import Discounter
+from MarkovClasses import CohortOutcomes
+from ParameterClasses import SubgroupParameters
+
+
+def recost_cohort(cohort, annual_state_costs=None, annual_state_utilities=None,
+                  stroke_cost=None, annual_anticoag_cost=None):
+    """ re-calculates the discounted cost and utility of every patient of a simulated cohort for new state costs,
+    state utilities, stroke cost or anticoagulation cost without simulating the cohort again
+    (these values do not change patient trajectories, so the discounted cost of a patient is
+    the dot product of their discounted time in each state with the annual state costs plus
+    their discounted number of stroke entries times the stroke cost)
+    :param cohort: a cohort simulated with if_record_discounted_times=True (for a HeterogeneousCohort, the new values
+        replace the values of every subgroup, and values that are not given keep the values of each subgroup;
+        the outcomes of each subgroup are new_outcomes.get_subsets(boundaries=cohort.subgroupBoundaries))
+    :param annual_state_costs: (list) new annual cost of each state (if None, the cohort's values are used)
+    :param annual_state_utilities: (list) new annual utility of each state (if None, the cohort's values are used)
+    :param stroke_cost: new stroke cost (if None, the cohort's value is used)
+    :param annual_anticoag_cost: new annual cost of anticoagulation (if None, the cohort's value is used)
+    :return: (CohortOutcomes) outcomes of the cohort under the new costs and utilities
+    """
+
+    sim_outcomes = cohort.cohortOutcomes
+    if not getattr(sim_outcomes, 'ifRecordDiscountedTimes', False):
+        raise ValueError('The cohort should be simulated with if_record_discounted_times=True.')
+
+    # parameters of each subgroup of patients and the subgroup of each patient
+    # (a cohort that is not heterogeneous has one subgroup)
+    if isinstance(cohort.params, SubgroupParameters):
+        subgroup_parameters = cohort.params.subgroupParameters
+        subgroups = cohort.subgroups
+    else:
+        subgroup_parameters = [cohort.params]
+        subgroups = np.zeros(cohort.popSize, dtype=int)
+
+    # annual costs, annual utilities and stroke cost of each subgroup with the new values
+    discounters = []
+    for subgroup_params in subgroup_parameters:
+        params = copy.copy(subgroup_params)
+        if annual_state_costs is not None:
+            params.annualStateCosts = annual_state_costs
+        if annual_state_utilities is not None:
+            params.annualStateUtilities = annual_state_utilities
+        if stroke_cost is not None:
+            params.strokeCost = stroke_cost
+        if annual_anticoag_cost is not None:
+            params.annuaAntiCoagCost = annual_anticoag_cost
+        discounters.append(Discounter(parameters=params))
+    annual_costs = np.array([discounter.annualCosts for discounter in discounters])
+    annual_utilities = np.array([discounter.annualUtilities for discounter in discounters])
+    stroke_costs = np.array([discounter.strokeCost for discounter in discounters], dtype=float)
+
+    # discounted costs and utilities of patients
+    discounted_state_times = np.array(sim_outcomes.discountedStateTimes)
+    costs = (discounted_state_times * annual_costs[subgroups]).sum(axis=1) \
+        + stroke_costs[subgroups] * np.array(sim_outcomes.discountedStrokeEntries)
+    utilities = (discounted_state_times * annual_utilities[subgroups]).sum(axis=1)
+
+    # new outcomes (survival times and number of strokes do not change)
+    new_outcomes = CohortOutcomes(if_record_discounted_times=True,
+                                  death_time_bin_width=sim_outcomes.deathTimeBinWidth,
+                                  group_size=sim_outcomes.groupSize)
+    new_outcomes.survivalTimes = sim_outcomes.survivalTimes
+    new_outcomes.deathIndices = sim_outcomes.deathIndices
+    new_outcomes.nTotalStrokes = sim_outcomes.nTotalStrokes
+    new_outcomes.nEvents = sim_outcomes.nEvents
+    new_outcomes.costs = costs.tolist()
+    new_outcomes.utilities = utilities.tolist()
+    new_outcomes.discountedStateTimes = sim_outcomes.discountedStateTimes
+    new_outcomes.discountedStrokeEntries = sim_outcomes.discountedStrokeEntries
+    new_outcomes.calculate_cohort_outcomes(initial_pop_size=cohort.popSize)
+
+    return new_outcomes
+
+
+if __name__ == '__main__':
+
+    # re-costing with the original costs and utilities should reproduce the simulated outcomes
+    import InputData as D
+    import MarkovClasses as Cls
+    import ParameterClasses as P
+
+    for therapy in P.Therapies:
+        cohort = Cls.Cohort(id=therapy.value, pop_size=D.POP_SIZE, parameters=P.Parameters(therapy=therapy),
+                            if_record_discounted_times=True)
+        cohort.simulate(sim_length=D.SIM_LENGTH, engine='vectorized')
+
+        recosted = recost_cohort(cohort)
+        assert np.allclose(recosted.costs, cohort.cohortOutcomes.costs)
+        assert np.allclose(recosted.utilities, cohort.cohortOutcomes.utilities)
+
+        # cost of the cohort if the cost of stroke doubles
+        recosted = recost_cohort(cohort, stroke_cost=2 * cohort.params.strokeCost)
+        print(therapy, 'mean discounted cost: {:.2f}, with doubled stroke cost: {:.2f}'.format(
+            cohort.cohortOutcomes.statCost.get_mean(), recosted.statCost.get_mean()))
+
+    # re-costing a heterogeneous cohort applies the costs and utilities of each subgroup to its patients
+    import PopulationClasses as Pop
+
+    rng = np.random.RandomState(seed=1)
+    covariates = {'age': rng.uniform(60, 95, size=2000), 'prior_stroke': rng.randint(0, 2, size=2000)}
+    keys, subgroups = Pop.get_subgroups(covariates=covariates, bins=D.SUBGROUP_BINS)
+    subgroup_inputs = [dict(Pop.get_subgroup_inputs(key), STROKE_COST=1000 * (k + 1)) for k, key in enumerate(keys)]
+    cohort = Pop.HeterogeneousCohort(id=1, subgroups=subgroups, if_record_discounted_times=True,
+                                     parameters=P.SubgroupParameters(therapy=P.Therapies.ANTICOAG,
+                                                                     subgroup_inputs=subgroup_inputs))
+    cohort.simulate(sim_length=D.SIM_LENGTH)
+
+    recosted = recost_cohort(cohort)
+    assert np.allclose(recosted.costs, cohort.cohortOutcomes.costs)
+    assert np.allclose(recosted.utilities, cohort.cohortOutcomes.utilities)
+
+    # with a stroke cost shared by all subgroups, the cost of each subgroup changes by its own stroke entries
+    recosted = recost_cohort(cohort, stroke_cost=5000)
+    for k, (before, after) in enumerate(zip(cohort.subgroupOutcomes,
+                                            recosted.get_subsets(boundaries=cohort.subgroupBoundaries))):
+        assert np.allclose(np.array(after.costs) - np.array(before.costs),
+                           (5000 - 1000 * (k + 1)) * np.array(before.discountedStrokeEntries))
+    print('Heterogeneous cohort re-costed with the costs of each subgroup.')
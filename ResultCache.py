@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import MarkovClasses as Cls
+
+
+class ResultCache:
+    def __init__(self, cache_dir='ResultCache', max_size_mb=1024):
+        """ on-disk cache of the outcomes of simulated cohorts; every entry is a directory of .npy files
+        (one per outcome array) named by a hash of the parameters and settings of the run, so that
+        an identical cohort is loaded (memory-mapped) instead of being simulated again
+        :param cache_dir: directory to store the cache in
+        :param max_size_mb: largest size of the cache (in MB); least recently used entries are removed
+            when the cache grows beyond this size
+        """
+
+        self.cacheDir = cache_dir
+        self.maxSize = max_size_mb * 2 ** 20
+
+    def load(self, cohort, sim_length, engine='object', batch_size=100000):
+        """ loads the outcomes of a cohort if they are in the cache
+        :param cohort: a cohort that is not simulated yet
+        :param sim_length: simulation length
+        :param engine: 'object' or 'vectorized'
+        :param batch_size: number of patients simulated together (only used by the 'vectorized' engine)
+        :return: True if the outcomes were found and loaded into cohort.cohortOutcomes (the summary
+            statistics and survival curve still need to be calculated), False otherwise
+        """
+
+        entry_dir = self._get_entry_dir(cohort=cohort, sim_length=sim_length, engine=engine, batch_size=batch_size)
+        if not os.path.isdir(entry_dir):
+            return False
+
+        # memory-mapped arrays (viewed as plain numpy.arrays, which deampy expects, without copying them)
+        state = {file_name[:-len('.npy')]: np.load(os.path.join(entry_dir, file_name), mmap_mode='r').view(np.ndarray)
+                 for file_name in os.listdir(entry_dir)}
+        cohort.cohortOutcomes.set_state(state, if_copy=False)
+
+        # mark the entry as recently used
+        os.utime(entry_dir)
+        return True
+
+    def save(self, cohort, sim_length, engine='object', batch_size=100000):
+        """ saves the outcomes of a simulated cohort in the cache
+        :param cohort: a simulated cohort
+        :param sim_length: simulation length
+        :param engine: 'object' or 'vectorized'
+        :param batch_size: number of patients simulated together (only used by the 'vectorized' engine)
+        """
+
+        entry_dir = self._get_entry_dir(cohort=cohort, sim_length=sim_length, engine=engine, batch_size=batch_size)
+        if os.path.isdir(entry_dir):
+            return
+
+        # write the entry under a temporary name so that an interrupted write never leaves a partial entry
+        os.makedirs(self.cacheDir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=self.cacheDir, prefix='.tmp')
+        for name, values in cohort.cohortOutcomes.get_state().items():
+            np.save(os.path.join(temp_dir, name + '.npy'), values)
+        try:
+            os.replace(temp_dir, entry_dir)
+        except OSError:
+            # another process saved the same entry in the meantime
+            shutil.rmtree(temp_dir)
+
+        self.evict(keep=entry_dir)
+
+    def evict(self, keep=None):
+        """ removes the least recently used entries until the cache is not larger than its maximum size
+        :param keep: directory of an entry that should not be removed (e.g. the one just saved)
+        """
+
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            entry_dir = os.path.join(self.cacheDir, name)
+            if name.startswith('.tmp') or not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, file_name)) for file_name in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.maxSize:
+                break
+            if entry_dir != keep:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total_size -= size
+
+    def clear(self):
+        """ removes all entries of the cache """
+        shutil.rmtree(self.cacheDir, ignore_errors=True)
+
+    def _get_entry_dir(self, cohort, sim_length, engine, batch_size):
+        return os.path.join(self.cacheDir, get_key(
+            cohort=cohort, sim_length=sim_length, engine=engine, batch_size=batch_size))
+
+
+def get_key(cohort, sim_length, engine='object', batch_size=100000):
+    """
+    :param cohort: a cohort
+    :param sim_length: simulation length
+    :param engine: 'object' or 'vectorized'
+    :param batch_size: number of patients simulated together (only used by the 'vectorized' engine)
+    :return: (string) hash of everything that determines the simulated outcomes of the cohort
+    """
+
+    if cohort.ifStreaming:
+        raise ValueError('Outcomes of cohorts simulated with if_streaming=True cannot be cached.')
+
+    contents = {
+        'engine_version': Cls.ENGINE_VERSION,
+        'engine': engine,
+        # batches are seeded by the index of their first patient unless patients have their own random streams
+        'batch_size': batch_size if engine == 'vectorized' and cohort.crnSeed is None and cohort.sampling == 'random'
+        else None,
+        'cohort_id': cohort.id,
+        'pop_size': cohort.popSize,
+        'sim_length': sim_length,
+        'crn_seed': cohort.crnSeed,
+        'sampling': cohort.sampling,
+        'if_record_discounted_times': cohort.ifRecordDiscountedTimes,
+    }
+    contents.update(get_parameters_description(parameters=cohort.params))
+
+    return hashlib.sha256(json.dumps(contents, sort_keys=True).encode()).hexdigest()
+
+
+def get_parameters_description(parameters):
+    """
+    :param parameters: parameters
+    :return: (dictionary) the values of parameters that determine the outcomes of a cohort
+        (the resolved transition rates, costs, utilities, discount rate and initial health state)
+    """
+
+    return {
+        'therapy': parameters.therapy.name,
+        'initial_health_state': parameters.initialHealthState.name,
+        'trans_rate_matrix': np.asarray(parameters.transRateMatrix, dtype=float).tolist(),
+        'age_breaks': np.asarray(parameters.ageBreaks, dtype=float).tolist(),
+        'trans_rate_matrices': np.asarray(parameters.transRateMatrices, dtype=float).tolist(),
+        'starting_ages': np.asarray(parameters.startingAges, dtype=float).tolist(),
+        'starting_age_cum_probs': np.asarray(parameters.startingAgeCumProbs, dtype=float).tolist(),
+        'annual_state_costs': np.asarray(parameters.annualStateCosts, dtype=float).tolist(),
+        'annual_state_utilities': np.asarray(parameters.annualStateUtilities, dtype=float).tolist(),
+        'annual_anticoag_cost': float(parameters.annuaAntiCoagCost),
+        'stroke_cost': float(parameters.strokeCost),
+        'discount_rate': float(parameters.discountRate),
+    }
@@ -0,0 +1,21 @@
+import CalibrationClasses as Cal
+import InputData as D
+import Support as Support
+
+if __name__ == '__main__':
+
+    # targets and bounds of the calibrated inputs
+    targets = [Cal.CalibrationTarget(**target) for target in D.CALIBRATION_TARGETS]
+    calibration = Cal.CalibrationRunner(targets=targets,
+                                        bounds=D.CALIBRATION_BOUNDS,
+                                        evaluator=D.CALIBRATION_EVALUATOR,
+                                        pop_size=D.CALIBRATION_POP_SIZE,
+                                        sim_length=D.SIM_LENGTH,
+                                        n_accepted=D.CALIBRATION_N_ACCEPTED,
+                                        cache_file='CalibrationCache.json')
+
+    # search for the accepted parameter sets (evaluated outcomes are cached for later runs)
+    calibration.run(n_workers=D.N_WORKERS)
+
+    # print the accepted parameter sets
+    Support.print_calibration(runner=calibration)
@@ -0,0 +1,35 @@
+import numpy as np
+
+import InputData as D
+import ParameterClasses as P
+import PopulationClasses as Pop
+import Support as Support
+
+if __name__ == '__main__':
+
+    # covariates of patients (read from POPULATION_FILE or sampled)
+    if D.POPULATION_FILE is None:
+        rng = np.random.RandomState(seed=1)
+        covariates = {'age': rng.uniform(60, 95, size=D.POP_SIZE),
+                      'female': rng.randint(0, 2, size=D.POP_SIZE),
+                      'prior_stroke': (rng.random_sample(D.POP_SIZE) < 0.15).astype(int)}
+    else:
+        covariates = Pop.read_covariates(file_name=D.POPULATION_FILE)
+
+    # subgroups of patients and their model inputs
+    keys, subgroups = Pop.get_subgroups(covariates=covariates, bins=D.SUBGROUP_BINS)
+    subgroup_inputs = [Pop.get_subgroup_inputs(key=key) for key in keys]
+
+    for therapy in P.Therapies:
+        # simulate all patients of the population under this therapy
+        cohort = Pop.HeterogeneousCohort(id=1,
+                                         subgroups=subgroups,
+                                         parameters=P.SubgroupParameters(therapy=therapy,
+                                                                         subgroup_inputs=subgroup_inputs),
+                                         crn_seed=1,
+                                         sampling=D.SAMPLING)
+        cohort.simulate(sim_length=D.SIM_LENGTH, n_workers=D.N_WORKERS)
+
+        # print the outcomes of the population and of each subgroup
+        Support.print_outcomes(sim_outcomes=cohort.cohortOutcomes, therapy_name=therapy)
+        Support.print_subgroup_outcomes(cohort=cohort, keys=keys, therapy_name=therapy)
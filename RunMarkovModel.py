@@ -5,6 +5,8 @@ import InputData as D
 import MarkovClasses as Cls
 import ParameterClasses as P
 import Support as Support
+from Profiling import Profiler, time_phase
+from ResultCache import ResultCache
 
 # selected therapy
 therapy = P.Therapies.ANTICOAG
@@ -12,25 +14,36 @@ therapy = P.Therapies.ANTICOAG
 # create a cohort
 myCohort = Cls.Cohort(id=1,
                       pop_size=D.POP_SIZE,
-                      parameters=P.Parameters(therapy=therapy))
+                      parameters=P.Parameters(therapy=therapy),
+                      if_profile=D.IF_PROFILE)
 
 # simulate the cohort over the specified time steps
-myCohort.simulate(sim_length=D.SIM_LENGTH)
-
-# plot the sample path (survival curve)
-path.plot_sample_path(
-    sample_path=myCohort.cohortOutcomes.nLivingPatients,
-    title='Survival Curve',
-    x_label='Time-Step (Year)',
-    y_label='Number Survived')
-
-# plot the histogram of survival times
-hist.plot_histogram(
-    data=myCohort.cohortOutcomes.nTotalStrokes,
-    title='Histogram of Patient Total Strokes',
-    x_label='Survival Time (Year)',
-    y_label='Count',
-    bin_width=1)
+# (or load its outcomes if it was simulated before with the same inputs)
+myCohort.simulate(sim_length=D.SIM_LENGTH,
+                  cache=ResultCache(max_size_mb=D.CACHE_MAX_SIZE_MB) if D.IF_CACHE_RESULTS else None)
+
+# profiler of the reporting phases (None if profiling is turned off)
+reportingProfiler = Profiler(name='Reporting') if D.IF_PROFILE else None
+
+with time_phase(reportingProfiler, 'plotting'):
+    # plot the sample path (survival curve)
+    path.plot_sample_path(
+        sample_path=myCohort.cohortOutcomes.nLivingPatients,
+        title='Survival Curve',
+        x_label='Time-Step (Year)',
+        y_label='Number Survived')
+
+    # plot the histogram of survival times
+    hist.plot_histogram(
+        data=myCohort.cohortOutcomes.nTotalStrokes,
+        title='Histogram of Patient Total Strokes',
+        x_label='Survival Time (Year)',
+        y_label='Count',
+        bin_width=1)
 
 # print the outcomes of this simulated cohort
 Support.print_outcomes(sim_outcomes=myCohort.cohortOutcomes, therapy_name=therapy)
+
+# print and save the profile of this run
+if D.IF_PROFILE:
+    Support.report_profiles(profilers=[myCohort.cohortOutcomes.profiler, reportingProfiler])
@@ -0,0 +1,19 @@
+import InputData as D
+import PSAClasses as PSA
+import Support as Support
+
+if __name__ == '__main__':
+
+    # sample the uncertain inputs
+    psa = PSA.PSARunner(n_draws=D.PSA_N_DRAWS,
+                        pop_size=D.PSA_POP_SIZE,
+                        sim_length=D.SIM_LENGTH)
+
+    # simulate both therapies under every draw and save the results
+    psaResults = psa.run(n_workers=D.N_WORKERS, file_name='PSAResults.npz')
+
+    # report the CEA results
+    Support.report_PSA_CEA_CBA(psa_results=psaResults)
+
+    # report the expected value of perfect and partial perfect information
+    Support.report_VOI(psa_results=psaResults)
@@ -0,0 +1,12 @@
+import InputData as D
+from ScenarioService import ScenarioService
+
+if __name__ == '__main__':
+
+    # serve scenario requests from ScenarioService.ScenarioClient until a client sends 'shutdown'
+    # (for example, ScenarioClient().evaluate(therapy='ANTICOAG', inputs={'ANTICOAG_COST': 1000}, pop_size=20000))
+    service = ScenarioService(socket_file=D.SERVICE_SOCKET_FILE,
+                              n_workers=D.N_WORKERS,
+                              cache_dir='ResultCache' if D.IF_CACHE_RESULTS else None)
+    print('Serving scenario requests on {} with {} worker process(es).'.format(service.socketFile, service.nWorkers))
+    service.run()
@@ -0,0 +1,305 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import InputData as D
+import MarkovClasses as Cls
+import ParameterClasses as P
+from ResultCache import ResultCache
+
+SCENARIO_FIELDS = ('therapy', 'inputs', 'pop_size', 'seed', 'sim_length')  # fields of a scenario request
+MAX_REQUEST_SIZE = 2 ** 20  # largest size of a request or response in bytes
+
+
+def get_scenario(request):
+    """
+    :param request: (dictionary) a scenario request with 'therapy' (name of a therapy in ParameterClasses.Therapies)
+        and optionally 'inputs' (values of model inputs keyed by their names in InputData), 'pop_size' and
+        'sim_length' (defaults in InputData) and 'seed' (id of the simulated cohort, which seeds its patients)
+    :return: (dictionary) the scenario with every field filled in (identical scenarios are equal dictionaries)
+    """
+
+    unknown_fields = set(request) - set(SCENARIO_FIELDS)
+    if len(unknown_fields) > 0:
+        raise ValueError('Unknown fields in the scenario request: {}.'.format(', '.join(sorted(unknown_fields))))
+
+    therapy = request.get('therapy')
+    if therapy not in P.Therapies.__members__:
+        raise ValueError("'therapy' should be one of {}.".format(', '.join(P.Therapies.__members__)))
+
+    inputs = request.get('inputs') or {}
+    if not isinstance(inputs, dict):
+        raise ValueError("'inputs' should map names of model inputs to their values.")
+    for name in inputs:
+        if name not in D.MODEL_INPUTS:
+            raise ValueError("'{}' is not a model input defined in InputData.".format(name))
+
+    pop_size = request.get('pop_size', D.POP_SIZE)
+    seed = request.get('seed', 0)
+    for field, value in (('pop_size', pop_size), ('seed', seed)):
+        if not isinstance(value, int) or isinstance(value, bool) or value < (1 if field == 'pop_size' else 0):
+            raise ValueError("'{}' should be a {} integer.".format(
+                field, 'positive' if field == 'pop_size' else 'non-negative'))
+
+    sim_length = request.get('sim_length', D.SIM_LENGTH)
+    if not isinstance(sim_length, (int, float)) or isinstance(sim_length, bool) or sim_length <= 0:
+        raise ValueError("'sim_length' should be a positive number.")
+
+    return {'therapy': therapy, 'inputs': inputs, 'pop_size': pop_size, 'seed': seed, 'sim_length': sim_length}
+
+
+def simulate_scenario(scenario, cache_dir=None):
+    """ simulates the cohort of a scenario (runs in a worker process of the service)
+    :param scenario: (dictionary) returned by get_scenario
+    :param cache_dir: directory of the ResultCache to load or save the outcomes of the cohort
+        (if None, the cohort is always simulated)
+    :return: (dictionary) summary outcomes of the cohort
+    """
+
+    start = time.perf_counter()
+
+    cohort = Cls.Cohort(id=scenario['seed'],
+                        pop_size=scenario['pop_size'],
+                        parameters=P.Parameters(therapy=P.Therapies[scenario['therapy']],
+                                                inputs=scenario['inputs'] or None))
+    cohort.simulate(sim_length=scenario['sim_length'], engine='vectorized',
+                    cache=None if cache_dir is None else ResultCache(cache_dir=cache_dir,
+                                                                     max_size_mb=D.CACHE_MAX_SIZE_MB))
+    outcomes = cohort.cohortOutcomes
+
+    summary = {'n_patients': cohort.popSize, 'n_events': int(outcomes.nEvents)}
+    for name, stat in (('survival_time', outcomes.statSurvivalTime),
+                       ('n_strokes', outcomes.statNumStrokes),
+                       ('cost', outcomes.statCost),
+                       ('utility', outcomes.statUtility)):
+        summary[name] = {'mean': float(stat.get_mean()),
+                         'ci': [float(bound) for bound in stat.get_t_CI(alpha=D.ALPHA)]}
+    summary['seconds'] = time.perf_counter() - start
+
+    return summary
+
+
+def _warm_up():
+    """ imports deampy and simulates a small cohort so that the first request to a worker process
+    does not pay for imports and the first calls into NumPy """
+
+    simulate_scenario(scenario=get_scenario({'therapy': P.Therapies.NONE.name, 'pop_size': 100}))
+
+
+class ScenarioService:
+    def __init__(self, socket_file=D.SERVICE_SOCKET_FILE, n_workers=D.N_WORKERS, cache_dir=None):
+        """ a local service that evaluates scenario requests sent over a Unix socket (one request per connection
+        as a JSON object on one line, answered by a JSON object on one line; see ScenarioClient); cohorts
+        are simulated by a pool of warm worker processes and concurrent requests for the same scenario
+        share one simulation
+        :param socket_file: name of the Unix socket file to listen on
+        :param n_workers: number of worker processes
+        :param cache_dir: directory of a ResultCache to reuse the outcomes of scenarios simulated before
+            (if None, every scenario that is not being simulated already is simulated)
+        """
+
+        self.socketFile = socket_file
+        self.nWorkers = n_workers
+        self.cacheDir = cache_dir
+
+        self.nRequests = 0      # number of scenario requests received
+        self.nSimulations = 0   # number of scenarios simulated
+        self.nMerged = 0        # number of requests answered by the simulation of an identical request
+
+        self._executor = None
+        self._inFlight = {}     # futures of scenarios being simulated, keyed by their JSON
+        self._stop = None
+
+    def run(self):
+        """ serves requests until a client sends the 'shutdown' command """
+
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """ serves requests until a client sends the 'shutdown' command """
+
+        self._stop = asyncio.Event()
+        if os.path.exists(self.socketFile):
+            os.remove(self.socketFile)
+
+        with ProcessPoolExecutor(max_workers=self.nWorkers, initializer=_warm_up) as self._executor:
+            server = await asyncio.start_unix_server(self._handle_connection, path=self.socketFile,
+                                                     limit=MAX_REQUEST_SIZE)
+            async with server:
+                await self._stop.wait()
+        os.remove(self.socketFile)
+
+    async def _handle_connection(self, reader, writer):
+        """ answers the request (a JSON object on one line) sent over a connection """
+
+        try:
+            line = await reader.readline()
+            if line:
+                response = await self._get_response(line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def _get_response(self, line):
+        """
+        :param line: (bytes) a request
+        :return: (dictionary) {'ok': True, 'outcomes': ...} or {'ok': True, 'status': ...} if the request succeeded
+            and {'ok': False, 'error': message} otherwise
+        """
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('A request should be a JSON object.')
+
+            command = request.pop('command', 'evaluate')
+            if command == 'status':
+                return {'ok': True, 'status': {'n_requests': self.nRequests,
+                                               'n_simulations': self.nSimulations,
+                                               'n_merged': self.nMerged,
+                                               'n_in_flight': len(self._inFlight)}}
+            elif command == 'shutdown':
+                self._stop.set()
+                return {'ok': True}
+            elif command == 'evaluate':
+                return {'ok': True, 'outcomes': await self._evaluate(request)}
+            else:
+                raise ValueError("'command' should be 'evaluate', 'status' or 'shutdown'.")
+
+        except Exception as error:
+            return {'ok': False, 'error': '{}: {}'.format(type(error).__name__, error)}
+
+    async def _evaluate(self, request):
+        """
+        :param request: (dictionary) a scenario request
+        :return: (dictionary) summary outcomes of the scenario
+        """
+
+        scenario = get_scenario(request)
+        self.nRequests += 1
+
+        # simulate the scenario unless an identical scenario is being simulated
+        key = json.dumps(scenario, sort_keys=True)
+        future = self._inFlight.get(key)
+        if future is None:
+            self.nSimulations += 1
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, simulate_scenario, scenario, self.cacheDir)
+            self._inFlight[key] = future
+            future.add_done_callback(lambda _: self._inFlight.pop(key))
+        else:
+            self.nMerged += 1
+
+        # (shielded so that a client that disconnects does not cancel the simulation for other clients)
+        return await asyncio.shield(future)
+
+
+class ScenarioClient:
+    def __init__(self, socket_file=D.SERVICE_SOCKET_FILE, timeout=None):
+        """ a client of a ScenarioService running on this machine
+        :param socket_file: name of the Unix socket file the service listens on
+        :param timeout: seconds to wait for a response (if None, waits until the response arrives)
+        """
+
+        self.socketFile = socket_file
+        self.timeout = timeout
+
+    def evaluate(self, therapy, inputs=None, pop_size=D.POP_SIZE, seed=0, sim_length=D.SIM_LENGTH):
+        """
+        :param therapy: (ParameterClasses.Therapies or its name) selected therapy
+        :param inputs: (dictionary) values of model inputs (keyed by their names in InputData)
+            to use instead of the values defined in InputData
+        :param pop_size: population size of the cohort
+        :param seed: id of the cohort (which seeds the random numbers of its patients)
+        :param sim_length: simulation length
+        :return: (dictionary) summary outcomes of the cohort: 'n_patients', 'n_events', 'seconds' (spent on
+            the simulation) and the 'mean' and confidence interval 'ci' of 'survival_time', 'n_strokes',
+            'cost' and 'utility'
+        """
+
+        return self._send({'therapy': therapy.name if isinstance(therapy, P.Therapies) else therapy,
+                           'inputs': inputs or {},
+                           'pop_size': pop_size,
+                           'seed': seed,
+                           'sim_length': sim_length})['outcomes']
+
+    def get_status(self):
+        """
+        :return: (dictionary) numbers of requests received, scenarios simulated, requests merged with
+            an identical request, and scenarios being simulated
+        """
+        return self._send({'command': 'status'})['status']
+
+    def shutdown(self):
+        """ stops the service """
+        self._send({'command': 'shutdown'})
+
+    def _send(self, request):
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            connection.connect(self.socketFile)
+            connection.sendall(json.dumps(request).encode() + b'\n')
+            with connection.makefile('rb') as file:
+                response = json.loads(file.readline(MAX_REQUEST_SIZE))
+
+        if not response['ok']:
+            raise ValueError(response['error'])
+        return response
+
+
+if __name__ == '__main__':
+
+    # check that concurrent identical requests share a simulation and that outcomes agree with
+    # simulating the cohort directly
+    import tempfile
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_file = os.path.join(temp_dir, 'service.sock')
+        service = ScenarioService(socket_file=socket_file, n_workers=1)
+        thread = threading.Thread(target=service.run)
+        thread.start()
+
+        client = ScenarioClient(socket_file=socket_file)
+        while True:
+            try:
+                client.get_status()
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                time.sleep(0.1)
+
+        scenario_a = {'therapy': 'ANTICOAG', 'pop_size': 50000, 'seed': 1}
+        scenario_b = {'therapy': 'ANTICOAG', 'pop_size': 50000, 'seed': 1, 'inputs': {'ANTICOAG_COST': 1000}}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=5) as threads:
+            results = list(threads.map(lambda scenario: client.evaluate(**scenario),
+                                       [scenario_a] * 4 + [scenario_b]))
+        print('5 concurrent requests answered in {:.2f} seconds.'.format(time.perf_counter() - start))
+
+        status = client.get_status()
+        assert status['n_requests'] == 5 and status['n_simulations'] == 2 and status['n_merged'] == 3, status
+        assert all(result == results[0] for result in results[:4])
+        assert results[4]['cost']['mean'] < results[0]['cost']['mean']
+        assert results[4]['utility'] == results[0]['utility']
+
+        # a request for an unknown input or for a simulation setting is rejected
+        for name in ('NOT_AN_INPUT', 'POP_SIZE'):
+            try:
+                client.evaluate(therapy='NONE', inputs={name: 10})
+                raise AssertionError("'{}' should be rejected.".format(name))
+            except ValueError as error:
+                print('Rejected:', error)
+
+        client.shutdown()
+        thread.join()
+
+    direct = simulate_scenario(scenario=get_scenario(scenario_a))
+    assert all(direct[name] == results[0][name] for name in ('survival_time', 'n_strokes', 'cost', 'utility'))
+    print('Concurrent identical requests shared a simulation and outcomes agree with a direct simulation.')
@@ -0,0 +1,208 @@
+import time
+
+import numpy as np
+
+from RandomStreams import get_group_size
+from StreamingStatistics import OnlineStat
+from TraceClasses import remove_trace
+
+MIN_N_BATCHES = 5   # smallest number of batches simulated before the targets are checked
+                    # (confidence intervals from fewer batch means are too unreliable to stop on)
+OUTCOMES = {'cost': [1, 0], 'utility': [0, 1]}  # coefficients of (mean cost, mean utility) of each outcome
+
+
+def get_batch_size(batch_size, sampling):
+    """
+    :param batch_size: number of patients of a cohort simulated in a round
+    :param sampling: sampling scheme of the cohort (see RandomStreams.SAMPLING_SCHEMES)
+    :return: batch_size rounded up to a multiple of the number of patients whose outcomes are dependent
+        under the sampling scheme (so that batch means are independent)
+    """
+    group_size = get_group_size(sampling)
+    return -(-batch_size // group_size) * group_size
+
+
+class PrecisionTarget:
+    def __init__(self, outcome, half_width, cohort_index=0, cohort_index_ref=None, wtp=None):
+        """ a target half-width of the confidence interval of a mean outcome
+        :param outcome: 'cost', 'utility' or 'nmb' (net monetary benefit: wtp * utility - cost)
+        :param half_width: target half-width of the confidence interval
+        :param cohort_index: index of the cohort (in the list of cohorts of the SequentialRunner)
+        :param cohort_index_ref: if provided, the target is for the mean outcome of the cohort minus
+            that of this reference cohort (e.g. the incremental net monetary benefit)
+        :param wtp: willingness-to-pay per unit of utility (only used for 'nmb')
+        """
+
+        if outcome == 'nmb':
+            if wtp is None:
+                raise ValueError("wtp should be provided for the outcome 'nmb'.")
+            self.coefficients = np.array([-1, wtp], dtype=float)
+        elif outcome in OUTCOMES:
+            self.coefficients = np.array(OUTCOMES[outcome], dtype=float)
+        else:
+            raise ValueError("outcome should be 'cost', 'utility' or 'nmb'.")
+
+        self.outcome = outcome
+        self.halfWidth = half_width
+        self.cohortIndex = cohort_index
+        self.cohortIndexRef = cohort_index_ref
+        self.wtp = wtp
+        # mean outcome of each batch of patients (batch means are independent and identically distributed)
+        self.stat = OnlineStat(name=self.get_name())
+
+    def get_name(self):
+        """
+        :return: (string) description of the targeted outcome (e.g. 'nmb at wtp 30000 of cohort 1 - cohort 0')
+        """
+        name = self.outcome if self.wtp is None else '{} at wtp {:g}'.format(self.outcome, self.wtp)
+        if self.cohortIndexRef is None:
+            return '{} of cohort {}'.format(name, self.cohortIndex)
+        else:
+            return '{} of cohort {} - cohort {}'.format(name, self.cohortIndex, self.cohortIndexRef)
+
+    def record(self, batch_means):
+        """ records the outcome of a batch of patients
+        :param batch_means: (numpy.array) mean cost and utility of the batch in each cohort with shape (n_cohorts, 2)
+        """
+
+        value = self.coefficients @ batch_means[self.cohortIndex]
+        if self.cohortIndexRef is not None:
+            value -= self.coefficients @ batch_means[self.cohortIndexRef]
+        self.stat.record(values=value)
+
+    def get_half_width(self, alpha):
+        """
+        :param alpha: significance level
+        :return: half-width of the t-based confidence interval of the mean outcome
+            (from the means of batches; nan before two batches are recorded)
+        """
+        return self.stat.get_t_half_length(alpha)
+
+    def get_if_met(self, alpha):
+        """
+        :return: True if the half-width of the confidence interval is not larger than the target
+        """
+        return self.get_half_width(alpha) <= self.halfWidth
+
+
+class SequentialRunner:
+    def __init__(self, cohorts, targets, batch_size=5000, alpha=0.05, min_n_batches=MIN_N_BATCHES, max_seconds=None):
+        """ simulates cohorts in rounds of one batch of patients per cohort until the confidence intervals
+        of the targeted outcomes are narrow enough, the patient budget (the population size of cohorts)
+        is used up, or the time budget runs out
+        (batch k of a cohort holds patients k * batch_size, ..., (k + 1) * batch_size - 1, whose random numbers
+        are seeded as in Cohort.simulate, so a run that stops after k batches has the same outcomes as
+        a run of k * batch_size patients, and a time budget only changes where the run stops)
+        :param cohorts: (list) cohorts to simulate (with the same population size, which is the patient budget)
+        :param targets: (list) of PrecisionTarget objects
+        :param batch_size: number of patients of a cohort simulated in a round (rounded up to a multiple of
+            the number of patients whose outcomes are dependent under the sampling schemes of cohorts, e.g. 256
+            for 'sobol'; the patient budget is the largest multiple of the batch size that is not above the
+            population size, so that every batch has the same number of patients)
+        :param alpha: significance level of confidence intervals
+        :param min_n_batches: smallest number of batches simulated before the targets are checked
+        :param max_seconds: time budget in seconds (if None, there is no time budget)
+        """
+
+        pop_size = cohorts[0].popSize
+        if any(cohort.popSize != pop_size for cohort in cohorts):
+            raise ValueError('Cohorts should have the same population size.')
+        # (group sizes are powers of 2, so the largest batch size is a multiple of the others)
+        batch_size = max(get_batch_size(batch_size=batch_size, sampling=cohort.sampling) for cohort in cohorts)
+        if pop_size < batch_size:
+            raise ValueError('The population size of cohorts ({}) should be at least the batch size ({}).'.format(
+                pop_size, batch_size))
+
+        self.cohorts = cohorts
+        self.targets = targets
+        self.batchSize = batch_size
+        self.maxNBatches = pop_size // batch_size  # number of batches in the patient budget
+        self.alpha = alpha
+        self.minNBatches = min_n_batches
+        self.maxSeconds = max_seconds
+
+        self.nBatches = 0       # number of batches simulated in each cohort
+        self.nPatients = 0      # number of patients simulated in each cohort
+        self.seconds = 0        # time spent on the run
+        self.stopReason = None  # 'targets met', 'patient budget' or 'time budget'
+
+    def run(self, sim_length, engine='vectorized'):
+        """ simulates batches of patients until a stopping rule is met and calculates the outcomes of cohorts
+        :param sim_length: simulation length
+        :param engine: 'object' or 'vectorized'
+        """
+
+        start = time.perf_counter()
+        batch_means = np.empty((len(self.cohorts), 2))
+        for cohort in self.cohorts:
+            if cohort.traceDir is not None:
+                remove_trace(cohort.traceDir)
+
+        for first_index in range(0, self.maxNBatches * self.batchSize, self.batchSize):
+
+            # simulate the next batch of patients of every cohort
+            for k, cohort in enumerate(self.cohorts):
+                batch_outcomes = cohort.create_cohort_outcomes()
+                cohort.simulate_patients(sim_length=sim_length,
+                                         first_index=first_index, last_index=first_index + self.batchSize,
+                                         cohort_outcomes=batch_outcomes,
+                                         engine=engine, batch_size=self.batchSize)
+                batch_means[k] = batch_outcomes.get_mean_cost_and_utility()
+                cohort.cohortOutcomes.merge(batch_outcomes)
+
+            for target in self.targets:
+                target.record(batch_means=batch_means)
+            self.nBatches += 1
+            self.nPatients += self.batchSize
+            self.seconds = time.perf_counter() - start
+
+            # stop if every target is met or the time budget has run out
+            if self.nBatches >= self.minNBatches and all(target.get_if_met(self.alpha) for target in self.targets):
+                self.stopReason = 'targets met'
+                break
+            if self.maxSeconds is not None and self.seconds >= self.maxSeconds:
+                self.stopReason = 'time budget'
+                break
+        else:
+            self.stopReason = 'patient budget'
+
+        for cohort in self.cohorts:
+            cohort.cohortOutcomes.calculate_cohort_outcomes(initial_pop_size=self.nPatients)
+
+
+if __name__ == '__main__':
+
+    # check that a run that stops after k batches has the same outcomes as simulating k * batch_size patients
+    import InputData as D
+    import MarkovClasses as Cls
+    import ParameterClasses as P
+
+    def get_cohorts(pop_size):
+        return [Cls.Cohort(id=therapy.value, pop_size=pop_size, parameters=P.Parameters(therapy=therapy), crn_seed=0)
+                for therapy in P.Therapies]
+
+    targets = [PrecisionTarget(outcome='cost', half_width=50, cohort_index=0),
+               PrecisionTarget(outcome='nmb', half_width=500, cohort_index=1, cohort_index_ref=0, wtp=30000)]
+    cohorts = get_cohorts(pop_size=100000)
+    runner = SequentialRunner(cohorts=cohorts, targets=targets, batch_size=2000)
+    runner.run(sim_length=D.SIM_LENGTH)
+
+    for target in targets:
+        print('{}: {:.2f} +/- {:.2f} (target +/- {})'.format(
+            target.get_name(), target.stat.get_mean(), target.get_half_width(runner.alpha), target.halfWidth))
+    print('Stopped after {} patients per cohort ({}).'.format(runner.nPatients, runner.stopReason))
+
+    for cohort, cohort_ref in zip(cohorts, get_cohorts(pop_size=100000)):
+        cohort_ref.simulate_patients(sim_length=D.SIM_LENGTH, first_index=0, last_index=runner.nPatients,
+                                     cohort_outcomes=cohort_ref.cohortOutcomes,
+                                     engine='vectorized', batch_size=runner.batchSize)
+        assert np.array_equal(cohort.cohortOutcomes.costs, cohort_ref.cohortOutcomes.costs)
+    print('Outcomes agree with simulating the same number of patients at once.')
+
+    # the batch size is rounded up to the groups of quasi-random points and the patient budget down to batches
+    cohorts = [Cls.Cohort(id=0, pop_size=10000, parameters=P.Parameters(therapy=P.Therapies.NONE), sampling='sobol')]
+    runner = SequentialRunner(cohorts=cohorts, targets=[PrecisionTarget(outcome='cost', half_width=0)],
+                              batch_size=1000)
+    runner.run(sim_length=D.SIM_LENGTH)
+    assert runner.batchSize == 1024 and runner.nPatients == 9216 and runner.stopReason == 'patient budget'
+    print('A sobol run simulated {} batches of {} patients.'.format(runner.nBatches, runner.batchSize))
@@ -0,0 +1,411 @@
+import math
+import sys
+
+import numpy as np
+
+# deampy and scipy.stats are imported only when intervals are calculated or formatted
+# (importing deampy loads its plotting modules, which worker processes do not need)
+
+
+class _Statistics:
+    def __init__(self, name=None):
+        """ the part of deampy's statistics interface that is used to report streaming statistics
+        :param name: name of this statistics
+        """
+        self.name = name
+        self._n = 0
+        self._mean = 0
+        self._min = sys.float_info.max
+        self._max = -sys.float_info.max
+
+    def get_var(self):
+        return self.get_stdev() ** 2
+
+    def get_t_half_length(self, alpha):
+        """
+        :param alpha: significance level (between 0 and 1)
+        :return: half-length of 100(1-alpha)% t-confidence interval
+        """
+        from scipy.stats import t
+
+        if self._n > 1:
+            return t.ppf(1 - alpha / 2, self._n - 1) * self.get_stdev() / math.sqrt(self._n)
+        else:
+            return math.nan
+
+    def get_t_CI(self, alpha):
+        """
+        :param alpha: significance level (between 0 and 1)
+        :return: t-based confidence interval in the format of list [l, u]
+        """
+        mean = self.get_mean()
+        half_length = self.get_t_half_length(alpha)
+        return [mean - half_length, mean + half_length]
+
+    def get_interval(self, interval_type='c', alpha=0.05, multiplier=1):
+        """
+        :param interval_type: (string) 'c' for t-based confidence interval, 'p' for percentile interval,
+            and 'n' for no interval
+        :param alpha: significance level
+        :param multiplier: to multiply the interval by the provided value
+        :return: a list [l, u]
+        """
+
+        if interval_type == 'c':
+            interval = self.get_t_CI(alpha)
+        elif interval_type == 'p':
+            interval = self.get_PI(alpha)
+        elif interval_type == 'n' or interval_type is None:
+            return None
+        else:
+            raise ValueError('Invalid interval type.')
+
+        if multiplier > 0:
+            return [v * multiplier for v in interval]
+        else:
+            return [interval[1] * multiplier, interval[0] * multiplier]
+
+    def get_formatted_mean_and_interval(self, interval_type='c',
+                                        alpha=0.05, deci=None, sig_digits=None, form=None, multiplier=1):
+        """
+        :return: (string) estimate and interval formatted as in deampy
+        """
+        import deampy.format_functions as F
+
+        return F.format_estimate_interval(estimate=self.get_mean() * multiplier,
+                                          interval=self.get_interval(interval_type=interval_type,
+                                                                     alpha=alpha, multiplier=multiplier),
+                                          deci=deci,
+                                          sig_digits=sig_digits,
+                                          format=form)
+
+
+class OnlineStat(_Statistics):
+    def __init__(self, name=None, reservoir_size=0):
+        """ summary statistics that are updated as observations arrive without storing them
+        (mean and variance are updated with Chan et al.'s parallel algorithm so that
+        two OnlineStat objects can be merged)
+        :param name: name of this statistics
+        :param reservoir_size: number of observations to keep in a uniform random sample of all observations
+            (used to calculate percentiles and for plots; set to 0 to store no observations)
+        """
+
+        _Statistics.__init__(self, name)
+        self._total = 0
+        self._m2 = 0  # sum of squared deviations from the mean
+        self._reservoirSize = reservoir_size
+        self._reservoirKeys = np.empty(0)
+        self._reservoirValues = np.empty(0)
+
+    def record(self, values, keys=None):
+        """ records a set of observations
+        :param values: (number, list or numpy.array) observations
+        :param keys: (list or numpy.array) uniform random numbers in [0, 1) assigned to these observations
+            (only needed if reservoir_size > 0; observations with the smallest keys are kept in the reservoir)
+        """
+
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        if len(values) == 0:
+            return
+
+        mean = values.mean()
+        self._combine(n=len(values), mean=mean, m2=((values - mean) ** 2).sum(),
+                      total=values.sum(), minimum=values.min(), maximum=values.max())
+
+        if self._reservoirSize > 0:
+            if keys is None:
+                raise ValueError('keys should be provided when reservoir_size > 0.')
+            self._update_reservoir(keys=np.atleast_1d(keys), values=values)
+
+    def merge(self, other):
+        """ merges the observations recorded by another OnlineStat into this one
+        :param other: (OnlineStat) statistics to merge
+        """
+
+        if other._n == 0:
+            return
+
+        self._combine(n=other._n, mean=other._mean, m2=other._m2,
+                      total=other._total, minimum=other._min, maximum=other._max)
+
+        if self._reservoirSize > 0:
+            self._update_reservoir(keys=other._reservoirKeys, values=other._reservoirValues)
+
+    def get_n(self):
+        return self._n
+
+    def get_total(self):
+        return self._total
+
+    def get_mean(self):
+        return self._mean
+
+    def get_stdev(self):
+        if self._n > 1:
+            return math.sqrt(self._m2 / (self._n - 1))  # unbiased estimator of the standard deviation
+        else:
+            return math.nan
+
+    def get_min(self):
+        return self._min
+
+    def get_max(self):
+        return self._max
+
+    def get_var_of_mean(self):
+        """
+        :return: estimated variance of the sample mean
+        """
+        return self.get_stdev() ** 2 / self._n
+
+    def get_df(self):
+        """
+        :return: degrees of freedom of the estimated variance of the sample mean
+        """
+        return self._n - 1
+
+    def get_percentile(self, q):
+        """
+        :param q: percentile to compute (q in range [0, 100])
+        :returns: qth percentile (estimated from the reservoir sample) """
+
+        if len(self._reservoirValues) == 0:
+            raise ValueError('Percentiles of ' + str(self.name) + ' need reservoir_size > 0.')
+        return float(np.percentile(self._reservoirValues, q))
+
+    def get_PI(self, alpha=0.05):
+        """
+        :param alpha: significance level (between 0 and 1)
+        :return: percentile interval in the format of list [l, u]
+        """
+        return [self.get_percentile(100 * alpha / 2), self.get_percentile(100 * (1 - alpha / 2))]
+
+    def get_reservoir_sample(self):
+        """
+        :return: (numpy.array) uniform random sample of observations
+        """
+        return self._reservoirValues
+
+    def get_state(self):
+        """
+        :return: (dictionary) numpy.arrays that fully describe this statistics (used for checkpoints)
+        """
+        return {'moments': np.array([self._n, self._mean, self._m2, self._total, self._min, self._max]),
+                'reservoir_keys': self._reservoirKeys,
+                'reservoir_values': self._reservoirValues}
+
+    def set_state(self, state):
+        """
+        :param state: (dictionary) returned by get_state
+        """
+
+        n, self._mean, self._m2, self._total, self._min, self._max = state['moments'].tolist()
+        self._n = int(n)
+        self._reservoirKeys = state['reservoir_keys']
+        self._reservoirValues = state['reservoir_values']
+
+    def _combine(self, n, mean, m2, total, minimum, maximum):
+
+        n_total = self._n + n
+        delta = mean - self._mean
+        self._mean += delta * n / n_total
+        self._m2 += m2 + delta ** 2 * self._n * n / n_total
+        self._n = n_total
+        self._total += total
+        self._min = min(self._min, float(minimum))
+        self._max = max(self._max, float(maximum))
+
+    def _update_reservoir(self, keys, values):
+
+        keys = np.concatenate((self._reservoirKeys, keys))
+        values = np.concatenate((self._reservoirValues, values))
+        if len(keys) > self._reservoirSize:
+            # keep the observations with the smallest keys
+            idx = np.argpartition(keys, self._reservoirSize)[:self._reservoirSize]
+            keys = keys[idx]
+            values = values[idx]
+        self._reservoirKeys = keys
+        self._reservoirValues = values
+
+
+class GroupedStat(_Statistics):
+    def __init__(self, name, data, groups, n_groups):
+        """ summary statistics of observations that are independent across groups but not within them
+        (e.g. outcomes of antithetic pairs of patients): the mean, standard deviation and percentiles describe
+        the observations, while the confidence interval of the mean is calculated from the totals of groups
+        (the cluster-robust variance of the mean with n_groups - 1 degrees of freedom)
+        :param name: name of this statistics
+        :param data: (list or numpy.array) observations
+        :param groups: (numpy.array) index of the group of each observation (between 0 and n_groups - 1)
+        :param n_groups: number of groups (including groups with no observations,
+            e.g. groups of patients of whom none died)
+        """
+
+        _Statistics.__init__(self, name)
+        self._data = np.asarray(data, dtype=float)
+        self._n = len(self._data)
+        self._nGroups = n_groups
+        self._varOfMean = math.nan
+        if self._n > 0:
+            self._mean = self._data.mean()
+            self._min = self._data.min()
+            self._max = self._data.max()
+
+            # deviation of the total of each group from its expected value under the overall mean
+            residuals = (np.bincount(groups, weights=self._data, minlength=n_groups)
+                         - np.bincount(groups, minlength=n_groups) * self._mean)
+            if n_groups > 1:
+                self._varOfMean = n_groups / (n_groups - 1) * (residuals ** 2).sum() / self._n ** 2
+
+    def get_n(self):
+        return self._n
+
+    def get_mean(self):
+        return self._mean
+
+    def get_stdev(self):
+        return float(np.std(self._data, ddof=1)) if self._n > 1 else math.nan
+
+    def get_min(self):
+        return self._min
+
+    def get_max(self):
+        return self._max
+
+    def get_var_of_mean(self):
+        """
+        :return: estimated variance of the sample mean (from the totals of groups)
+        """
+        return self._varOfMean
+
+    def get_df(self):
+        """
+        :return: degrees of freedom of the estimated variance of the sample mean
+        """
+        return self._nGroups - 1
+
+    def get_t_half_length(self, alpha):
+        """
+        :param alpha: significance level (between 0 and 1)
+        :return: half-length of 100(1-alpha)% t-confidence interval
+        """
+        from scipy.stats import t
+
+        if self._n > 1 and self._nGroups > 1:
+            return t.ppf(1 - alpha / 2, self.get_df()) * math.sqrt(self._varOfMean)
+        else:
+            return math.nan
+
+    def get_percentile(self, q):
+        """
+        :param q: percentile to compute (q in range [0, 100])
+        :returns: qth percentile of observations """
+        return float(np.percentile(self._data, q))
+
+    def get_PI(self, alpha=0.05):
+        """
+        :param alpha: significance level (between 0 and 1)
+        :return: percentile interval in the format of list [l, u]
+        """
+        return [self.get_percentile(100 * alpha / 2), self.get_percentile(100 * (1 - alpha / 2))]
+
+
+class OnlineDifferenceStatIndp(_Statistics):
+    def __init__(self, x, y_ref, name=None):
+        """ statistics of x - y_ref for independent samples summarized by OnlineStat
+        (or GroupedStat) objects
+        :param x: (OnlineStat or GroupedStat) first set of observations
+        :param y_ref: (OnlineStat or GroupedStat) second set of observations
+        """
+
+        _Statistics.__init__(self, name)
+        self._x = x
+        self._y_ref = y_ref
+        self._n = min(x.get_n(), y_ref.get_n())
+
+    def get_mean(self):
+        """
+        for independent variable x and y, E(x-y) = E(x) - E(y)
+        """
+        return self._x.get_mean() - self._y_ref.get_mean()
+
+    def get_stdev(self):
+        """
+        for independent variable x and y, var(x-y) = var_x + var_y
+        """
+        return math.sqrt(self._x.get_stdev() ** 2 + self._y_ref.get_stdev() ** 2)
+
+    def get_t_half_length(self, alpha):
+        """
+        :param alpha: significance level (between 0 and 1)
+        :return: half-length of Welch's t-interval for x_bar - y_bar
+        """
+        from scipy.stats import t
+
+        var_x = self._x.get_var_of_mean()
+        var_y = self._y_ref.get_var_of_mean()
+        df = (var_x + var_y) ** 2 / (var_x ** 2 / self._x.get_df() + var_y ** 2 / self._y_ref.get_df())
+
+        return t.ppf(1 - alpha / 2, df) * math.sqrt(var_x + var_y)
+
+    def get_min(self):
+        return self._x.get_min() - self._y_ref.get_max()
+
+    def get_max(self):
+        return self._x.get_max() - self._y_ref.get_min()
+
+
+class BinnedCounts:
+    def __init__(self, bin_width):
+        """ counts of observations in bins [0, w), [w, 2w), ... that can be merged with other counts
+        :param bin_width: width of bins
+        """
+
+        self.binWidth = bin_width
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def record(self, values):
+        """
+        :param values: (number, list or numpy.array) non-negative observations
+        """
+
+        new_counts = np.bincount(
+            (np.atleast_1d(np.asarray(values, dtype=float)) / self.binWidth).astype(np.int64))
+        self._add(new_counts)
+
+    def merge(self, other):
+        """
+        :param other: (BinnedCounts) counts with the same bin width
+        """
+
+        if other.binWidth != self.binWidth:
+            raise ValueError('Only counts with the same bin width can be merged.')
+        self._add(other.counts)
+
+    def get_state(self):
+        """
+        :return: (dictionary) numpy.arrays that fully describe these counts (used for checkpoints)
+        """
+        return {'bin_width': np.array(self.binWidth), 'counts': self.counts}
+
+    def set_state(self, state):
+        """
+        :param state: (dictionary) returned by get_state
+        """
+        self.binWidth = float(state['bin_width'])
+        self.counts = state['counts']
+
+    def get_bin_edges(self):
+        """
+        :return: (numpy.array) lower edges of bins
+        """
+        return np.arange(len(self.counts)) * self.binWidth
+
+    def _add(self, counts):
+
+        if len(counts) > len(self.counts):
+            counts = counts.copy()
+            counts[:len(self.counts)] += self.counts
+            self.counts = counts
+        else:
+            self.counts[:len(counts)] += counts
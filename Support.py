@@ -1,9 +1,13 @@
-import deampy.econ_eval as econ
-import deampy.plots.histogram as hist
-import deampy.plots.sample_paths as path
-import deampy.statistics as stats
+import numpy as np
 
+import CEAClasses as CEA
 import InputData as D
+from InputData import HealthStates
+from Profiling import save_profiles
+from StreamingStatistics import GroupedStat, OnlineDifferenceStatIndp, OnlineStat
+from TraceClasses import EventTrace
+
+# deampy is imported in the functions that use it because importing it loads its plotting modules
 
 
 def print_outcomes(sim_outcomes, therapy_name):
@@ -49,11 +53,34 @@ def print_outcomes(sim_outcomes, therapy_name):
     print("")
 
 
+def print_trace_outcomes(trace_dir, therapy_name):
+    """ prints outcomes of patients that are calculated from the trace of their transitions
+    :param trace_dir: directory of the trace of a simulated cohort
+    :param therapy_name: the name of the selected therapy
+    """
+
+    trace = EventTrace(trace_dir=trace_dir)
+    times_to_first_stroke = trace.get_time_to_first_entry(
+        states=[HealthStates.STROKE.value, HealthStates.STROKE_DEAD.value])
+    times_in_post_stroke = trace.get_time_in_states(states=HealthStates.POST_STROKE.value)
+    if_stroke = ~np.isnan(times_to_first_stroke)
+
+    print(therapy_name, '(from the trace of {:,} transitions)'.format(trace.nEvents))
+    print('  Proportion of patients with a stroke: {:.3f}'.format(if_stroke.mean()))
+    if if_stroke.any():
+        print('  Mean time to first stroke among patients with a stroke: {:.2f}'.format(
+            times_to_first_stroke[if_stroke].mean()))
+    print('  Mean time in post-stroke: {:.2f}'.format(times_in_post_stroke.mean()))
+    print('')
+
+
 def plot_survival_curves_and_histograms(sim_outcomes_mono, sim_outcomes_combo):
     """ draws the survival curves and the histograms of time until HIV deaths
     :param sim_outcomes_mono: outcomes of a cohort simulated under mono therapy
     :param sim_outcomes_combo: outcomes of a cohort simulated under combination therapy
     """
+    import deampy.plots.histogram as hist
+    import deampy.plots.sample_paths as path
 
     # get survival curves of both treatments
     survival_curves = [
@@ -90,18 +117,22 @@ def plot_survival_curves_and_histograms(sim_outcomes_mono, sim_outcomes_combo):
     )
 
 
-def print_comparative_outcomes(sim_outcomes_none, sim_outcomes_anti):
+def print_comparative_outcomes(sim_outcomes_none, sim_outcomes_anti, if_paired=False):
     """ prints average increase in survival time, discounted cost, and discounted utility
     under combination therapy compared to mono therapy
     :param sim_outcomes_none: outcomes of a cohort simulated under no anticoagulation
     :param sim_outcomes_anti: outcomes of a cohort simulated under anticoagulation
+    :param if_paired: set to True if patient i of both cohorts was simulated with common random numbers
     """
 
     # increase in mean survival time under combination therapy with respect to mono therapy
-    increase_survival_time = stats.DifferenceStatIndp(
+    # (survival times are only recorded for patients who die, so they cannot be paired)
+    increase_survival_time = get_difference_stat(
         name='Increase in mean survival time',
-        x=sim_outcomes_anti.survivalTimes,
-        y_ref=sim_outcomes_none.survivalTimes)
+        sim_outcomes=sim_outcomes_anti,
+        sim_outcomes_ref=sim_outcomes_none,
+        obs_attribute='survivalTimes',
+        stat_attribute='statSurvivalTime')
 
     # estimate and CI
     estimate_CI = increase_survival_time.get_formatted_mean_and_interval(interval_type='c',
@@ -112,10 +143,13 @@ def print_comparative_outcomes(sim_outcomes_none, sim_outcomes_anti):
           estimate_CI)
 
     # increase in mean discounted cost under combination therapy with respect to mono therapy
-    increase_discounted_cost = stats.DifferenceStatIndp(
+    increase_discounted_cost = get_difference_stat(
         name='Increase in mean discounted cost',
-        x=sim_outcomes_anti.costs,
-        y_ref=sim_outcomes_none.costs)
+        sim_outcomes=sim_outcomes_anti,
+        sim_outcomes_ref=sim_outcomes_none,
+        obs_attribute='costs',
+        stat_attribute='statCost',
+        if_paired=if_paired)
 
     # estimate and CI
     estimate_CI = increase_discounted_cost.get_formatted_mean_and_interval(interval_type='c',
@@ -127,10 +161,13 @@ def print_comparative_outcomes(sim_outcomes_none, sim_outcomes_anti):
           estimate_CI)
 
     # increase in mean discounted utility under combination therapy with respect to mono therapy
-    increase_discounted_utility = stats.DifferenceStatIndp(
+    increase_discounted_utility = get_difference_stat(
         name='Increase in mean discounted utility',
-        x=sim_outcomes_anti.utilities,
-        y_ref=sim_outcomes_none.utilities)
+        sim_outcomes=sim_outcomes_anti,
+        sim_outcomes_ref=sim_outcomes_none,
+        obs_attribute='utilities',
+        stat_attribute='statUtility',
+        if_paired=if_paired)
 
     # estimate and CI
     estimate_CI = increase_discounted_utility.get_formatted_mean_and_interval(interval_type='c',
@@ -141,10 +178,13 @@ def print_comparative_outcomes(sim_outcomes_none, sim_outcomes_anti):
           estimate_CI)
 
     # increase in mean discounted utility under combination therapy with respect to mono therapy
-    increase_num_strokes = stats.DifferenceStatIndp(
+    increase_num_strokes = get_difference_stat(
         name='Increase in mean discounted utility',
-        x=sim_outcomes_anti.nTotalStrokes,
-        y_ref=sim_outcomes_none.nTotalStrokes)
+        sim_outcomes=sim_outcomes_anti,
+        sim_outcomes_ref=sim_outcomes_none,
+        obs_attribute='nTotalStrokes',
+        stat_attribute='statNumStrokes',
+        if_paired=if_paired)
 
     # estimate and CI
     estimate_CI = increase_num_strokes.get_formatted_mean_and_interval(interval_type='c',
@@ -155,44 +195,89 @@ def print_comparative_outcomes(sim_outcomes_none, sim_outcomes_anti):
           estimate_CI)
 
 
-def report_CEA_CBA(sim_outcomes_none, sim_outcomes_anti):
-    """ performs cost-effectiveness and cost-benefit analyses
-    :param sim_outcomes_mono: outcomes of a cohort simulated under mono therapy
-    :param sim_outcomes_combo: outcomes of a cohort simulated under combination therapy
+def get_difference_stat(name, sim_outcomes, sim_outcomes_ref, obs_attribute, stat_attribute, if_paired=False):
+    """ returns the statistics of the difference in an outcome between two simulated cohorts
+    :param name: name of the statistics
+    :param sim_outcomes: outcomes of the first cohort
+    :param sim_outcomes_ref: outcomes of the reference cohort
+    :param obs_attribute: name of the attribute storing patient observations (e.g. 'costs')
+    :param stat_attribute: name of the attribute storing the summary statistics (e.g. 'statCost')
+    :param if_paired: set to True if observation i of both cohorts belongs to patient i
+        simulated with common random numbers
+    :return: DifferenceStatPaired, DifferenceStatIndp or, if the outcomes are streaming or of groups of patients
+        (see GroupedStat), OnlineDifferenceStatIndp or GroupedStat
+    """
+    import deampy.statistics as stats
+
+    stat = getattr(sim_outcomes, stat_attribute)
+    stat_ref = getattr(sim_outcomes_ref, stat_attribute)
+    if isinstance(stat, OnlineStat) and isinstance(stat_ref, OnlineStat):
+        if if_paired:
+            raise ValueError('Paired differences need the outcomes of every patient '
+                             '(simulate cohorts with if_streaming=False).')
+        return OnlineDifferenceStatIndp(name=name, x=stat, y_ref=stat_ref)
+    elif isinstance(stat, GroupedStat) or isinstance(stat_ref, GroupedStat):
+        if not if_paired:
+            return OnlineDifferenceStatIndp(name=name, x=stat, y_ref=stat_ref)
+        if sim_outcomes.groupSize != sim_outcomes_ref.groupSize:
+            raise ValueError('Paired outcomes should be simulated with the same sampling scheme.')
+        # differences of patients are independent across groups of patients
+        differences = np.subtract(getattr(sim_outcomes, obs_attribute), getattr(sim_outcomes_ref, obs_attribute))
+        return GroupedStat(name=name, data=differences,
+                           groups=np.arange(len(differences)) // sim_outcomes.groupSize,
+                           n_groups=-(-len(differences) // sim_outcomes.groupSize))
+    elif if_paired:
+        return stats.DifferenceStatPaired(name=name,
+                                          x=getattr(sim_outcomes, obs_attribute),
+                                          y_ref=getattr(sim_outcomes_ref, obs_attribute))
+    else:
+        return stats.DifferenceStatIndp(name=name,
+                                        x=getattr(sim_outcomes, obs_attribute),
+                                        y_ref=getattr(sim_outcomes_ref, obs_attribute))
+
+
+def report_CEA_CBA(sim_outcomes_none, sim_outcomes_anti, if_paired=False):
+    """ performs cost-effectiveness and cost-benefit analyses on the arrays of patient outcomes
+    :param sim_outcomes_none: outcomes of a cohort simulated under no anticoagulation
+    :param sim_outcomes_anti: outcomes of a cohort simulated under anticoagulation
+    :param if_paired: set to True if patient i of both cohorts was simulated with common random numbers
     """
 
     # define two strategies
-    no_therapy_strategy = econ.Strategy(
+    no_therapy_strategy = CEA.Strategy(
         name='No Anticoagulation ',
-        cost_obs=sim_outcomes_none.costs,
-        effect_obs=sim_outcomes_none.utilities,
-        color='green'
+        costs=sim_outcomes_none.costs,
+        effects=sim_outcomes_none.utilities,
+        color='green',
+        group_size=getattr(sim_outcomes_none, 'groupSize', 1)
     )
-    anti_therapy_strategy = econ.Strategy(
+    anti_therapy_strategy = CEA.Strategy(
         name='With Anticoagulation',
-        cost_obs=sim_outcomes_anti.costs,
-        effect_obs=sim_outcomes_anti.utilities,
-        color='blue'
+        costs=sim_outcomes_anti.costs,
+        effects=sim_outcomes_anti.utilities,
+        color='blue',
+        group_size=getattr(sim_outcomes_anti, 'groupSize', 1)
     )
 
     # do CEA
-    CEA = econ.CEA(
+    cea = CEA.CEA(
         strategies=[no_therapy_strategy, anti_therapy_strategy],
-        if_paired=False
+        if_paired=if_paired
     )
 
     # plot cost-effectiveness figure
-    CEA.plot_CE_plane(
+    cea.plot_CE_plane(
         title='Cost-Effectiveness Analysis',
         x_label='Additional QALYs',
         y_label='Additional Cost',
         interval_type='c',
+        alpha=D.ALPHA,
         x_range=(-0.5, 1),
         y_range=(-1000, 10000)
     )
 
     # report the CE table
-    CEA.build_CE_table(
+    cea.build_CE_table(
         interval_type='c',
         alpha=D.ALPHA,
         cost_digits=0,
@@ -201,20 +286,158 @@ def report_CEA_CBA(sim_outcomes_none, sim_outcomes_anti):
         file_name='CETable.csv')
 
     # CBA
-    NBA = econ.CBA(
+    cba = CEA.CBA(
         strategies=[no_therapy_strategy, anti_therapy_strategy],
         wtp_range=[0, 50000],
-        if_paired=False
+        if_paired=if_paired
     )
     # show the net monetary benefit figure
-    NBA.plot_marginal_nmb_lines(
+    cba.plot_marginal_nmb_lines(
         title='Cost-Benefit Analysis',
         x_label='Willingness-to-pay per QALY ($)',
         y_label='Marginal Net Monetary Benefit ($)',
         interval_type='c',
+        alpha=D.ALPHA,
         show_legend=True,
         figure_size=(6, 5),
         y_range=(-30000, 40000)
     )
 
 
+def report_PSA_CEA_CBA(psa_results):
+    """ performs cost-effectiveness and cost-benefit analyses on the results of
+    a probabilistic sensitivity analysis
+    :param psa_results: (PSAResults) mean cost and effect of each therapy for each parameter draw
+    """
+    import deampy.econ_eval as econ
+
+    # define two strategies (one observation per parameter draw)
+    no_therapy_strategy = econ.Strategy(
+        name='No Anticoagulation ',
+        cost_obs=psa_results.costs[:, 0],
+        effect_obs=psa_results.effects[:, 0],
+        color='green'
+    )
+    anti_therapy_strategy = econ.Strategy(
+        name='With Anticoagulation',
+        cost_obs=psa_results.costs[:, 1],
+        effect_obs=psa_results.effects[:, 1],
+        color='blue'
+    )
+
+    # do CEA (draws are paired since both therapies are evaluated under the same parameter values)
+    CEA = econ.CEA(
+        strategies=[no_therapy_strategy, anti_therapy_strategy],
+        if_paired=True
+    )
+
+    # report the CE table
+    CEA.build_CE_table(
+        interval_type='p',
+        alpha=D.ALPHA,
+        cost_digits=0,
+        effect_digits=2,
+        icer_digits=2,
+        file_name='PSACETable.csv')
+
+    # CBA
+    NBA = econ.CBA(
+        strategies=[no_therapy_strategy, anti_therapy_strategy],
+        wtp_range=[0, 50000],
+        if_paired=True
+    )
+    # show the cost-effectiveness acceptability curves
+    NBA.plot_acceptability_curves(
+        title='Cost-Effectiveness Acceptability Curves',
+        x_label='Willingness-to-pay per QALY ($)',
+        y_label='Probability of Being the Optimal Strategy',
+        show_legend=True
+    )
+
+
+def report_VOI(psa_results, wtp_values=(0, 10000, 20000, 30000, 40000, 50000)):
+    """ prints and plots the expected value of perfect information and of partial perfect information
+    about the groups of inputs in InputData.VOI_GROUPS
+    :param psa_results: (PSAResults) mean cost and effect of each therapy for each parameter draw
+    :param wtp_values: willingness-to-pay values to print the expected values of information at
+    """
+    from VOIClasses import ValueOfInformation
+
+    voi = ValueOfInformation.from_psa_results(psa_results=psa_results, wtp_range=[0, 50000])
+    evpi = voi.get_evpi()
+    evppis = voi.get_evppi_of_groups(groups=D.VOI_GROUPS)
+
+    # print the expected values at the willingness-to-pay values closest to the requested ones
+    print('Expected value of information per patient ($):')
+    print('  {:>20}'.format('WTP') + ''.join('{:>10,.0f}'.format(wtp) for wtp in wtp_values))
+    indices = [np.abs(voi.wtpValues - wtp).argmin() for wtp in wtp_values]
+    for name, values in [('EVPI', evpi)] + list(evppis.items()):
+        print('  {:>20}'.format(name) + ''.join('{:>10,.1f}'.format(values[i]) for i in indices))
+    print('')
+
+    voi.plot_curves(evppis=evppis)
+
+
+def print_calibration(runner):
+    """ prints the parameter sets accepted by a calibration
+    :param runner: (CalibrationRunner) a calibration that is completed
+    """
+
+    print('Evaluated {:,} candidates in {} rounds ({} evaluator{}); {} parameter sets are accepted.'.format(
+        len(runner.scores), runner.nRoundsRun, runner.evaluator,
+        ', {} confirmed by simulation'.format(runner.nConfirmed) if runner.ifConfirm else '',
+        len(runner.acceptedSets)))
+    for target in runner.targets:
+        print('  Target {}: {:g} +/- {:g}'.format(target.get_name(), target.value, target.tolerance))
+
+    for k, accepted_set in enumerate(runner.acceptedSets):
+        print('  Set {} (score {:.2f})'.format(k + 1, accepted_set['score']))
+        print('    ' + ', '.join('{} = {:.4g}'.format(label, value)
+                                 for label, value in accepted_set['inputs'].items()))
+        print('    ' + ', '.join('{} = {:.4g}'.format(name, value)
+                                 for name, value in accepted_set['outcomes'].items()))
+    print('')
+
+
+def print_subgroup_outcomes(cohort, keys, therapy_name):
+    """ prints the outcomes of each subgroup of a simulated heterogeneous cohort
+    :param cohort: (HeterogeneousCohort) a simulated cohort
+    :param keys: (list) value of each covariate of each subgroup (see PopulationClasses.get_subgroups)
+    :param therapy_name: the name of the selected therapy
+    """
+
+    print(therapy_name, '(outcomes of {:,} patients in {} subgroups)'.format(cohort.popSize, len(keys)))
+    print('  {:<40}{:>10}{:>10}{:>18}{:>20}'.format(
+        'Subgroup', 'Patients', 'Strokes', 'Discounted cost', 'Discounted utility'))
+    for key, size, outcomes in zip(keys, cohort.subgroupSizes, cohort.subgroupOutcomes):
+        if size > 0:
+            print('  {:<40}{:>10,}{:>10.3f}{:>18,.0f}{:>20.3f}'.format(
+                ', '.join('{}={}'.format(name, value) for name, value in key.items()), size,
+                outcomes.statNumStrokes.get_mean(), outcomes.statCost.get_mean(), outcomes.statUtility.get_mean()))
+    print('')
+
+
+def print_sequential_run(runner):
+    """ prints the number of patients simulated by a sequential run and the precision of the targeted outcomes
+    :param runner: (SequentialRunner) a sequential run that is completed
+    """
+
+    print('Simulated {:,} patients per cohort in {} batches ({:.1f} seconds); stopped because of {}.'.format(
+        runner.nPatients, runner.nBatches, runner.seconds, runner.stopReason))
+    for target in runner.targets:
+        print('  {}: {:,.2f} with {:.{prec}%} confidence interval half-width {:,.4g} (target {:,.4g})'.format(
+            target.get_name(), target.stat.get_mean(), 1 - runner.alpha, target.get_half_width(runner.alpha),
+            target.halfWidth, prec=0))
+    print('')
+
+
+def report_profiles(profilers, file_name='Profile.json'):
+    """ prints a summary of each profile and saves all profiles as JSON
+    :param profilers: (list) of Profiler objects
+    :param file_name: name of the JSON file
+    """
+
+    for profiler in profilers:
+        print(profiler.get_summary())
+        print('')
+    save_profiles(profilers=profilers, file_name=file_name)
@@ -0,0 +1,72 @@
+import numpy as np
+from deampy.sample_path import PrevalenceSamplePath
+from scipy.stats import norm
+
+from StreamingStatistics import BinnedCounts
+
+
+class SurvivalCurve(PrevalenceSamplePath):
+    def __init__(self, name, initial_size, time_step=0.1, survival_times=None, death_counts=None):
+        """ number of living patients over time built from death times binned on a grid
+        (deaths are recorded at the upper edge of the bin they occurred in, so the curve has at most
+        one step per bin; it can be passed to the sample path plotting functions of deampy)
+        :param name: name of this survival curve
+        :param initial_size: number of patients at time 0
+        :param time_step: width of the bins of the time grid
+        :param survival_times: (list or numpy.array) death times of patients who died
+        :param death_counts: (BinnedCounts) number of deaths in each bin (instead of survival_times)
+        """
+
+        PrevalenceSamplePath.__init__(self, name=name, initial_size=initial_size, collect_stat=False)
+
+        if death_counts is None:
+            self.deathCounts = BinnedCounts(bin_width=time_step)
+        else:
+            self.deathCounts = BinnedCounts(bin_width=death_counts.binWidth)
+            self.deathCounts.merge(death_counts)
+        if survival_times is not None and len(survival_times) > 0:
+            self.deathCounts.record(values=survival_times)
+
+        self.initialSize = initial_size
+        self._build()
+
+    def merge(self, other):
+        """ merges the survival curve of another shard of patients into this one
+        :param other: (SurvivalCurve) survival curve with the same time step
+        """
+
+        self.initialSize += other.initialSize
+        self.deathCounts.merge(other.deathCounts)
+        self._build()
+
+    def get_survival_probabilities(self):
+        """
+        :return: (numpy.array) probability of being alive at the times returned by get_times()
+        """
+        return np.asarray(self._values) / self.initialSize
+
+    def get_confidence_bands(self, alpha=0.05):
+        """ pointwise confidence bands of the number of living patients using Greenwood's variance
+        of the Kaplan-Meier estimator (which reduces to S(1-S)/N since patients are only censored
+        at the end of the simulation)
+        :param alpha: significance level (between 0 and 1)
+        :return: (lower, upper) numpy.arrays of the number of living patients at the times returned by get_times()
+        """
+
+        survival = self.get_survival_probabilities()
+        half_length = norm.ppf(1 - alpha / 2) * np.sqrt(survival * (1 - survival) / self.initialSize)
+
+        lower = np.clip(survival - half_length, 0, 1) * self.initialSize
+        upper = np.clip(survival + half_length, 0, 1) * self.initialSize
+        return lower, upper
+
+    def _build(self):
+        """ populates the times and values of the step curve from the binned deaths """
+
+        counts = self.deathCounts.counts
+        if_nonzero = counts > 0
+        times = self.deathCounts.get_bin_edges()[if_nonzero] + self.deathCounts.binWidth
+
+        self.currentSize = self.initialSize - counts.sum()
+        self._times = [0] + times.tolist()
+        self._values = (self.initialSize - np.concatenate(([0], np.cumsum(counts[if_nonzero])))).tolist()
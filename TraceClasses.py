@@ -0,0 +1,293 @@
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+
+# columns of an event trace and their types (one row per transition, including the end of the simulation,
+# which is recorded as a transition from the current state to itself at the simulation length)
+TRACE_COLUMNS = {'patient_id': np.int64, 'time': np.float64, 'from_state': np.int8, 'to_state': np.int8}
+WRITE_BUFFER_SIZE = 1000000     # number of events buffered in memory before they are appended to the files
+READ_CHUNK_SIZE = 10000000      # number of events read into memory at a time by queries
+
+
+class TraceWriter:
+    def __init__(self, directory, id_offset, first_index, last_index, buffer_size=WRITE_BUFFER_SIZE):
+        """ appends the transitions of patients first_index, ..., last_index - 1 of a cohort to
+        one binary file per column in 'directory' (a part of the trace of the cohort)
+        :param directory: directory of this part of the trace (created or overwritten)
+        :param id_offset: id of patient 0 of the cohort (patient n has id id_offset + n)
+        :param first_index: index of the first patient of this part
+        :param last_index: index of the patient after the last patient of this part
+        :param buffer_size: number of events buffered in memory before they are appended to the files
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.idOffset = id_offset
+        self.firstIndex = first_index
+        self.lastIndex = last_index
+        self.nEvents = 0    # number of events appended to the files
+
+        self._files = {name: open(os.path.join(directory, name + '.bin'), 'wb') for name in TRACE_COLUMNS}
+        self._buffers = {name: np.empty(buffer_size, dtype=dtype) for name, dtype in TRACE_COLUMNS.items()}
+        self._nBuffered = 0
+
+    def record_event(self, patient_id, time, from_state, to_state):
+        """ records the transition of a patient """
+
+        i = self._nBuffered
+        self._buffers['patient_id'][i] = patient_id
+        self._buffers['time'][i] = time
+        self._buffers['from_state'][i] = from_state
+        self._buffers['to_state'][i] = to_state
+        self._nBuffered += 1
+        if self._nBuffered == len(self._buffers['time']):
+            self.flush()
+
+    def record_events(self, patient_ids, times, from_states, to_states):
+        """ records the transitions of several patients
+        (the events of a patient should be recorded in the order of time)
+        """
+
+        self.flush()
+        self._append(patient_id=patient_ids, time=times, from_state=from_states, to_state=to_states)
+
+    def flush(self):
+        """ appends the buffered events to the files """
+
+        if self._nBuffered > 0:
+            n = self._nBuffered
+            self._nBuffered = 0
+            self._append(**{name: buffer[:n] for name, buffer in self._buffers.items()})
+
+    def close(self):
+        """ appends the buffered events to the files and saves the description of this part of the trace """
+
+        self.flush()
+        for file in self._files.values():
+            file.close()
+        with open(os.path.join(self.directory, 'metadata.json'), 'w') as file:
+            json.dump({'id_offset': self.idOffset, 'first_index': self.firstIndex, 'last_index': self.lastIndex,
+                       'n_events': self.nEvents}, file)
+
+    def _append(self, **columns):
+
+        for name, dtype in TRACE_COLUMNS.items():
+            np.asarray(columns[name], dtype=dtype).tofile(self._files[name])
+        self.nEvents += len(columns['time'])
+
+
+def get_part_directory(trace_dir, first_index, last_index):
+    """
+    :return: directory of the part of a trace that holds patients first_index, ..., last_index - 1
+    """
+    return os.path.join(trace_dir, 'part_{}_{}'.format(first_index, last_index))
+
+
+def remove_trace(trace_dir):
+    """ removes the parts of a trace saved in trace_dir by an earlier simulation (other files are kept) """
+
+    for directory in glob.glob(os.path.join(trace_dir, 'part_*_*')):
+        shutil.rmtree(directory)
+
+
+class EventTrace:
+    def __init__(self, trace_dir, chunk_size=READ_CHUNK_SIZE):
+        """ transitions of the patients of a simulated cohort, memory-mapped from the files in trace_dir
+        (queries read chunk_size events at a time, so the trace does not need to fit in memory)
+        :param trace_dir: directory that the cohort wrote its trace in (see Cohort's trace_dir)
+        :param chunk_size: number of events read into memory at a time
+        """
+
+        self.chunkSize = chunk_size
+        self.parts = []     # (first_index, last_index, columns) of each part in the order of patients
+        id_offsets = set()
+        for directory in glob.glob(os.path.join(trace_dir, 'part_*_*')):
+            with open(os.path.join(directory, 'metadata.json')) as file:
+                metadata = json.load(file)
+            columns = {name: np.memmap(os.path.join(directory, name + '.bin'), dtype=dtype, mode='r',
+                                       shape=(metadata['n_events'],)) if metadata['n_events'] > 0
+                       else np.empty(0, dtype=dtype)
+                       for name, dtype in TRACE_COLUMNS.items()}
+            self.parts.append((metadata['first_index'], metadata['last_index'], columns))
+            id_offsets.add(metadata['id_offset'])
+
+        if len(self.parts) == 0:
+            raise ValueError('There is no trace in {}.'.format(trace_dir))
+        if len(id_offsets) > 1:
+            raise ValueError('The parts of the trace in {} belong to different cohorts.'.format(trace_dir))
+        self.parts.sort(key=lambda part: part[0])
+        for (_, last_index, _), (first_index, _, _) in zip(self.parts[:-1], self.parts[1:]):
+            if first_index < last_index:
+                raise ValueError('The parts of the trace in {} overlap.'.format(trace_dir))
+
+        self.idOffset = id_offsets.pop()
+        self.nPatients = self.parts[-1][1]  # patients are indexed from 0 to nPatients - 1
+        self.nEvents = sum(len(columns['time']) for _, _, columns in self.parts)
+
+    def get_chunks(self):
+        """
+        :return: (generator) dictionaries of columns of consecutive chunks of events (loaded into memory),
+            where 'patient_index' (the index of the patient in the cohort) replaces 'patient_id'
+        """
+
+        for _, _, columns in self.parts:
+            for start in range(0, len(columns['time']), self.chunkSize):
+                chunk = {name: np.asarray(column[start:start + self.chunkSize]) for name, column in columns.items()}
+                chunk['patient_index'] = chunk.pop('patient_id') - self.idOffset
+                yield chunk
+
+    def get_intervals(self):
+        """
+        :return: (generator) chunks of the intervals between consecutive events of patients as dictionaries of
+            'patient_index', 'state' (the state during the interval), 'next_state', 't_start' and 't_end',
+            sorted by patient (intervals of a patient are in the order of time)
+        """
+
+        # time of the last event of each patient read so far (patients start at time 0)
+        last_times = np.zeros(self.nPatients)
+
+        for chunk in self.get_chunks():
+            # sort by patient (the stable sort keeps the events of a patient in the order of time)
+            order = np.argsort(chunk['patient_index'], kind='stable')
+            patient_indices = chunk['patient_index'][order]
+            t_ends = chunk['time'][order]
+
+            # an interval starts at the previous event of the patient, which is in this chunk unless
+            # the interval is the first of the patient in this chunk
+            if_first = np.ones(len(order), dtype=bool)
+            if_first[1:] = patient_indices[1:] != patient_indices[:-1]
+            t_starts = np.empty(len(order))
+            t_starts[1:] = t_ends[:-1]
+            t_starts[if_first] = last_times[patient_indices[if_first]]
+
+            # the last event of each patient in this chunk
+            if_last = np.ones(len(order), dtype=bool)
+            if_last[:-1] = if_first[1:]
+            last_times[patient_indices[if_last]] = t_ends[if_last]
+
+            yield {'patient_index': patient_indices,
+                   'state': chunk['from_state'][order],
+                   'next_state': chunk['to_state'][order],
+                   't_start': t_starts,
+                   't_end': t_ends}
+
+    def get_n_entries(self, states):
+        """
+        :param states: index of a state or a list of indices of states
+        :return: (numpy.array) number of times each patient entered these states
+        """
+
+        n_entries = np.zeros(self.nPatients, dtype=int)
+        for chunk in self.get_chunks():
+            if_entry = np.isin(chunk['to_state'], states) & (chunk['from_state'] != chunk['to_state'])
+            n_entries += np.bincount(chunk['patient_index'][if_entry], minlength=self.nPatients)
+        return n_entries
+
+    def get_time_to_first_entry(self, states):
+        """
+        :param states: index of a state or a list of indices of states
+        :return: (numpy.array) time when each patient first entered these states (nan if they never did)
+        """
+
+        first_times = np.full(self.nPatients, np.nan)
+        for chunk in self.get_intervals():
+            if_entry = np.isin(chunk['next_state'], states) & (chunk['state'] != chunk['next_state'])
+            # the first entry of each patient in this chunk (intervals of a patient are in the order of time)
+            patient_indices, positions = np.unique(chunk['patient_index'][if_entry], return_index=True)
+            times = chunk['t_end'][if_entry][positions]
+            if_new = np.isnan(first_times[patient_indices])
+            first_times[patient_indices[if_new]] = times[if_new]
+        return first_times
+
+    def get_time_in_states(self, states, discount_rate=0):
+        """
+        :param states: index of a state or a list of indices of states
+        :param discount_rate: annual discount rate (continuously compounded)
+        :return: (numpy.array) (discounted) time each patient spent in these states
+        """
+
+        times = np.zeros(self.nPatients)
+        for chunk in self.get_intervals():
+            if_in_states = np.isin(chunk['state'], states)
+            t_starts = chunk['t_start'][if_in_states]
+            t_ends = chunk['t_end'][if_in_states]
+            if discount_rate == 0:
+                durations = t_ends - t_starts
+            else:
+                durations = (np.exp(-discount_rate * t_starts) - np.exp(-discount_rate * t_ends)) / discount_rate
+            times += np.bincount(chunk['patient_index'][if_in_states], weights=durations, minlength=self.nPatients)
+        return times
+
+    def get_patient_events(self, patient_index):
+        """
+        :param patient_index: index of a patient in the cohort
+        :return: (times, from_states, to_states) of the transitions of this patient
+        """
+
+        for first_index, last_index, columns in self.parts:
+            if first_index <= patient_index < last_index:
+                events = {name: [] for name in ('time', 'from_state', 'to_state')}
+                for start in range(0, len(columns['time']), self.chunkSize):
+                    if_patient = columns['patient_id'][start:start + self.chunkSize] == self.idOffset + patient_index
+                    for name in events:
+                        events[name].append(np.asarray(columns[name][start:start + self.chunkSize][if_patient]))
+                return tuple(np.concatenate(events[name]) if len(events[name]) > 0
+                             else np.empty(0, dtype=TRACE_COLUMNS[name])
+                             for name in ('time', 'from_state', 'to_state'))
+
+        raise ValueError('Patient {} is not in the trace.'.format(patient_index))
+
+
+if __name__ == '__main__':
+
+    # check that outcomes calculated from the trace agree with the outcomes recorded during the simulation
+    import tempfile
+
+    import InputData as D
+    import MarkovClasses as Cls
+    import ParameterClasses as P
+    from InputData import HealthStates
+
+    DEATH_STATES = [HealthStates.STROKE_DEAD.value, HealthStates.NATURAL_DEATH.value]
+    STROKE_STATES = [HealthStates.STROKE.value, HealthStates.STROKE_DEAD.value]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for engine in ('object', 'vectorized'):
+            for n_workers in (1, 2):
+                cohort = Cls.Cohort(id=1, pop_size=5000, parameters=P.Parameters(therapy=P.Therapies.ANTICOAG),
+                                    if_record_discounted_times=True, trace_dir=temp_dir)
+                cohort.simulate(sim_length=D.SIM_LENGTH, engine=engine, batch_size=1000, n_workers=n_workers)
+                outcomes = cohort.cohortOutcomes
+
+                # read the trace 3000 events at a time to check that intervals continue across chunks
+                trace = EventTrace(trace_dir=temp_dir, chunk_size=3000)
+                assert trace.nPatients == cohort.popSize and trace.nEvents == outcomes.nEvents
+
+                survival_times = trace.get_time_to_first_entry(states=DEATH_STATES)
+                assert np.allclose(survival_times[~np.isnan(survival_times)], outcomes.survivalTimes)
+                # (the simulation also counts a stroke when a patient in stroke reaches the end of the simulation)
+                n_censored_in_stroke = np.zeros(trace.nPatients, dtype=int)
+                for chunk in trace.get_chunks():
+                    if_censored_in_stroke = (chunk['from_state'] == HealthStates.STROKE.value) \
+                                            & (chunk['to_state'] == HealthStates.STROKE.value)
+                    n_censored_in_stroke += np.bincount(chunk['patient_index'][if_censored_in_stroke],
+                                                        minlength=trace.nPatients)
+                assert np.array_equal(trace.get_n_entries(states=STROKE_STATES) + n_censored_in_stroke,
+                                      outcomes.nTotalStrokes)
+                discounted_times = np.column_stack(
+                    [trace.get_time_in_states(states=state.value, discount_rate=cohort.params.discountRate)
+                     for state in HealthStates])
+                assert np.allclose(discounted_times, outcomes.discountedStateTimes)
+
+                # every patient is followed until death or the end of the simulation
+                alive_times = trace.get_time_in_states(
+                    states=[state.value for state in HealthStates if state.value not in DEATH_STATES])
+                assert np.allclose(np.where(np.isnan(survival_times), D.SIM_LENGTH, survival_times), alive_times)
+
+                times, from_states, to_states = trace.get_patient_events(patient_index=17)
+                assert np.all(np.diff(times) > 0) and np.array_equal(from_states[1:], to_states[:-1])
+
+    print('Outcomes calculated from the trace agree with the simulated outcomes.')
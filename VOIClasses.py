@@ -0,0 +1,255 @@
+import numpy as np
+
+from CEAClasses import N_WTP_VALUES
+
+N_KNOTS = {1: 8, 2: 6, 3: 4}    # number of spline knots per input of the tensor-product metamodel of 1, 2 or 3 inputs
+N_KNOTS_ADDITIVE = 6            # number of spline knots per input of the additive metamodel of more than 3 inputs
+N_NEIGHBOURS = 50               # number of draws averaged by the nearest-neighbour metamodel
+NEIGHBOUR_CHUNK_SIZE = 500      # number of draws whose nearest neighbours are found at a time
+
+
+class ValueOfInformation:
+    def __init__(self, input_labels, input_samples, costs, effects, wtp_range=(0, 50000), n_wtp_values=N_WTP_VALUES):
+        """ expected value of perfect and partial perfect information (per patient) from the results of
+        a probabilistic sensitivity analysis; the EVPPI of a group of inputs is estimated by regressing the
+        incremental cost and effect of each strategy on these inputs (a metamodel of their expected values
+        given the inputs), so no inner simulation is needed
+        :param input_labels: labels of sampled inputs (e.g. PSAResults.inputLabels)
+        :param input_samples: (numpy.array) sampled inputs with one row per draw
+        :param costs: (numpy.array) mean cost with one row per draw and one column per strategy
+        :param effects: (numpy.array) mean effect with one row per draw and one column per strategy
+        :param wtp_range: ([l, u]) range of willingness-to-pay values
+        :param n_wtp_values: number of willingness-to-pay values in this range
+        """
+
+        self.inputLabels = list(input_labels)
+        self.inputSamples = np.asarray(input_samples, dtype=float)
+        self.costs = np.asarray(costs, dtype=float)
+        self.effects = np.asarray(effects, dtype=float)
+        self.wtpValues = np.linspace(wtp_range[0], wtp_range[1], n_wtp_values)
+
+        if self.costs.shape != self.effects.shape or self.costs.shape[0] != self.inputSamples.shape[0]:
+            raise ValueError('costs, effects and input_samples should have one row per draw '
+                             '(and costs and effects one column per strategy).')
+
+        # incremental cost and effect of every strategy with respect to the first strategy
+        # (the net monetary benefit is linear in the willingness-to-pay, so a metamodel of these
+        # at every willingness-to-pay value follows from a metamodel of incremental costs and effects)
+        self._incrementals = np.column_stack((self.costs[:, 1:] - self.costs[:, [0]],
+                                              self.effects[:, 1:] - self.effects[:, [0]]))
+
+    @staticmethod
+    def from_psa_results(psa_results, wtp_range=(0, 50000), n_wtp_values=N_WTP_VALUES):
+        """
+        :param psa_results: (PSAClasses.PSAResults) results of a probabilistic sensitivity analysis
+        :return: (ValueOfInformation)
+        """
+        return ValueOfInformation(input_labels=psa_results.inputLabels,
+                                  input_samples=psa_results.inputSamples,
+                                  costs=psa_results.costs,
+                                  effects=psa_results.effects,
+                                  wtp_range=wtp_range, n_wtp_values=n_wtp_values)
+
+    def get_evpi(self):
+        """
+        :return: (numpy.array) expected value of perfect information at each willingness-to-pay value
+            (Monte Carlo noise in the outcomes of draws inflates this estimate)
+        """
+        return self._get_value_of_information(incrementals=self._incrementals)
+
+    def get_evppi(self, inputs, method='spline', n_neighbours=N_NEIGHBOURS):
+        """
+        :param inputs: (list) labels of the inputs of the group (e.g. ['ANTICOAG_STROKE_REDUCTION'])
+        :param method: metamodel of the expected incremental costs and effects given the inputs:
+            'spline' (regression on a tensor product of natural cubic splines of up to 3 inputs,
+            or on additive splines and pairwise interactions of more inputs) or
+            'knn' (average over the nearest draws in the ranks of the inputs; its smoothing bias grows
+            with the number of inputs, so it suits groups of one or two inputs)
+        :param n_neighbours: number of nearest draws averaged by the 'knn' metamodel
+        :return: (numpy.array) expected value of partial perfect information about these inputs
+            at each willingness-to-pay value
+        """
+
+        unknown_inputs = [label for label in inputs if label not in self.inputLabels]
+        if len(unknown_inputs) > 0:
+            raise ValueError('Inputs {} were not sampled.'.format(', '.join(unknown_inputs)))
+
+        # ranks of the inputs of the group scaled to [0, 1] (the metamodels do not depend on
+        # the scale of inputs, and knots at quantiles become evenly spaced)
+        columns = [self.inputLabels.index(label) for label in inputs]
+        ranks = self.inputSamples[:, columns].argsort(axis=0).argsort(axis=0) / (self.inputSamples.shape[0] - 1)
+
+        if method == 'spline':
+            fitted = _get_spline_fit(x=ranks, y=self._incrementals)
+        elif method == 'knn':
+            fitted = _get_nearest_neighbour_fit(x=ranks, y=self._incrementals, n_neighbours=n_neighbours)
+        else:
+            raise ValueError("method should be either 'spline' or 'knn'.")
+
+        return self._get_value_of_information(incrementals=fitted)
+
+    def get_evppi_of_groups(self, groups, method='spline'):
+        """
+        :param groups: (dictionary) labels of the inputs of each group keyed by the name of the group
+        :param method: 'spline' or 'knn' (see get_evppi)
+        :return: (dictionary) EVPPI of each group at each willingness-to-pay value keyed by the name of the group
+        """
+        return {name: self.get_evppi(inputs=inputs, method=method) for name, inputs in groups.items()}
+
+    def plot_curves(self, evppis, title='Expected Value of Information', x_label='Willingness-to-pay per QALY ($)',
+                    y_label='Expected value per patient ($)', figure_size=(6, 5), file_name=None):
+        """ plots the EVPI and the EVPPI of groups of inputs against the willingness-to-pay
+        :param evppis: (dictionary) EVPPI of each group keyed by the name of the group (see get_evppi_of_groups)
+        :param file_name: (string) file name to save the figure as (if None, the figure is displayed)
+        """
+        import matplotlib.pyplot as plt
+        from deampy.plots.plot_support import output_figure
+
+        fig, ax = plt.subplots(figsize=figure_size)
+        ax.set_title(title)
+        ax.set_xlabel(x_label)
+        ax.set_ylabel(y_label)
+
+        ax.plot(self.wtpValues, self.get_evpi(), color='k', linewidth=2, label='EVPI')
+        for name, evppi in evppis.items():
+            ax.plot(self.wtpValues, evppi, label='EVPPI: ' + name)
+
+        ax.legend()
+        ax.set_xlim(self.wtpValues[0], self.wtpValues[-1])
+        ax.set_ylim(bottom=0)
+
+        output_figure(plt=fig, filename=file_name)
+
+    def _get_value_of_information(self, incrementals):
+        """
+        :param incrementals: (numpy.array) (expected) incremental costs of strategies 2, 3, ... followed by their
+            incremental effects with one row per draw
+        :return: (numpy.array) E[max over strategies of the expected net monetary benefit]
+            - max over strategies of E[net monetary benefit] at each willingness-to-pay value
+        """
+
+        n_incrementals = self.costs.shape[1] - 1
+        # incremental net monetary benefit (draws, willingness-to-pay values, strategies 2, 3, ...)
+        nmbs = (self.wtpValues[None, :, None] * incrementals[:, None, n_incrementals:]
+                - incrementals[:, None, :n_incrementals])
+        # the first strategy has an incremental net monetary benefit of 0
+        value_of_optimal = np.maximum(nmbs.max(axis=2), 0).mean(axis=0)
+        optimal_of_values = np.maximum(nmbs.mean(axis=0).max(axis=1), 0)
+
+        return value_of_optimal - optimal_of_values
+
+
+def _get_natural_spline_basis(x, n_knots):
+    """
+    :param x: (numpy.array) values in [0, 1]
+    :param n_knots: number of knots (evenly spaced in [0, 1])
+    :return: (numpy.array) natural cubic spline basis (including the constant) with one row per value
+        and n_knots columns
+    """
+
+    knots = np.linspace(0, 1, n_knots)
+
+    def get_d(k):
+        return (np.maximum(x - knots[k], 0) ** 3 - np.maximum(x - knots[-1], 0) ** 3) / (knots[-1] - knots[k])
+
+    d_last = get_d(n_knots - 2)
+    return np.column_stack([np.ones_like(x), x] + [get_d(k) - d_last for k in range(n_knots - 2)])
+
+
+def _get_spline_fit(x, y):
+    """
+    :param x: (numpy.array) inputs in [0, 1] with one row per draw
+    :param y: (numpy.array) outputs with one row per draw
+    :return: (numpy.array) least-squares fitted outputs on natural cubic splines of the inputs
+    """
+
+    n_inputs = x.shape[1]
+    if n_inputs in N_KNOTS:
+        # tensor product of the spline bases of inputs (includes every lower-order term and interaction)
+        design = np.ones((x.shape[0], 1))
+        for j in range(n_inputs):
+            basis = _get_natural_spline_basis(x=x[:, j], n_knots=N_KNOTS[n_inputs])
+            design = (design[:, :, None] * basis[:, None, :]).reshape(x.shape[0], -1)
+    else:
+        # additive splines of inputs and pairwise interactions of their linear terms
+        terms = [np.ones((x.shape[0], 1))]
+        terms += [_get_natural_spline_basis(x=x[:, j], n_knots=N_KNOTS_ADDITIVE)[:, 1:] for j in range(n_inputs)]
+        rows, cols = np.triu_indices(n_inputs, k=1)
+        terms.append(x[:, rows] * x[:, cols])
+        design = np.column_stack(terms)
+
+    coefficients = np.linalg.lstsq(design, y, rcond=None)[0]
+    return design @ coefficients
+
+
+def _get_nearest_neighbour_fit(x, y, n_neighbours):
+    """
+    :param x: (numpy.array) inputs in [0, 1] with one row per draw
+    :param y: (numpy.array) outputs with one row per draw
+    :param n_neighbours: number of nearest draws to average
+    :return: (numpy.array) average output of the nearest draws (including the draw itself) of each draw
+    """
+
+    n_draws = x.shape[0]
+    n_neighbours = min(n_neighbours, n_draws)
+    fitted = np.empty_like(y)
+    squared_norms = (x ** 2).sum(axis=1)
+
+    for start in range(0, n_draws, NEIGHBOUR_CHUNK_SIZE):
+        chunk = x[start:start + NEIGHBOUR_CHUNK_SIZE]
+        # squared distances from the draws of this chunk to every draw
+        distances = squared_norms[start:start + NEIGHBOUR_CHUNK_SIZE, None] + squared_norms[None, :] \
+            - 2 * chunk @ x.T
+        neighbours = np.argpartition(distances, n_neighbours - 1, axis=1)[:, :n_neighbours]
+        fitted[start:start + NEIGHBOUR_CHUNK_SIZE] = y[neighbours].mean(axis=1)
+
+    return fitted
+
+
+if __name__ == '__main__':
+
+    # check the metamodels against the EVPPI of a model whose expected incremental net monetary benefit
+    # given the input of interest is normally distributed
+    import time
+
+    from scipy.stats import norm
+
+    n_draws = 10000
+    rng = np.random.default_rng(seed=1)
+    theta = rng.normal(size=(n_draws, 3))
+    # incremental effect depends on input 0, incremental cost on input 1 and both have noise
+    d_effects = 0.1 + 0.05 * theta[:, 0] + 0.01 * theta[:, 2] + 0.05 * rng.normal(size=n_draws)
+    d_costs = 2000 + 1000 * theta[:, 1] + 300 * theta[:, 2] + 500 * rng.normal(size=n_draws)
+    voi = ValueOfInformation(input_labels=['effect', 'cost', 'other'],
+                             input_samples=theta,
+                             costs=np.column_stack((np.zeros(n_draws), d_costs)),
+                             effects=np.column_stack((np.zeros(n_draws), d_effects)))
+
+    def get_normal_evppi(means, st_devs):
+        """ E[max(0, X)] - max(0, E[X]) for X ~ N(means, st_devs^2) """
+        z = means / st_devs
+        return st_devs * norm.pdf(z) + means * norm.cdf(z) - np.maximum(means, 0)
+
+    w = voi.wtpValues
+    exact = {('effect',): get_normal_evppi(0.1 * w - 2000, 0.05 * w + 1e-12),
+             ('cost',): get_normal_evppi(0.1 * w - 2000, 1000 * np.ones_like(w)),
+             ('effect', 'cost'): get_normal_evppi(0.1 * w - 2000, np.sqrt((0.05 * w) ** 2 + 1000 ** 2)),
+             ('effect', 'cost', 'other'): get_normal_evppi(
+                 0.1 * w - 2000, np.sqrt((0.05 * w) ** 2 + 1000 ** 2 + (0.01 * w - 300) ** 2))}
+
+    for method in ('spline', 'knn'):
+        for inputs, expected in exact.items():
+            if method == 'knn' and len(inputs) > 2:
+                continue
+            start = time.perf_counter()
+            evppi = voi.get_evppi(inputs=list(inputs), method=method)
+            seconds = time.perf_counter() - start
+            error = np.abs(evppi - expected).max()
+            print('{} EVPPI of {}: largest error {:.1f} (largest EVPPI {:.1f}) in {:.2f} seconds'.format(
+                method, inputs, error, expected.max(), seconds))
+            assert error < 0.1 * expected.max()
+
+    # no EVPPI exceeds the EVPI (which the noise in the outcomes of draws inflates)
+    evpi = voi.get_evpi()
+    assert all(np.all(voi.get_evppi(inputs=list(inputs)) <= evpi + 1e-9) for inputs in exact)
+    print('The metamodel EVPPIs agree with the exact EVPPIs.')